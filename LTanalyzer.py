@@ -1,52 +1,111 @@
 import backtrader as bt
 import numpy as np
 import math
+from trade_ledger import TradeLedger
+from my_data import num_to_datetime
 
 '''
 自定义的，解析长期持仓策略的分析器
 LongTermTradeAnalyzer用于输出单笔交易数据
 CalculateAnalyzer用于计算总收益率、年化收益率、最大回撤、夏普比率
+CalculateMetrics用一个分析器单次遍历计算上述全部指标（以及回撤持续时间），main 中使用这一个
+EquityCurve逐 bar 记录净值，供稳健性分析（robustness.py）等使用
+EarlyStop在回撤或净值越过阈值时提前终止回测，供自适应参数优化淘汰明显失败的参数
 '''
 
 class LongTermTradeAnalyzer(bt.Analyzer):
     def __init__(self):
-        self.trades = []
+        self.ledger = TradeLedger()  # 成交记录按列保存，按日期和订单编号索引
         self.pnl = []  # 存储每笔交易的盈亏
+        self.rejected = 0  # 被拒绝（现金不足等）或取消的订单数，成本模型回放据此判断订单流是否完整
 
     def notify_order(self, order):
         if order.status in [order.Completed]:
-            trade_info = {
-                'date': bt.num2date(order.executed.dt),
-                'price': order.executed.price,
-                'size': order.executed.size,
-                'value': order.executed.value,
-                'pnl': order.executed.pnl,
-                'isbuy': order.isbuy(),
-                'closed': False,
-                'x': order.info.get('x', None),
-                'ema200': order.info.get('ema200', None),
-                'atr': order.info.get('atr', None),
-                'y': order.info.get('y', None),
-                'target_position': order.info.get('target_position', None),
-                'current_position': order.info.get('current_position', None)
-            }
-            self.trades.append(trade_info)
+            self.ledger.append(order.executed.dt, order.executed.price, order.executed.size,
+                               order.executed.value, order.executed.pnl, order.isbuy(),
+                               ref=order.ref, info=order.info)
+        elif order.status in [order.Canceled, order.Margin, order.Rejected]:
+            self.rejected += 1
 
     def notify_trade(self, trade):
         if trade.isclosed:
-            for t in self.trades:
-                if t['date'] == bt.num2date(trade.dtclose):
-                    t['closed'] = True
-                    t['pnl'] = trade.pnl
-                    self.pnl.append(trade.pnl)  # 记录已关闭交易的盈亏
-                    break
+            # 按平仓日期直接定位对应的成交记录，不再遍历全部成交
+            if self.ledger.mark_closed(trade.dtclose, trade.pnl) is not None:
+                self.pnl.append(trade.pnl)  # 记录已关闭交易的盈亏
+
+    @property
+    def trades(self):
+        return self.ledger.to_records()
 
     def get_analysis(self):
         return {
-            'trades': self.trades,
-            'pnl': self.pnl
+            'trades': self.ledger.to_records(),
+            'pnl': self.pnl,
+            'ledger': self.ledger,
+            'rejected': self.rejected
         }
     
+# 逐 bar 记录净值和时间
+class EquityCurve(bt.Analyzer):
+    def __init__(self):
+        self.count = 0
+        self.dts = None  # backtrader 日期数值
+        self.values = None
+
+    def start(self):
+        # 数据已预加载时按 bar 数一次分配好数组，否则从 1024 开始按需翻倍
+        capacity = max(self.strategy.data.buflen(), 1024)
+        self.dts = np.empty(capacity)
+        self.values = np.empty(capacity)
+
+    def next(self):
+        if self.count == len(self.values):
+            self.dts = np.resize(self.dts, 2 * self.count)
+            self.values = np.resize(self.values, 2 * self.count)
+        self.dts[self.count] = self.strategy.data.datetime[0]
+        self.values[self.count] = self.strategy.broker.get_value()
+        self.count += 1
+
+    def get_analysis(self):
+        return {
+            'datetime': num_to_datetime(self.dts[:self.count]),
+            'value': self.values[:self.count]
+        }
+
+# 提前终止：回撤超过 max_drawdown 或净值低于初始资金的 min_equity 倍时停止回测
+class EarlyStop(bt.Analyzer):
+    params = (
+        ('max_drawdown', None),
+        ('min_equity', None),
+    )
+
+    def __init__(self):
+        self.start_value = None
+        self.peak = -math.inf
+        self.bars = 0  # 实际运行的 bar 数
+        self.stopped = False
+
+    def start(self):
+        self.start_value = self.strategy.broker.get_value()
+
+    def next(self):
+        self.bars += 1
+        if self.stopped:
+            return
+        value = self.strategy.broker.get_value()
+        if value > self.peak:
+            self.peak = value
+        if (self.p.max_drawdown is not None and (self.peak - value) / self.peak > self.p.max_drawdown) or \
+                (self.p.min_equity is not None and value < self.start_value * self.p.min_equity):
+            self.stopped = True
+            self.strategy.env.runstop()
+
+    def get_analysis(self):
+        return {
+            'stopped': self.stopped,
+            'bars': self.bars
+        }
+
 # 计算总收益
 class CalculateTotalReturn(bt.Analyzer):
     def __init__(self):
@@ -75,20 +134,27 @@ class CalculateAnnualReturn(bt.Analyzer):
         self.end_value = None
         self.start_date = None
         self.end_date = None
+        self.first_dt = None  # 第一根 bar 的时间（backtrader 日期数值）
+        self.last_dt = None
 
     def start(self):
         if self.start_value is None:
             self.start_value = self.strategy.broker.get_value()
-            if len(self.strategy.data.datetime.array):
-                # 获取初始日期
-                self.start_date = bt.num2date(self.strategy.data.datetime.array[0]).date()
+
+    def next(self):
+        # 自己记录首尾 bar 的时间，不读取 datetime.array（有界内存模式下只保留最近的几根 bar）
+        dt = self.strategy.data.datetime[0]
+        if self.first_dt is None:
+            self.first_dt = dt
+        self.last_dt = dt
 
     def stop(self):
         if self.end_value is None:
             self.end_value = self.strategy.broker.get_value()
-            if len(self.strategy.data.datetime.array):
-                # 获取结束日期
-                self.end_date = bt.num2date(self.strategy.data.datetime.array[-1]).date()
+            if self.first_dt is not None:
+                # 获取初始日期和结束日期
+                self.start_date = bt.num2date(self.first_dt).date()
+                self.end_date = bt.num2date(self.last_dt).date()
 
 
     def get_analysis(self):
@@ -162,4 +228,109 @@ class CalculateSharpeRatio(bt.Analyzer):
         # 计算夏普比率,如果年化波动率不为零，则用年化超额收益率除以年化波动率
         sharpe_ratio = annualized_return / annualized_volatility if annualized_volatility != 0 else 0
         
-        return {'sharpe_ratio': sharpe_ratio}
\ No newline at end of file
+        return {'sharpe_ratio': sharpe_ratio}
+
+
+# 单次遍历计算全部指标：每根 bar 只读取一次净值，回撤、回撤持续时间和收益率的均值/方差（Welford）都在线更新，内存为 O(1)
+class CalculateMetrics(bt.Analyzer):
+    params = (
+        ('risk_free_rate', 0.02),
+    )
+
+    def __init__(self):
+        self.start_value = None
+        self.end_value = None
+        self.first_dt = None  # 第一根 bar 的时间（backtrader 日期数值）
+        self.last_dt = None
+        self.bars = 0
+
+        # 回撤
+        self.peak = -math.inf
+        self.max_drawdown = 0
+        self.drawdown_bars = 0  # 当前回撤已持续的 bar 数
+        self.max_drawdown_bars = 0
+
+        # 每期收益率的均值和平方差累计（Welford）
+        self.prev_value = None
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def start(self):
+        if self.start_value is None:
+            self.start_value = self.strategy.broker.get_value()
+
+    def next(self):
+        value = self.strategy.broker.get_value()
+        dt = self.strategy.data.datetime[0]
+        if self.first_dt is None:
+            self.first_dt = dt
+        self.last_dt = dt
+        self.bars += 1
+
+        if value >= self.peak:
+            self.peak = value
+            self.drawdown_bars = 0
+        else:
+            self.drawdown_bars += 1
+            self.max_drawdown_bars = max(self.max_drawdown_bars, self.drawdown_bars)
+        drawdown = (self.peak - value) / self.peak
+        if drawdown > self.max_drawdown:
+            self.max_drawdown = drawdown
+
+        if self.prev_value is not None:
+            period_return = (value - self.prev_value) / self.prev_value
+            self.count += 1
+            delta = period_return - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (period_return - self.mean)
+        self.prev_value = value
+
+    def stop(self):
+        if self.end_value is None:
+            self.end_value = self.strategy.broker.get_value()
+
+    def get_analysis(self):
+        return summarize_metrics(self.start_value, self.end_value, self.first_dt, self.last_dt,
+                                 self.max_drawdown, self.max_drawdown_bars,
+                                 self.count, self.mean, self.m2, self.params.risk_free_rate)
+
+
+def summarize_metrics(start_value, end_value, first_dt, last_dt, max_drawdown, max_drawdown_bars,
+                      count, mean, m2, risk_free_rate=0.02):
+    '''
+    由累计量计算最终指标（CalculateMetrics 和 fast_engine.analyze_values 共用）
+    first_dt / last_dt 为 backtrader 日期数值
+    '''
+    total_return = (end_value - start_value) / start_value
+
+    # 年化收益率：与 CalculateAnnualReturn 一样按首尾 bar 的日期计算年数
+    if first_dt is not None and last_dt is not None:
+        days = (bt.num2date(last_dt).date() - bt.num2date(first_dt).date()).days
+    else:
+        days = 1
+    years = days / 365.0
+    annual_return = (1 + total_return) ** (1 / years) - 1 if years > 0 else total_return
+
+    # 年化因子：按实际的 bar 间隔估计每年的周期数（已包含休市、周末等空缺），不再固定为 252 * 2
+    elapsed_years = (last_dt - first_dt) / 365.0 if first_dt is not None and last_dt is not None else 0
+    periods_per_year = count / elapsed_years if count and elapsed_years > 0 else 252 * 2
+
+    # 夏普比率：超额收益 = 每期收益率 - 每期无风险利率，平移不改变标准差
+    if count < 2:
+        sharpe_ratio = 0
+    else:
+        annualized_return = (mean - risk_free_rate / periods_per_year) * periods_per_year
+        annualized_volatility = math.sqrt(m2 / count) * math.sqrt(periods_per_year)
+        sharpe_ratio = annualized_return / annualized_volatility if annualized_volatility != 0 else 0
+
+    return {
+        'total_return': total_return,
+        'annual_return': annual_return,
+        'max_drawdown': max_drawdown,
+        'max_drawdown_duration': max_drawdown_bars,
+        'sharpe_ratio': sharpe_ratio,
+        'periods_per_year': periods_per_year,
+        'start_value': start_value,
+        'end_value': end_value
+    }
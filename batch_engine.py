@@ -0,0 +1,248 @@
+import math
+import numpy as np
+import config
+from fast_engine import ATR_PERIOD, vad_bands
+from LTanalyzer import summarize_metrics
+from my_data import datetime_to_num
+
+'''
+批量回测引擎
+一次运行成千上万组 VADStrategy 参数：所有参数组共用同一份价格、ATR 和 VWMA 数组，
+k·ATR 通道和开仓 / 止盈止损信号按 (bar × 参数组) 的二维数组分块计算，
+DCA 状态（现金、持仓、挂单、加仓次数）和指标累计量都是长度为参数组数的向量，逐根 bar 一起推进
+成交规则与 fast_engine.run_vad 相同，指标按 LTanalyzer.CalculateMetrics 的方式在线累计，不保存每根 bar 的净值
+'''
+
+# 每块信号矩阵的最多元素数（bar 数 × 参数组数）
+CHUNK_ELEMENTS = 1 << 20
+
+
+def run_vad_batch(data, k, base_order_amount=config.vad_strategy_params['base_order_amount'],
+                  dca_multiplier=config.vad_strategy_params['dca_multiplier'],
+                  number_of_dca_orders=config.vad_strategy_params['number_of_dca_orders'],
+                  vwma_period=config.indicator_params['vwma_period'],
+                  broker_params=config.broker_params, risk_free_rate=0.02):
+    '''
+    批量运行向量化的 VADStrategy
+    :param data: fast_engine.load_arrays 返回的列数组
+    :param k, base_order_amount, dca_multiplier, number_of_dca_orders: 标量或一维数组，广播成同一长度，每个元素是一组参数
+    :return: 每组参数的指标数组 {'total_return', 'annual_return', 'max_drawdown', 'max_drawdown_duration',
+             'sharpe_ratio', 'periods_per_year', 'start_value', 'end_value', 'buy_count', 'sell_count'}
+    '''
+    k, base_order_amount, dca_multiplier, number_of_dca_orders = np.broadcast_arrays(
+        np.asarray(k, dtype=np.float64), np.asarray(base_order_amount, dtype=np.float64),
+        np.asarray(dca_multiplier, dtype=np.float64), np.asarray(number_of_dca_orders, dtype=np.int64))
+    n_sets = len(k)
+
+    # ATR、VWMA 与 k 无关，只算一次（k 传 0 只取 atr 和 vwma）
+    bands = vad_bands(data, 0.0, vwma_period)
+    atr = bands['atr']
+    vwma = bands['vwma']
+    opens = data['open']
+    highs = data['high']
+    lows = data['low']
+    closes = data['close']
+    n_bars = len(closes)
+
+    start_value = float(broker_params['initial_cash'])
+    commission = broker_params['commission_rate']
+    slippage = broker_params['slippage']
+    minperiod = max(ATR_PERIOD + 1, vwma_period)
+
+    # DCA 状态
+    cash = np.full(n_sets, start_value)
+    pos_size = np.zeros(n_sets)
+    pos_price = np.zeros(n_sets)
+    pending_buy = np.zeros(n_sets, dtype=bool)
+    pending_sell = np.zeros(n_sets, dtype=bool)
+    pending_size = np.zeros(n_sets)
+    pending_price = np.zeros(n_sets)  # 下单时的收盘价
+    total_long_trades = np.zeros(n_sets, dtype=np.int64)
+    last_dca_price = np.zeros(n_sets)
+    buy_count = np.zeros(n_sets, dtype=np.int64)
+    sell_count = np.zeros(n_sets, dtype=np.int64)
+
+    # 指标累计量（同 CalculateMetrics）
+    peak = np.full(n_sets, -math.inf)
+    max_drawdown = np.zeros(n_sets)
+    drawdown_bars = np.zeros(n_sets, dtype=np.int64)
+    max_drawdown_bars = np.zeros(n_sets, dtype=np.int64)
+    prev_value = None
+    count = 0
+    mean = np.zeros(n_sets)
+    m2 = np.zeros(n_sets)
+    values = cash.copy()
+
+    chunk = max(1, CHUNK_ELEMENTS // max(n_sets, 1))
+    for chunk_start in range(0, n_bars, chunk):
+        chunk_end = min(chunk_start + chunk, n_bars)
+        # 本块的 k·ATR 通道和信号矩阵 (bar × 参数组)
+        k_atr = atr[chunk_start:chunk_end, None] * k[None, :]
+        block_close = closes[chunk_start:chunk_end, None]
+        long_block = block_close < vwma[chunk_start:chunk_end, None] - k_atr
+        short_block = block_close > vwma[chunk_start:chunk_end, None] + k_atr
+        any_long = long_block.any(axis=1)
+        any_short = short_block.any(axis=1)
+
+        for row in range(chunk_end - chunk_start):
+            i = chunk_start + row
+
+            # 撮合上一根 bar 下的市价单
+            if pending_buy.any():
+                size = pending_size
+                check_cash = cash - size * pending_price
+                check_cash -= size * commission * pending_price
+                price = min(opens[i] * (1 + slippage), highs[i])
+                new_cash = cash - size * price
+                new_cash -= size * commission * price
+                filled = pending_buy & (check_cash >= 0.0) & (new_cash >= 0.0)
+                new_size = pos_size + size
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    averaged = (pos_price * pos_size + size * price) / new_size
+                pos_price = np.where(filled, np.where(pos_size != 0, averaged, price), pos_price)
+                pos_size = np.where(filled, new_size, pos_size)
+                cash = np.where(filled, new_cash, cash)
+            if pending_sell.any():
+                price = max(opens[i] * (1 - slippage), lows[i])
+                size = pending_size
+                pnl = size * (price - pos_price) * 1.0
+                closed_value = np.abs(-size) * pos_price
+                sold = cash + (closed_value + pnl)
+                sold -= np.abs(-size) * commission * price
+                cash = np.where(pending_sell, sold, cash)
+                pos_price = np.where(pending_sell, 0.0, pos_price)
+                pos_size = np.where(pending_sell, 0.0, pos_size)
+            pending_buy[:] = False
+            pending_sell[:] = False
+
+            values = cash + pos_size * closes[i]
+
+            # 回撤和回撤持续时间
+            new_peak = values >= peak
+            peak = np.where(new_peak, values, peak)
+            drawdown_bars = np.where(new_peak, 0, drawdown_bars + 1)
+            np.maximum(max_drawdown_bars, drawdown_bars, out=max_drawdown_bars)
+            np.maximum(max_drawdown, (peak - values) / peak, out=max_drawdown)
+
+            # 每期收益率的均值和平方差累计（Welford）
+            if prev_value is not None:
+                period_return = (values - prev_value) / prev_value
+                count += 1
+                delta = period_return - mean
+                mean = mean + delta / count
+                m2 = m2 + delta * (period_return - mean)
+            prev_value = values
+
+            if i < minperiod - 1:
+                continue
+            holding = pos_size > 0
+            if not any_long[row] and not (any_short[row] and holding.any()):
+                continue
+
+            close = closes[i]
+            if any_long[row]:
+                long_signal = long_block[row]
+                # 开仓
+                opening = long_signal & (total_long_trades == 0)
+                # 加仓
+                adding = long_signal & (total_long_trades > 0) & (total_long_trades < number_of_dca_orders)
+                last_dca_price = np.where(opening, base_order_amount,
+                                          np.where(adding, last_dca_price * dca_multiplier, last_dca_price))
+                buying = opening | adding
+                pending_buy |= buying
+                pending_size = np.where(buying, last_dca_price / close, pending_size)
+                pending_price[buying] = close
+                total_long_trades += buying
+                buy_count += buying
+
+            # 止盈止损（与 run_vad 一样覆盖同一根 bar 的买单）
+            if any_short[row]:
+                distance = close - pos_price
+                row_k_atr = k_atr[row]
+                selling = holding & short_block[row] & ((distance >= row_k_atr * pos_size)
+                                                        | (distance <= - row_k_atr * pos_size))
+                pending_buy &= ~selling
+                pending_sell |= selling
+                pending_size = np.where(selling, pos_size, pending_size)
+                pending_price[selling] = close
+                sell_count += selling
+
+    dtnum = datetime_to_num(np.asarray(data['datetime']).view(np.int64)) if n_bars else None
+    first_dt = float(dtnum[0]) if dtnum is not None else None
+    last_dt = float(dtnum[-1]) if dtnum is not None else None
+    results = [summarize_metrics(start_value, float(values[j]), first_dt, last_dt, float(max_drawdown[j]),
+                                 int(max_drawdown_bars[j]), count, float(mean[j]), float(m2[j]), risk_free_rate)
+               for j in range(n_sets)]
+    metrics = {key: np.array([result[key] for result in results]) for key in results[0]} if results else {}
+    metrics['buy_count'] = buy_count
+    metrics['sell_count'] = sell_count
+    return metrics
+
+
+def run_grid(data, combos, **kwargs):
+    # 把参数字典列表拆成各参数的数组后批量运行，未给出的参数用 config.vad_strategy_params 的默认值
+    columns = {key: [params.get(key, default) for params in combos]
+               for key, default in config.vad_strategy_params.items()}
+    return run_vad_batch(data, **columns, **kwargs)
+
+
+def verify_against_fast(data_file, n_sets=200, volume=None, seed=0):
+    '''
+    随机抽取 n_sets 组参数，与 fast_engine.run_vad 逐组比较买卖次数和指标
+    :param volume: 给定时把成交量替换为该常数（数据文件没有成交量时 VADStrategy 不会交易）
+    '''
+    import fast_engine
+
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                   todate=config.backtest_params['end_date'])
+    if volume is not None:
+        data['volume'] = np.full(len(data['close']), float(volume))
+    rng = np.random.default_rng(seed)
+    combos = [{'k': float(rng.choice(config.sweep_params['k'])),
+               'base_order_amount': float(rng.choice([50000, 100000, 200000])),
+               'dca_multiplier': float(rng.choice(config.sweep_params['dca_multiplier'])),
+               'number_of_dca_orders': int(rng.choice(config.sweep_params['number_of_dca_orders']))}
+              for _ in range(n_sets)]
+    batch = run_grid(data, combos)
+
+    mismatches = 0
+    for j, params in enumerate(combos):
+        result = fast_engine.run_vad(data, **params)
+        expected = fast_engine.analyze_values(result['values'], data['datetime'], result['start_value'])
+        same = (result['buy_count'], result['sell_count']) == (batch['buy_count'][j], batch['sell_count'][j])
+        for key in ('end_value', 'total_return', 'max_drawdown', 'max_drawdown_duration', 'sharpe_ratio'):
+            same &= bool(np.isclose(expected[key], batch[key][j], rtol=1e-9, atol=1e-12))
+        mismatches += not same
+    print(f'{data_file}：{n_sets} 组参数，{mismatches} 组与 fast_engine 不一致，'
+          f'其中 {int((batch["buy_count"] > 0).sum())} 组有交易')
+    return mismatches == 0
+
+
+if __name__ == '__main__':
+    import time
+    import fast_engine
+    from optimizer import param_grid
+
+    for _, data_file in config.data_files:
+        verify_against_fast(data_file, volume=1)
+
+    # 10000 组参数一次批量运行，与单次 fast_engine / Cerebro 的用时比较
+    name, data_file = config.data_files[0]
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                   todate=config.backtest_params['end_date'])
+    data['volume'] = np.ones(len(data['close']))
+    grid = dict(config.sweep_params, base_order_amount=[50000, 100000, 150000, 200000, 250000,
+                                                       300000, 350000, 400000, 450000, 500000])
+    combos = param_grid(grid)
+    start = time.time()
+    metrics = run_grid(data, combos)
+    batch_elapsed = time.time() - start
+    start = time.time()
+    fast_engine.run_vad(data)
+    fast_elapsed = time.time() - start
+    start = time.time()
+    fast_engine.verify_against_backtrader(data_file, volume=1)
+    cerebro_elapsed = time.time() - start
+    print(f'{name}：{len(combos)} 组参数 × {len(data["close"])} 根 bar 批量运行用时 {batch_elapsed:.1f} 秒，'
+          f'单次 fast_engine {fast_elapsed:.2f} 秒，单次 Cerebro（含校验）{cerebro_elapsed:.2f} 秒，'
+          f'相当于 {batch_elapsed / cerebro_elapsed:.1f} 次 Cerebro 回测')
@@ -0,0 +1,281 @@
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import backtrader as bt
+import numpy as np
+import pandas as pd
+from texttable import Texttable
+import config
+import indicator_cache
+from data_cache import load_columns, read_csv_columns
+from indicators import VWMA, atr_array, vwma_array
+from my_data import MyCSVData, MyArrayData
+from LTanalyzer import (LongTermTradeAnalyzer, CalculateMetrics, CalculateTotalReturn, CalculateAnnualReturn,
+                        CalculateMaxDrawdown, CalculateSharpeRatio)
+
+'''
+性能基准
+对 results/ 中的数据文件和 10 万、100 万根 bar 的合成数据，分别测量每秒处理的 bar 数：
+数据读取（MyCSVData 逐行/向量化、read_csv_columns、列式缓存）、指标计算（numpy 数组版和 backtrader 版）、
+每个分析器（与空策略的运行时间比较）、以及 add_data_and_run_strategy 端到端回测
+结果写入 benchmarks/latest.json，并与 benchmarks/baseline.json 比较，bars/秒 明显下降的项标记为回退
+'''
+
+output_dir = config.benchmark_params['output_dir']
+
+# 分析器基准：(名称, [(分析器类, _name)])，CalculateAnnualReturn 依赖 total_return
+ANALYZERS = [
+    ('LongTermTradeAnalyzer', [(LongTermTradeAnalyzer, 'longterm_trades')]),
+    ('CalculateMetrics', [(CalculateMetrics, 'metrics')]),
+    ('CalculateTotalReturn', [(CalculateTotalReturn, 'total_return')]),
+    ('CalculateAnnualReturn', [(CalculateTotalReturn, 'total_return'), (CalculateAnnualReturn, 'annual_return')]),
+    ('CalculateMaxDrawdown', [(CalculateMaxDrawdown, 'max_drawdown')]),
+    ('CalculateSharpeRatio', [(CalculateSharpeRatio, 'sharpe_ratio')]),
+]
+
+
+class IndicatorStrategy(bt.Strategy):
+    # 只计算 VADStrategy 使用的 backtrader 指标，不交易
+    def __init__(self):
+        self.atr = bt.indicators.ATR(self.data, period=14)
+        self.vwma = VWMA(self.data, period=config.indicator_params['vwma_period'])
+
+
+def synthetic_file(bars, seed=0):
+    '''
+    生成（或复用已生成的）合成数据文件：从回测结束日期往前的连续 1 分钟 bar，价格为随机游走
+    格式与 results/ 中的文件相同，可直接用 MyCSVData 读取
+    '''
+    path = os.path.join(output_dir, 'data', f'synthetic_{bars}.csv')
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(config.backtest_params['end_date'])
+    dt = pd.date_range(end=end, periods=bars, freq='1min')
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, bars)))
+    open_ = np.empty(bars)
+    open_[0] = close[0]
+    open_[1:] = close[:-1]
+    spread = np.abs(rng.normal(0, 0.0005, bars)) * close
+    df = pd.DataFrame({
+        'time': dt.strftime('%Y/%m/%d %H:%M'),
+        'open': open_.round(4),
+        'high': (np.maximum(open_, close) + spread).round(4),
+        'low': (np.minimum(open_, close) - spread).round(4),
+        'close': close.round(4)
+    })
+    tmp = f'{path}.{os.getpid()}.tmp'
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def datasets():
+    # [(名称, 数据文件)]：results/ 中的文件和合成数据
+    items = [(name, data_file) for name, data_file in config.data_files if data_file.endswith('.csv')]
+    items += [(f'synthetic_{bars}', synthetic_file(bars)) for bars in config.benchmark_params['synthetic_sizes']]
+    return items
+
+
+@contextlib.contextmanager
+def backtest_window(columns):
+    # 合成数据不在 config 的回测区间内，运行端到端基准时临时把回测区间设为整个数据集
+    saved = dict(config.backtest_params)
+    dt = pd.to_datetime(columns['datetime'][[0, -1]])
+    config.backtest_params['start_date'] = str(dt[0])
+    config.backtest_params['end_date'] = str(dt[1])
+    try:
+        yield
+    finally:
+        config.backtest_params.update(saved)
+
+
+def _time_best(func, repeat, setup=None):
+    # 运行 repeat 次，返回最快一次的秒数
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _run_cerebro(data, strategy=bt.Strategy, analyzers=()):
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(data)
+    cerebro.addstrategy(strategy)
+    for analyzer, name in analyzers:
+        cerebro.addanalyzer(analyzer, _name=name)
+    return cerebro.run()
+
+
+def benchmark_dataset(name, data_file):
+    '''
+    对单个数据文件运行全部基准
+    :return: [{'dataset', 'benchmark', 'bars', 'seconds', 'bars_per_sec'}]
+    '''
+    from main import add_data_and_run_strategy
+    from strategy import BuyAndHoldStrategy, VADStrategy
+
+    columns, total_lines = read_csv_columns(data_file)
+    bars = len(columns['close'])
+    repeat = max(1, min(config.benchmark_params['repeat'], config.benchmark_params['repeat_bars'] // bars))
+    results = []
+
+    def record(benchmark, func, setup=None, count=bars):
+        seconds = _time_best(func, repeat, setup)
+        results.append({
+            'dataset': name,
+            'benchmark': benchmark,
+            'bars': count,
+            'seconds': seconds,
+            'bars_per_sec': count / seconds if seconds > 0 else float('inf')
+        })
+        print(f'{name} {benchmark}: {count / seconds:,.0f} bars/秒')
+
+    # 数据读取
+    record('load_mycsvdata', lambda: _run_cerebro(MyCSVData(dataname=data_file)))
+    record('load_mycsvdata_vectorized', lambda: _run_cerebro(MyCSVData(dataname=data_file, vectorized=True)))
+    record('load_read_csv_columns', lambda: read_csv_columns(data_file))
+    load_columns(data_file)  # 先建好缓存，测量的是命中缓存时的读取
+    record('load_columns_cache', lambda: np.add.reduce(load_columns(data_file)[0]['close']))
+
+    # 指标
+    volume = np.full(bars, np.nan)
+    vwma_period = config.indicator_params['vwma_period']
+    record('indicator_atr_array', lambda: atr_array(columns['high'], columns['low'], columns['close']))
+    record('indicator_vwma_array', lambda: vwma_array(columns['close'], volume, vwma_period))
+    record('indicator_backtrader', lambda: _run_cerebro(MyArrayData(dataname=columns, total_lines=total_lines),
+                                                         IndicatorStrategy))
+
+    # 分析器：空策略上只挂一个分析器，engine_empty 为不挂分析器的对照
+    record('engine_empty', lambda: _run_cerebro(MyArrayData(dataname=columns, total_lines=total_lines)))
+    for analyzer_name, analyzers in ANALYZERS:
+        record(f'analyzer_{analyzer_name}',
+               lambda analyzers=analyzers: _run_cerebro(MyArrayData(dataname=columns, total_lines=total_lines),
+                                                        analyzers=analyzers))
+
+    # 端到端：与 main 相同的路径（列式缓存 + 回测区间 + 全部分析器）
+    window = backtest_window(columns) if name.startswith('synthetic_') else contextlib.nullcontext()
+    with window:
+        from main import load_data
+        window_bars = len(load_data(data_file)[0]['close'])
+        record('end_to_end_BuyAndHold',
+               lambda: add_data_and_run_strategy(BuyAndHoldStrategy, data_file, name, 'BuyAndHold'),
+               count=window_bars)
+        # 每次运行前清空指标缓存，测量单次回测（而不是参数扫描中命中缓存）的耗时
+        record('end_to_end_VADStrategy',
+               lambda: add_data_and_run_strategy(VADStrategy, data_file, name, 'VADStrategy', printlog=False),
+               setup=indicator_cache.clear, count=window_bars)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'backtrader': bt.__version__,
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(results, baseline, tolerance=config.benchmark_params['tolerance']):
+    '''
+    与基准比较，给每项结果加上 baseline_bars_per_sec、change 和 regression
+    change 为 bars/秒 的相对变化，低于 -tolerance 视为回退
+    :return: 回退的项
+    '''
+    previous = {(item['dataset'], item['benchmark']): item for item in (baseline or {}).get('results', [])}
+    regressions = []
+    for item in results:
+        old = previous.get((item['dataset'], item['benchmark']))
+        if old is None or old['bars'] != item['bars']:
+            # 数据变了（例如合成数据的规模不同）的项不比较
+            item['baseline_bars_per_sec'] = None
+            item['change'] = None
+            item['regression'] = False
+            continue
+        item['baseline_bars_per_sec'] = old['bars_per_sec']
+        item['change'] = item['bars_per_sec'] / old['bars_per_sec'] - 1
+        item['regression'] = item['change'] < -tolerance
+        if item['regression']:
+            regressions.append(item)
+    return regressions
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def print_results(results):
+    table = Texttable(max_width=0)
+    table.set_cols_align(['l', 'l', 'r', 'r', 'r', 'r', 'l'])
+    rows = [['数据', '项目', 'bar 数', 'bars/秒', '基准 bars/秒', '变化', '']]
+    for item in results:
+        change = item.get('change')
+        rows.append([
+            item['dataset'],
+            item['benchmark'],
+            item['bars'],
+            f"{item['bars_per_sec']:,.0f}",
+            f"{item['baseline_bars_per_sec']:,.0f}" if item.get('baseline_bars_per_sec') else '',
+            f'{change * 100:+.1f}%' if change is not None else '',
+            '回退' if item.get('regression') else ''
+        ])
+    table.add_rows(rows)
+    print(table.draw())
+
+
+def run_benchmarks(selected=None):
+    '''
+    运行基准并与 baseline.json 比较
+    :param selected: 只运行名称在其中的数据集，None 表示全部
+    :return: (结果列表, 回退的项)
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for name, data_file in datasets():
+        if selected is None or name in selected:
+            results.extend(benchmark_dataset(name, data_file))
+
+    baseline_path = os.path.join(output_dir, 'baseline.json')
+    baseline = _read_json(baseline_path)
+    regressions = compare(results, baseline)
+
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'environment': environment(), 'results': results}
+    _write_json(os.path.join(output_dir, 'latest.json'), report)
+    if baseline is None or config.benchmark_params['update_baseline']:
+        _write_json(baseline_path, report)
+    elif baseline.get('environment') != report['environment']:
+        print('注意：基准是在不同的环境中测得的，比较结果仅供参考')
+    return results, regressions
+
+
+if __name__ == '__main__':
+    # 可以在命令行指定数据集名称，例如 python benchmark.py synthetic_100000
+    results, regressions = run_benchmarks(sys.argv[1:] or None)
+    print_results(results)
+    if regressions:
+        print(f'{len(regressions)} 项性能回退（低于基准 {config.benchmark_params["tolerance"] * 100:.0f}% 以上）')
+        sys.exit(1)
+    print('没有性能回退')
@@ -0,0 +1,39 @@
+import config
+from profiling import STRATEGY_METHODS, ANALYZER_METHODS, instrument_cerebro
+
+'''
+cerebro 的公共设置
+添加数据、策略、资金、佣金、滑点和分析器后运行回测，main 的各种运行方式共用
+result_store 把本模块的源码计入回测结果的键，这里的设置变化时已保存的结果不再命中
+'''
+
+
+def run_cerebro(cerebro, data, strategy_class, name, analyzers, profiler=None, broker_params=None, **strategy_params):
+    '''
+    :param analyzers: 每项为 (分析器类, _name) 或 (分析器类, _name, 参数字典)
+    :param profiler: profiling.Profiler，传入时给策略、分析器和 cerebro 加上计时
+    :param broker_params: 格式同 config.broker_params，None 表示使用 config 中的资金、佣金和滑点
+    '''
+    broker_params = broker_params or config.broker_params
+    if profiler is not None:
+        strategy_class = profiler.instrument_class(strategy_class, STRATEGY_METHODS)
+        analyzers = [(profiler.instrument_class(item[0], ANALYZER_METHODS),) + tuple(item[1:]) for item in analyzers]
+
+    # 添加数据、策略
+    cerebro.adddata(data, name=name)
+    cerebro.addstrategy(strategy_class, **strategy_params)
+
+    # 添加资金、佣金、滑点
+    cerebro.broker.setcash(broker_params['initial_cash'])
+    cerebro.broker.setcommission(broker_params['commission_rate'])
+    cerebro.broker.set_slippage_perc(broker_params['slippage'])
+
+    # 添加分析器
+    for analyzer, _name, *kwargs in analyzers:
+        cerebro.addanalyzer(analyzer, _name=_name, **(kwargs[0] if kwargs else {}))
+
+    # 运行回测
+    if profiler is not None:
+        instrument_cerebro(profiler, cerebro)
+        return profiler.call('cerebro.run', cerebro.run)
+    return cerebro.run()
@@ -7,8 +7,104 @@ import os
 
 # 获取 results 文件夹中的所有 CSV 文件
 data_dir = 'results'
+# 始终指向 CSV（流式运行、日期索引和有界内存模式都按行读取文本），同名的 .npz 由 data_cache.load_data_file 优先读取
 data_files = [(os.path.splitext(os.path.basename(file))[0], file) for file in glob.glob(os.path.join(data_dir, '*.csv'))]
 
+# 数据格式转换（time_convert.py）
+time_convert_params = {
+    'input_dir': 'original',
+    'output_dir': data_dir,
+    'formats': ['csv'],  # 'csv' 和/或 'npz'
+    'processes': None  # 进程数，None 表示使用全部 CPU 核
+}
+
+# 数据缓存：CSV 第一次读取后转换为二进制列文件，之后直接内存映射读取（默认关闭，开启后写入 cache_dir）
+data_cache_params = {
+    'enabled': False,
+    'cache_dir': 'cache'
+}
+
+# 日期索引（date_index.py）：MyCSVData 设置了 fromdate / todate 时按索引直接 seek 到区间，只解析区间内的行
+# （默认关闭，开启后写入 index_dir）
+date_index_params = {
+    'enabled': False,
+    'index_dir': 'cache/index'
+}
+
+# 流式运行（streaming.py）：检查点目录
+streaming_params = {
+    'checkpoint_dir': 'checkpoints'
+}
+
+# 多周期重采样（resample.py）：只读取最细周期的数据文件，其他周期在内存中聚合得到
+resample_params = {
+    'enabled': False,  # 为 True 时 main 用 base_file 及其重采样结果代替 data_files
+    'base_file': os.path.join(data_dir, 'BATS_QQQ, 5.csv'),
+    'timeframes': ['15min', '60min', '4h', '1D'],  # 不短于交易时段的周期（如 1D）每个时段聚合为一根 bar
+    'session_gap': '2h',  # 相邻 bar 间隔超过该值视为新的交易时段
+    'maxsize': 16  # 内存中最多缓存的重采样结果个数
+}
+
+# 交易记录导出：CSV 之外是否同时写入二进制列式文件（.npz）
+trade_log_params = {
+    'npz': False
+}
+
+# 有界内存模式：MyCSVData 逐行读取、cerebro 以 exactbars 运行，数据和指标只保留回看窗口（ATR(14)、vwma_period 等）所需的 bar，
+# 多年的 1 分钟数据也以常数内存运行；不记录逐 bar 净值曲线（不绘图），不使用结果库
+bounded_memory_params = {
+    'enabled': False,
+    'exactbars': 1  # backtrader 的 exactbars：1 为最小缓冲（-1、-2 保留部分指标 / 观察器的完整数据）
+}
+
+# 回测结果库（result_store.py）：数据、参数、broker 设置和策略源码都没有变化时直接取回已保存的结果
+# （默认关闭，开启后 main 和参数扫描读写 path 中的 SQLite 文件）
+result_store_params = {
+    'enabled': False,
+    'path': 'cache/results.sqlite'
+}
+
+# 绘图（visual.py）：main 运行结束后为每个策略绘制与 BuyAndHold 比较的净值曲线和买卖点
+plot_params = {
+    'enabled': False,
+    'max_points': 2000,  # 每条净值曲线 LTTB 降采样后的最多点数
+    'include_plotlyjs': 'cdn'  # 'cdn' 时 HTML 引用在线的 plotly.js，True 时内嵌（离线可用，但每个文件多约 4 MB）
+}
+
+# 稳健性分析（robustness.py）：对交易盈亏和逐 bar 收益率做蒙特卡洛 / 块 bootstrap 模拟
+robustness_params = {
+    'simulations': 10000,
+    'block_length': 78,  # 块 bootstrap 的块长（bar 数），78 约为 5 分钟数据的一个交易日
+    'batch_size': 250,  # 每批同时模拟的路径数，限制内存占用
+    'seed': 42,
+    'percentiles': [5, 25, 50, 75, 95]
+}
+
+# 多标的组合回测（portfolio.py）：所有标的共用一个资金池
+portfolio_params = {
+    'data_files': data_files,  # [(标的名称, 数据文件)]
+    'strategies': ['BuyAndHold', 'VADStrategy'],  # BuyAndHold 把初始资金平均分给每个标的
+    'scaling_symbols': [10, 100, 300],  # python portfolio.py 检查规模扩展时的合成标的数
+    'scaling_bars': 5000
+}
+
+# 热点分析（profiling.py）：开启后 add_data_and_run_strategy 给策略、分析器、broker 和数据读取计时
+profiling_params = {
+    'enabled': False,
+    'output_dir': 'profiles',  # 导出 JSON 和火焰图 folded 文件的目录
+    'print_summary': True  # 是否打印汇总表
+}
+
+# 性能基准（benchmark.py）
+benchmark_params = {
+    'output_dir': 'benchmarks',  # 合成数据、本次结果 latest.json 和基准 baseline.json 所在目录
+    'synthetic_sizes': [100000, 1000000],  # 合成数据集的 bar 数
+    'repeat': 3,  # 每项重复次数，取最快一次
+    'repeat_bars': 300000,  # 数据集较大时减少重复次数：重复次数 * bar 数不超过该值（至少 1 次）
+    'tolerance': 0.15,  # bars/秒 比基准低出该比例视为性能回退
+    'update_baseline': False  # True 时用本次结果覆盖基准（没有基准时总是写入）
+}
+
 # 回测时间参数
 backtest_params = {
     'start_date': '2023-6-30',
@@ -40,6 +136,49 @@ vad_strategy_params = {
     'number_of_dca_orders': 4
 }
 
+# 参数扫描（optimizer.py）：每个参数的取值列表，做笛卡尔积
+sweep_params = {
+    'k': [0.8, 1.0, 1.2, 1.4, 1.6, 1.8, 2.0, 2.2, 2.4, 2.6],
+    'dca_multiplier': [1.0, 1.2, 1.4, 1.6, 1.8, 2.0, 2.2, 2.4, 2.6, 2.8],
+    'number_of_dca_orders': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+}
+
+# 参数扫描设置
+sweep_settings = {
+    'engine': 'backtrader',  # 'backtrader' 用 Cerebro 和 LTanalyzer 分析器，'fast' 用向量化引擎 fast_engine，'batch' 用批量引擎 batch_engine 一次算完整个网格
+    'processes': None,  # 进程数，None 表示使用全部 CPU 核
+    'sort_by': 'sharpe_ratio',  # 排名依据
+    'top_n': 20,  # 打印前多少名
+    'method': 'grid'  # 'grid' 回测全部组合，'halving' 自适应（successive halving，见 halving_params）
+}
+
+# 自适应参数优化（successive halving）：每一轮只用回测区间的前一部分评估候选参数，保留最好的 1/eta 进入下一轮，
+# 下一轮的数据长度乘以 eta，直到用完整区间；回撤或净值越过阈值的回测提前终止并淘汰
+halving_params = {
+    'eta': 3,
+    'min_fraction': 1 / 9,  # 第一轮使用的数据比例
+    'candidates': None,  # 第一轮从 sweep_params 中随机抽取的组合数，None 表示全部组合
+    'seed': 42,
+    'stop_drawdown': 0.5,  # 回撤超过 50% 时提前终止，None 表示不检查
+    'stop_equity': None  # 净值低于初始资金的该倍数时提前终止，None 表示不检查
+}
+
+# 成本模型回放（cost_replay.py）：佣金率和滑点的取值列表，做笛卡尔积，每个组合是一个成本模型
+cost_replay_params = {
+    'commission_rate': [0, 1/10000, 3/10000, 5/10000, 10/10000],
+    'slippage': [0, 5/10000, 1/1000, 2/1000]
+}
+
+# 滚动前推优化（walk_forward.py）：训练窗口上用 sweep_params 选参数，紧随其后的测试窗口上评估
+walk_forward_params = {
+    'train_months': 6,
+    'test_months': 2,
+    'step_months': None,  # 相邻窗口的间隔，None 表示等于 test_months
+    'engine': 'fast',  # 每个窗口要跑完整个参数网格，默认用向量化引擎；'backtrader' 结果相同但慢得多
+    'processes': None,  # 进程数，None 表示使用全部 CPU 核
+    'sort_by': 'sharpe_ratio'  # 训练窗口上选参数的依据
+}
+
 
 '''
 指标 Indicator 参数设置
@@ -47,4 +186,21 @@ vad_strategy_params = {
 # VWMA
 indicator_params = {
     'vwma_period': 14
+}
+
+# 指标预计算缓存：同一数据集、同一指标和周期只计算一次
+indicator_cache_params = {
+    'enabled': True,
+    'maxsize': 64,  # 内存中最多保存的指标数组个数（LRU）
+    'disk': False,  # 是否同时写入磁盘，供其他进程和之后的运行复用
+    'cache_dir': 'cache/indicators'
+}
+
+# 共享内存数据集（shared_data.py）：进程池运行前把每个数据文件回测区间的列数组和下列指标放入共享内存一次，
+# 工作进程只读挂载，不再各自读取、解析数据文件
+shared_data_params = {
+    'enabled': True,
+    # (indicator_cache 中的指标名, 周期)：VADStrategy 的 ATR、VWMA 和 AR_Strategy 的 EMA、ATR
+    'indicators': [('atr', 14), ('vwma', indicator_params['vwma_period']),
+                   ('ema', atr_regression_params['ema_period']), ('atr', atr_regression_params['atr_period'])]
 }
\ No newline at end of file
@@ -0,0 +1,245 @@
+import itertools
+import numpy as np
+import pandas as pd
+import config
+from fast_engine import ATR_PERIOD, analyze_values, vad_bands
+
+'''
+成本模型回放
+策略的下单时机和数量大多与佣金、滑点无关，换一组成本参数不必重跑整个回测：
+先按 config.broker_params 正常回测一次，取 LongTermTradeAnalyzer 记录的订单流（成交 bar、数量），
+再对一组成本模型（佣金率、滑点的向量）一次重算成交价、现金、持仓成本、盈亏和每根 bar 的净值
+以下情况成本会改变下单数量或现金约束，对应的成本模型改为完整重跑：
+  下单数量按扣除成本后的现金计算的策略（COST_DEPENDENT_SIZING）
+  原回测中有被拒绝的订单（成本更低时可能成交）
+  某个成本模型下买单的现金检查不通过（该成本下会被拒绝）
+  决策依赖持仓成本的策略（DECISION_CHECKS，如 VADStrategy 的止盈止损），成本改变了触发卖出的 bar
+'''
+
+# 下单数量按扣除佣金、滑点后的现金计算的策略，换成本参数只能完整重跑
+COST_DEPENDENT_SIZING = ('BuyAndHoldStrategy',)
+
+
+def cost_models(grid=config.cost_replay_params):
+    # 佣金率和滑点的取值做笛卡尔积，返回 (佣金率数组, 滑点数组)
+    pairs = list(itertools.product(grid['commission_rate'], grid['slippage']))
+    return np.array([pair[0] for pair in pairs], dtype=np.float64), np.array([pair[1] for pair in pairs], dtype=np.float64)
+
+
+def order_stream(ledger, columns):
+    '''
+    从交易台账得到订单流
+    :return: (每笔成交所在 bar 的下标, 带符号的成交数量（卖出为负）)；市价单在下单 bar 的下一根 bar 成交
+    '''
+    fills = ledger.columns()
+    dt = np.asarray(columns['datetime']).view(np.int64)
+    dates = fills['date'].view(np.int64)
+    # 台账日期由 backtrader 日期数值换算而来，允许 1 秒以内的误差
+    bars = np.minimum(np.searchsorted(dt, dates - 10 ** 9, side='left'), len(dt) - 1)
+    if len(dates) and np.abs(dt[bars] - dates).max() >= 10 ** 9:
+        raise ValueError('交易台账中的成交日期不在数据中')
+    return bars, fills['size'].copy()
+
+
+def replay_fills(columns, bars, sizes, commission, slippage, initial_cash=config.broker_params['initial_cash']):
+    '''
+    在一组成本模型下重放订单流，成交规则与 backtrader 的 BackBroker 一致（同 fast_engine.run_vad）
+    :param commission, slippage: 长度相同的数组，每个元素是一个成本模型
+    :return: {'values': 净值 (bar × 成本模型), 'price': 成交价 (成交 × 成本模型), 'pnl': 每笔卖出的盈亏 (成交 × 成本模型),
+              'position': 每根 bar 的持仓数量, 'position_price': 每笔成交后的持仓成本 (成交 × 成本模型),
+              'feasible': 每个成本模型下所有买单是否都能通过现金检查, 'supported': 订单流是否只有多头的开仓、加仓和减仓}
+    '''
+    opens, highs, lows, closes = columns['open'], columns['high'], columns['low'], columns['close']
+    n_models = len(commission)
+    n_fills = len(bars)
+
+    cash = np.full(n_models, float(initial_cash))
+    pos_size = 0.0
+    pos_price = np.zeros(n_models)
+    feasible = np.ones(n_models, dtype=bool)
+    supported = True
+    cash_after = np.empty((n_fills, n_models))
+    price_after = np.empty((n_fills, n_models))
+    fill_price = np.empty((n_fills, n_models))
+    pnl = np.zeros((n_fills, n_models))
+    position_after = np.empty(n_fills)
+
+    for f in range(n_fills):
+        i = bars[f]
+        size = sizes[f]
+        if size > 0:
+            # 提交检查：按下单 bar 的收盘价预估现金
+            created_price = closes[i - 1]
+            check_cash = cash - size * created_price
+            check_cash -= size * commission * created_price
+            price = np.minimum(opens[i] * (1 + slippage), highs[i])
+            new_cash = cash - size * price
+            new_cash -= size * commission * price
+            feasible &= (check_cash >= 0.0) & (new_cash >= 0.0)
+            new_size = pos_size + size
+            pos_price = price if not pos_size else (pos_price * pos_size + size * price) / new_size
+            pos_size = new_size
+            cash = new_cash
+        else:
+            if -size > pos_size * (1 + 1e-9):
+                # 卖出后转为空头，不在回放支持的范围内
+                supported = False
+            price = np.maximum(opens[i] * (1 - slippage), lows[i])
+            closed = -size
+            pnl[f] = closed * (price - pos_price) * 1.0
+            closed_value = closed * pos_price
+            cash = cash + (closed_value + pnl[f])
+            cash -= closed * commission * price
+            pos_size += size
+            if abs(pos_size) <= 1e-12 * max(closed, 1.0):
+                pos_size = 0.0
+                pos_price = np.zeros(n_models)
+        cash_after[f] = cash
+        price_after[f] = pos_price
+        fill_price[f] = price
+        position_after[f] = pos_size
+
+    # 每根 bar 的现金和持仓取该 bar 及之前最后一笔成交之后的值
+    steps = np.searchsorted(bars, np.arange(len(closes)), side='right')
+    cash_path = np.vstack([np.full((1, n_models), float(initial_cash)), cash_after])[steps]
+    position = np.concatenate([[0.0], position_after])[steps]
+    return {
+        'values': cash_path + position[:, None] * closes[:, None],
+        'price': fill_price,
+        'pnl': pnl,
+        'position': position,
+        'position_price': price_after,
+        'steps': steps,
+        'feasible': feasible,
+        'supported': supported
+    }
+
+
+def _vad_decisions(strat, columns, replay):
+    '''
+    VADStrategy 的止盈止损比较收盘价与持仓成本，成交价随滑点、佣金变化时触发卖出的 bar 可能改变
+    :return: 每个成本模型的卖出触发与第 0 个（原回测的成本）是否完全相同
+    '''
+    closes = columns['close']
+    if 'volume' not in columns:
+        columns = dict(columns, volume=np.full(len(closes), np.nan))
+    bands = vad_bands(columns, strat.p.k)
+    minperiod = max(ATR_PERIOD + 1, config.indicator_params['vwma_period'])
+    position = replay['position']
+    candidates = np.flatnonzero((np.arange(len(closes)) >= minperiod - 1) & (closes > bands['upper']) & (position > 0))
+    if not len(candidates):
+        return np.ones(replay['values'].shape[1], dtype=bool)
+
+    position_price = np.vstack([np.zeros((1, replay['values'].shape[1])), replay['position_price']])
+    distance = closes[candidates, None] - position_price[replay['steps'][candidates]]
+    threshold = (bands['k_atr'][candidates] * position[candidates])[:, None]
+    triggers = (distance >= threshold) | (distance <= -threshold)
+    return (triggers == triggers[:, :1]).all(axis=0)
+
+
+# 决策（下单时机）依赖持仓成本的策略：按策略类名检查每个成本模型下的决策是否与原回测相同
+DECISION_CHECKS = {
+    'VADStrategy': _vad_decisions
+}
+
+
+def replay_costs(strategy_class, columns, total_lines, name, commission=None, slippage=None, **strategy_params):
+    '''
+    在一组成本模型下评估策略：能回放的一次向量化重算，不能回放的完整重跑
+    :param commission, slippage: 成本模型的佣金率和滑点数组，默认取 cost_models()
+    :return: (每个成本模型一行的 DataFrame：commission_rate、slippage、method（replay / full）和各项指标,
+              净值矩阵 (bar × 成本模型))
+    '''
+    from main import run_strategy, collect_metrics
+
+    if commission is None or slippage is None:
+        commission, slippage = cost_models()
+    commission = np.asarray(commission, dtype=np.float64)
+    slippage = np.asarray(slippage, dtype=np.float64)
+    initial_cash = config.broker_params['initial_cash']
+
+    # 按 config.broker_params 正常回测一次，记录订单流
+    strat = run_strategy(strategy_class, columns, total_lines, name, **strategy_params)[0]
+    trades = strat.analyzers.longterm_trades.get_analysis()
+    bars, sizes = order_stream(trades['ledger'], columns)
+
+    # 第 0 个成本模型为原回测的成本，用于校验回放与原回测一致
+    base_commission = np.concatenate([[config.broker_params['commission_rate']], commission])
+    base_slippage = np.concatenate([[config.broker_params['slippage']], slippage])
+    replay = replay_fills(columns, bars, sizes, base_commission, base_slippage, initial_cash)
+
+    valid = replay['feasible'].copy()
+    ledger_prices = trades['ledger'].columns()['price']
+    base_matches = replay['supported'] and np.allclose(replay['price'][:, 0], ledger_prices, rtol=1e-12) and \
+        np.allclose(replay['values'][:, 0], strat.analyzers.equity.get_analysis()['value'], rtol=1e-12)
+    if strategy_class.__name__ in COST_DEPENDENT_SIZING or trades['rejected'] or not base_matches:
+        valid[:] = False
+    elif strategy_class.__name__ in DECISION_CHECKS:
+        valid &= DECISION_CHECKS[strategy_class.__name__](strat, columns, replay)
+    valid = valid[1:]
+
+    dts = np.asarray(columns['datetime']).view('datetime64[ns]')
+    values = replay['values'][:, 1:].copy()
+    rows = []
+    for m in range(len(commission)):
+        if valid[m]:
+            metrics = analyze_values(values[:, m], dts, initial_cash)
+            metrics['trade_count'] = strat.buy_count + strat.sell_count
+            method = 'replay'
+        else:
+            broker_params = dict(config.broker_params, commission_rate=commission[m], slippage=slippage[m])
+            full = run_strategy(strategy_class, columns, total_lines, name, broker_params=broker_params,
+                                **strategy_params)[0]
+            metrics = collect_metrics(full)
+            values[:, m] = full.analyzers.equity.get_analysis()['value']
+            method = 'full'
+        row = {'commission_rate': commission[m], 'slippage': slippage[m], 'method': method}
+        row.update(metrics)
+        rows.append(row)
+    return pd.DataFrame(rows), values
+
+
+def verify_against_full(strategy_class, columns, total_lines, name, **strategy_params):
+    '''
+    每个成本模型都完整重跑一次，与 replay_costs 的结果比较，并比较两者的用时
+    :return: {'max_error': 回放的净值与完整重跑的最大相对误差, 'trades_match': 交易次数是否都一致,
+              'replayed': 回放（没有完整重跑）的成本模型个数}
+    '''
+    import time
+    from main import run_strategy, collect_metrics
+
+    commission, slippage = cost_models()
+    start = time.time()
+    df, values = replay_costs(strategy_class, columns, total_lines, name, commission, slippage, **strategy_params)
+    replay_elapsed = time.time() - start
+
+    start = time.time()
+    max_error = 0.0
+    trades_match = True
+    for m in range(len(commission)):
+        broker_params = dict(config.broker_params, commission_rate=commission[m], slippage=slippage[m])
+        full = run_strategy(strategy_class, columns, total_lines, name, broker_params=broker_params,
+                            **strategy_params)[0]
+        expected = full.analyzers.equity.get_analysis()['value']
+        max_error = max(max_error, float(np.max(np.abs(values[:, m] - expected) / expected)))
+        trades_match &= collect_metrics(full)['trade_count'] == df['trade_count'][m]
+    full_elapsed = time.time() - start
+
+    replayed = int((df['method'] == 'replay').sum())
+    print(f'{name} {strategy_class.__name__}：{len(df)} 个成本模型，回放 {replayed} 个，完整重跑 {len(df) - replayed} 个，'
+          f'用时 {replay_elapsed:.1f} 秒（逐个完整重跑 {full_elapsed:.1f} 秒）；'
+          f'净值最大相对误差 {max_error:.1e}，交易次数{"一致" if trades_match else "不一致"}')
+    return {'max_error': max_error, 'trades_match': bool(trades_match), 'replayed': replayed}
+
+
+if __name__ == '__main__':
+    from main import load_data
+    from strategy import VADStrategy, AR_Strategy, BuyAndHoldStrategy
+
+    name, data_file = config.data_files[0]
+    columns, total_lines = load_data(data_file)
+    verify_against_full(AR_Strategy, columns, total_lines, name)
+    verify_against_full(BuyAndHoldStrategy, columns, total_lines, name)
+    # 数据文件没有成交量时 VADStrategy 不会交易，成交量取 1 检查止盈止损的回退判断
+    columns = dict(columns, volume=np.ones(len(columns['close'])))
+    verify_against_full(VADStrategy, columns, total_lines, name, printlog=False)
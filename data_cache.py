@@ -0,0 +1,155 @@
+import hashlib
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+import config
+
+'''
+数据文件的二进制列式缓存
+第一次读取 CSV 时把 datetime（int64 纳秒）和 open/high/low/close（float64）分别保存为 .npy 列文件，
+之后的回测直接以内存映射方式读取，不再做文本解析
+源文件的大小或修改时间变化时校验内容哈希，内容确实变化则重建缓存
+'''
+
+COLUMNS = ['datetime', 'open', 'high', 'low', 'close']
+
+
+def count_lines(raw):
+    # 与 sum(1 for line in f) 一致：最后一行没有换行符时也算一行
+    lines = raw.count(b'\n')
+    if raw and not raw.endswith(b'\n'):
+        lines += 1
+    return lines
+
+
+def read_csv_columns(data_file, dtformat='%Y/%m/%d %H:%M', raw=None, headers=True, separator=',',
+                     datetime=0, open=1, high=2, low=3, close=4):
+    '''
+    一次读入数据文件并向量化解析，返回 (列数组字典, 文件总行数)
+    列的位置参数与 MyCSVData 的参数一致，总行数与逐行计数的结果相同（含表头）
+    '''
+    if raw is None:
+        with io.open(data_file, 'rb') as f:
+            raw = f.read()
+
+    df = pd.read_csv(io.BytesIO(raw), sep=separator, header=0 if headers else None)
+    dt = pd.to_datetime(df.iloc[:, datetime], format=dtformat)
+    columns = {
+        'datetime': dt.to_numpy(dtype='datetime64[ns]').view(np.int64),
+        'open': df.iloc[:, open].to_numpy(dtype=np.float64),
+        'high': df.iloc[:, high].to_numpy(dtype=np.float64),
+        'low': df.iloc[:, low].to_numpy(dtype=np.float64),
+        'close': df.iloc[:, close].to_numpy(dtype=np.float64)
+    }
+    return columns, count_lines(raw)
+
+
+def cache_path(data_file, cache_dir=config.data_cache_params['cache_dir']):
+    # 每个数据文件一个缓存目录，用绝对路径的哈希区分同名文件
+    base = os.path.splitext(os.path.basename(data_file))[0]
+    digest = hashlib.sha1(os.path.abspath(data_file).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(cache_dir, f'{base}-{digest}')
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, name, writer):
+    # 先写临时文件再替换，多个进程同时重建缓存时不会读到写了一半的文件
+    tmp = os.path.join(path, f'.{name}.{os.getpid()}.tmp')
+    with open(tmp, 'wb') as f:
+        writer(f)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def build_cache(data_file, cache_dir=config.data_cache_params['cache_dir'], dtformat='%Y/%m/%d %H:%M'):
+    # 解析 CSV 并写入列式缓存，返回元信息
+    path = cache_path(data_file, cache_dir)
+    os.makedirs(path, exist_ok=True)
+
+    stat = os.stat(data_file)
+    with open(data_file, 'rb') as f:
+        raw = f.read()
+    columns, total_lines = read_csv_columns(data_file, dtformat=dtformat, raw=raw)
+
+    for name in COLUMNS:
+        _write_atomic(path, f'{name}.npy', lambda f, name=name: np.save(f, columns[name]))
+
+    meta = {
+        'source': os.path.abspath(data_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': hashlib.sha1(raw).hexdigest(),
+        'dtformat': dtformat,
+        'rows': len(columns['close']),
+        'total_lines': total_lines
+    }
+    # 元信息最后写入，作为缓存完整可用的标志
+    _write_atomic(path, 'meta.json', lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+    return meta
+
+
+def _file_sha1(data_file):
+    with open(data_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_columns(data_file, cache_dir=config.data_cache_params['cache_dir'], dtformat='%Y/%m/%d %H:%M'):
+    '''
+    从缓存读取数据文件的列数组，缓存不存在或已过期时先重建
+    :return: (列数组字典（只读内存映射）, 文件总行数)
+    '''
+    path = cache_path(data_file, cache_dir)
+    meta = _read_meta(path)
+    stat = os.stat(data_file)
+
+    if meta is None or meta.get('dtformat') != dtformat or meta['size'] != stat.st_size:
+        meta = build_cache(data_file, cache_dir, dtformat)
+    elif meta['mtime_ns'] != stat.st_mtime_ns:
+        # 修改时间变了但内容可能没变（例如重新拷贝），比较内容哈希
+        if _file_sha1(data_file) == meta['sha1']:
+            meta['mtime_ns'] = stat.st_mtime_ns
+            _write_atomic(path, 'meta.json', lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+        else:
+            meta = build_cache(data_file, cache_dir, dtformat)
+
+    columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+    return columns, meta['total_lines']
+
+
+def load_npz(data_file):
+    '''
+    读取 time_convert 输出的二进制列式文件（datetime 为 int64 纳秒），不做任何文本解析
+    :return: (列数组字典, 总行数)，总行数与同样内容的 CSV 文件一致（含表头）
+    '''
+    with np.load(data_file) as npz:
+        columns = {name: npz[name] for name in COLUMNS}
+        total_lines = int(npz['total_lines']) if 'total_lines' in npz else len(columns['close']) + 1
+    return columns, total_lines
+
+
+def npz_sibling(data_file):
+    # CSV 旁边 time_convert 输出的同名 .npz，存在且不早于 CSV 时返回其路径，否则返回 None
+    path = os.path.splitext(data_file)[0] + '.npz'
+    if path != data_file and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(data_file):
+        return path
+    return None
+
+
+def load_data_file(data_file):
+    # 按文件类型读取：.npz 直接读取列数组；CSV 旁边有同名的 .npz 时改读 .npz，否则优先使用列式缓存
+    if data_file.endswith('.npz'):
+        return load_npz(data_file)
+    sibling = npz_sibling(data_file)
+    if sibling is not None:
+        return load_npz(sibling)
+    if config.data_cache_params['enabled']:
+        return load_columns(data_file)
+    return read_csv_columns(data_file)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import config
+from data_cache import read_csv_columns
+
+'''
+数据文件的日期索引
+每个数据文件建立一次 时间 -> 字节偏移 / 行号 的索引（保存在 config.date_index_params['index_dir']），源文件变化时重建
+MyCSVData 按 fromdate / todate 在索引中二分查找，直接 seek 到区间的第一行、读到区间最后一行就停止，
+不再逐行 strptime 解析区间之外的数据；total_lines 也取自索引，不再逐行计数
+'''
+
+
+def index_path(data_file, index_dir=config.date_index_params['index_dir']):
+    # 用绝对路径的哈希区分同名文件
+    base = os.path.splitext(os.path.basename(data_file))[0]
+    digest = hashlib.sha1(os.path.abspath(data_file).encode('utf-8')).hexdigest()[:10]
+    return os.path.join(index_dir, f'{base}-{digest}.npz')
+
+
+def build_index(data_file, dtformat='%Y/%m/%d %H:%M', index_dir=config.date_index_params['index_dir']):
+    '''
+    读取整个文件建立索引并写入磁盘
+    :return: 索引字典：datetime（每个数据行的 int64 纳秒）、offset（每个数据行起始的字节偏移，末尾多一个文件长度）、meta
+    '''
+    stat = os.stat(data_file)
+    with open(data_file, 'rb') as f:
+        raw = f.read()
+    columns, total_lines = read_csv_columns(data_file, dtformat=dtformat, raw=raw)
+
+    # 每一行的起止位置，跳过空行（read_csv 同样跳过），第一行为表头
+    buffer = np.frombuffer(raw, dtype=np.uint8)
+    ends = np.flatnonzero(buffer == ord('\n'))
+    starts = np.concatenate(([0], ends + 1))
+    ends = np.concatenate((ends, [len(raw)]))
+    content = ends - starts - (buffer[np.maximum(ends - 1, 0)] == ord('\r')) > 0
+    starts = starts[content][1:]
+    if len(starts) != len(columns['datetime']):
+        raise ValueError(f'{data_file} 的行数与解析出的 bar 数不一致，无法建立索引')
+
+    meta = {
+        'source': os.path.abspath(data_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': hashlib.sha1(raw).hexdigest(),
+        'dtformat': dtformat,
+        'total_lines': total_lines
+    }
+    index = {
+        'datetime': columns['datetime'],
+        'offset': np.append(starts, len(raw)).astype(np.int64),
+        'meta': meta
+    }
+
+    path = index_path(data_file, index_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, datetime=index['datetime'], offset=index['offset'], meta=json.dumps(meta))
+    os.replace(tmp, path)
+    return index
+
+
+def _read_index(path):
+    try:
+        with np.load(path) as npz:
+            return {'datetime': npz['datetime'], 'offset': npz['offset'], 'meta': json.loads(str(npz['meta']))}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_index(data_file, dtformat='%Y/%m/%d %H:%M', index_dir=config.date_index_params['index_dir']):
+    # 读取索引，不存在或源文件已变化时重建（修改时间变了但内容相同时只更新元信息）
+    index = _read_index(index_path(data_file, index_dir))
+    stat = os.stat(data_file)
+    if index is None or index['meta']['dtformat'] != dtformat or index['meta']['size'] != stat.st_size:
+        return build_index(data_file, dtformat, index_dir)
+    if index['meta']['mtime_ns'] != stat.st_mtime_ns:
+        with open(data_file, 'rb') as f:
+            if hashlib.sha1(f.read()).hexdigest() != index['meta']['sha1']:
+                return build_index(data_file, dtformat, index_dir)
+        index['meta']['mtime_ns'] = stat.st_mtime_ns
+        path = index_path(data_file, index_dir)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, datetime=index['datetime'], offset=index['offset'], meta=json.dumps(index['meta']))
+        os.replace(tmp, path)
+    return index
+
+
+def lookup(data_file, fromdate=None, todate=None, dtformat='%Y/%m/%d %H:%M'):
+    '''
+    查找 [fromdate, todate] 区间（两端都包含，与 backtrader 的过滤一致）
+    :return: {'start_offset', 'end_offset', 'start_row', 'rows', 'total_lines'}，
+             start_row 为区间第一行在数据行中的序号（不含表头），rows 为区间内的行数
+    '''
+    index = load_index(data_file, dtformat)
+    dt = index['datetime']
+    start = 0 if fromdate is None else int(np.searchsorted(dt, pd.Timestamp(fromdate).as_unit('ns').value, side='left'))
+    end = len(dt) if todate is None else int(np.searchsorted(dt, pd.Timestamp(todate).as_unit('ns').value, side='right'))
+    end = max(start, end)
+    return {
+        'start_offset': int(index['offset'][start]),
+        'end_offset': int(index['offset'][end]),
+        'start_row': start,
+        'rows': end - start,
+        'total_lines': index['meta']['total_lines']
+    }
@@ -0,0 +1,344 @@
+import math
+import numpy as np
+import pandas as pd
+import config
+from indicators import atr_array, vwma_array
+from data_cache import load_data_file
+import indicator_cache
+from my_data import datetime_to_num
+from LTanalyzer import summarize_metrics
+
+'''
+向量化回测引擎
+先把 ATR(14)、VWMA 和 k*ATR 通道整体算成数组，再用一个紧凑的循环跑 VADStrategy 的 DCA 状态机
+成交规则与 backtrader 的 BackBroker 一致（下一根 bar 开盘价成交、百分比滑点、按比例佣金、现金不足则拒单），
+因此交易列表和最终净值与 Cerebro 的结果相同，但速度快得多，适合参数扫描
+'''
+
+ATR_PERIOD = 14
+
+
+def load_arrays(data_file, fromdate=None, todate=None):
+    '''
+    按 MyCSVData 的方式读取数据文件，返回列数组
+    注意：MyCSVData 不解析成交量，backtrader 中 volume 为 NaN，这里保持一致
+    '''
+    columns, _ = load_data_file(data_file)
+
+    dt = columns['datetime'].view('datetime64[ns]')
+    mask = np.ones(len(dt), dtype=bool)
+    if fromdate is not None:
+        mask &= dt >= pd.to_datetime(fromdate).to_datetime64()
+    if todate is not None:
+        mask &= dt <= pd.to_datetime(todate).to_datetime64()
+
+    return {
+        'datetime': dt[mask],
+        'open': columns['open'][mask],
+        'high': columns['high'][mask],
+        'low': columns['low'][mask],
+        'close': columns['close'][mask],
+        'volume': np.full(int(mask.sum()), np.nan)
+    }
+
+
+def vad_bands(data, k, vwma_period=config.indicator_params['vwma_period']):
+    # 预先计算 VADStrategy 用到的指标和通道，ATR、VWMA 优先从指标缓存读取
+    if config.indicator_cache_params['enabled']:
+        key = indicator_cache.dataset_key(data)
+        atr = indicator_cache.get_indicator(data, 'atr', ATR_PERIOD, key=key)
+        vwma = indicator_cache.get_indicator(data, 'vwma', vwma_period, key=key)
+    else:
+        atr = atr_array(data['high'], data['low'], data['close'], period=ATR_PERIOD)
+        vwma = vwma_array(data['close'], data['volume'], period=vwma_period)
+    k_atr = k * atr
+    return {
+        'atr': atr,
+        'vwma': vwma,
+        'k_atr': k_atr,
+        'upper': vwma + k_atr,
+        'lower': vwma - k_atr
+    }
+
+
+def run_vad(data, k=config.vad_strategy_params['k'],
+            base_order_amount=config.vad_strategy_params['base_order_amount'],
+            dca_multiplier=config.vad_strategy_params['dca_multiplier'],
+            number_of_dca_orders=config.vad_strategy_params['number_of_dca_orders'],
+            vwma_period=config.indicator_params['vwma_period'],
+            broker_params=config.broker_params, bands=None, stop_drawdown=None, stop_equity=None):
+    '''
+    运行向量化的 VADStrategy
+    :param data: load_arrays 返回的列数组
+    :param bands: 可选，预先算好的 vad_bands 结果（参数扫描时可复用）
+    :param stop_drawdown: 回撤超过该比例时提前终止（与 LTanalyzer.EarlyStop 一致），None 表示不检查
+    :param stop_equity: 净值低于初始资金的该倍数时提前终止，None 表示不检查
+    :return: 与 LongTermTradeAnalyzer 相同格式的交易列表、每根 bar 的净值（提前终止时只到终止的 bar）、最终净值、是否提前终止等
+    '''
+    if bands is None:
+        bands = vad_bands(data, k, vwma_period)
+
+    dts = data['datetime']
+    opens = data['open'].tolist()
+    highs = data['high'].tolist()
+    lows = data['low'].tolist()
+    closes = data['close'].tolist()
+    upper = bands['upper'].tolist()
+    lower = bands['lower'].tolist()
+    k_atr = bands['k_atr'].tolist()
+
+    cash = float(broker_params['initial_cash'])
+    start_value = cash
+    commission = broker_params['commission_rate']
+    slippage = broker_params['slippage']
+
+    # 指标全部就绪后策略才开始 next（ATR 需要 period + 1 根 bar，VWMA 需要 vwma_period 根）
+    minperiod = max(ATR_PERIOD + 1, vwma_period)
+
+    pos_size = 0.0
+    pos_price = 0.0
+    pending = None  # (是否买入, 数量, 下单时收盘价)
+    total_long_trades = 0
+    last_dca_price = 0.0
+    buy_count = 0
+    sell_count = 0
+
+    trades = []
+    pnl_list = []
+    values = np.empty(len(closes))
+    peak = -math.inf
+    stopped = False
+
+    for i in range(len(closes)):
+        # 撮合上一根 bar 下的市价单
+        if pending is not None:
+            isbuy, size, created_price = pending
+            pending = None
+            if isbuy:
+                # 提交检查：按下单时的收盘价预估现金
+                check_cash = cash - abs(size) * created_price
+                check_cash -= abs(size) * commission * created_price
+                if check_cash >= 0.0:
+                    price = opens[i] * (1 + slippage)
+                    if price > highs[i]:
+                        price = highs[i]
+                    new_cash = cash - abs(size) * price
+                    new_cash -= abs(size) * commission * price
+                    if new_cash >= 0.0:
+                        cash = new_cash
+                        new_size = pos_size + size
+                        pos_price = price if not pos_size else (pos_price * pos_size + size * price) / new_size
+                        pos_size = new_size
+                        trades.append(_trade_info(dts[i], price, size, abs(size) * price, 0.0, True))
+            else:
+                price = opens[i] * (1 - slippage)
+                if price < lows[i]:
+                    price = lows[i]
+                closed = -size
+                pnl = size * (price - pos_price) * 1.0
+                closed_value = abs(closed) * pos_price
+                cash += closed_value + pnl
+                cash -= abs(closed) * commission * price
+                pos_size = 0.0
+                pos_price = 0.0
+                trade = _trade_info(dts[i], price, closed, closed_value, pnl, False)
+                # 与 LongTermTradeAnalyzer.notify_trade 一致，平仓的那笔记录为 closed
+                trade['closed'] = True
+                trades.append(trade)
+                pnl_list.append(pnl)
+
+        values[i] = cash + pos_size * closes[i]
+
+        if stop_drawdown is not None or stop_equity is not None:
+            value = values[i]
+            if value > peak:
+                peak = value
+            if (stop_drawdown is not None and (peak - value) / peak > stop_drawdown) or \
+                    (stop_equity is not None and value < start_value * stop_equity):
+                stopped = True
+                values = values[:i + 1]
+                break
+
+        if i < minperiod - 1:
+            continue
+
+        close = closes[i]
+        long_signal = close < lower[i]
+        short_signal = close > upper[i]
+
+        # 开仓逻辑
+        if long_signal and total_long_trades == 0:
+            size = base_order_amount / close
+            pending = (True, size, close)
+            last_dca_price = base_order_amount
+            total_long_trades = 1
+            buy_count += 1
+
+        # 加仓逻辑
+        elif long_signal and total_long_trades > 0 and total_long_trades < number_of_dca_orders:
+            last_dca_price *= dca_multiplier
+            size = last_dca_price / close
+            pending = (True, size, close)
+            total_long_trades += 1
+            buy_count += 1
+
+        # 止盈止损
+        if pos_size > 0:
+            if short_signal and (close - pos_price >= k_atr[i] * pos_size
+                                 or close - pos_price <= - k_atr[i] * pos_size):
+                pending = (False, pos_size, close)
+                sell_count += 1
+
+    return {
+        'trades': trades,
+        'pnl': pnl_list,
+        'values': values,
+        'start_value': start_value,
+        'end_value': float(values[-1]) if len(values) else start_value,
+        'buy_count': buy_count,
+        'sell_count': sell_count,
+        'stopped': stopped
+    }
+
+
+def analyze_values(values, dts, start_value, risk_free_rate=0.02):
+    '''
+    由每根 bar 的净值计算总收益率、年化收益率、最大回撤（及持续 bar 数）、夏普比率
+    算法与 LTanalyzer.CalculateMetrics 一致
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    end_value = float(values[-1]) if len(values) else start_value
+    dtnum = datetime_to_num(np.asarray(dts).view(np.int64)) if len(dts) else None
+
+    max_drawdown = 0
+    max_drawdown_bars = 0
+    if len(values):
+        peak = np.maximum.accumulate(values)
+        max_drawdown = max(0, float(np.max((peak - values) / peak)))
+        # 最长的连续低于前高的 bar 数
+        underwater = (values < peak).astype(np.int64)
+        runs = np.cumsum(underwater) - np.maximum.accumulate(np.where(underwater == 0, np.cumsum(underwater), 0))
+        max_drawdown_bars = int(runs.max())
+
+    period_returns = np.diff(values) / values[:-1] if len(values) > 1 else np.empty(0)
+    count = len(period_returns)
+    mean = float(np.mean(period_returns)) if count else 0.0
+    m2 = float(np.sum((period_returns - mean) ** 2)) if count else 0.0
+
+    return summarize_metrics(start_value, end_value,
+                             float(dtnum[0]) if dtnum is not None else None,
+                             float(dtnum[-1]) if dtnum is not None else None,
+                             max_drawdown, max_drawdown_bars, count, mean, m2, risk_free_rate)
+
+
+def _trade_info(dt, price, size, value, pnl, isbuy):
+    # 字段与 LongTermTradeAnalyzer 的单笔交易记录一致
+    return {
+        'date': pd.Timestamp(dt).to_pydatetime(),
+        'price': price,
+        'size': size,
+        'value': value,
+        'pnl': pnl,
+        'isbuy': isbuy,
+        'closed': False,
+        'x': None,
+        'ema200': None,
+        'atr': None,
+        'y': None,
+        'target_position': None,
+        'current_position': None
+    }
+
+
+def _bt_feed(data):
+    # 把列数组包装成 backtrader 的数据源（仅用于一致性校验）
+    import backtrader as bt
+    df = pd.DataFrame({
+        'open': data['open'],
+        'high': data['high'],
+        'low': data['low'],
+        'close': data['close'],
+        'volume': data['volume']
+    }, index=pd.DatetimeIndex(data['datetime']))
+    return bt.feeds.PandasData(dataname=df, openinterest=None)
+
+
+def verify_against_backtrader(data_file, volume=None, **params):
+    '''
+    用同一份数据分别跑 Cerebro 和向量化引擎，比较交易列表和最终净值
+    :param volume: 为 None 时与 MyCSVData 一致（成交量为 NaN）；也可传入常数成交量，使 VWMA 有效、DCA 逻辑真正被触发
+    :param params: 覆盖 VADStrategy 的参数，例如 k=0.5
+    :return: (是否一致, 向量化引擎交易笔数, 差异说明)
+    '''
+    import backtrader as bt
+    from strategy import VADStrategy
+    from LTanalyzer import LongTermTradeAnalyzer
+    from my_data import MyCSVData
+
+    data = load_arrays(data_file,
+                       fromdate=config.backtest_params['start_date'],
+                       todate=config.backtest_params['end_date'])
+    if volume is not None:
+        data['volume'] = np.full(len(data['close']), float(volume))
+
+    class QuietVADStrategy(VADStrategy):
+        def log(self, txt, dt=None):
+            pass
+
+    cerebro = bt.Cerebro()
+    if volume is None:
+        cerebro.adddata(MyCSVData(
+            dataname=data_file,
+            fromdate=pd.to_datetime(config.backtest_params['start_date']),
+            todate=pd.to_datetime(config.backtest_params['end_date'])))
+    else:
+        cerebro.adddata(_bt_feed(data))
+    cerebro.addstrategy(QuietVADStrategy, **params)
+    cerebro.broker.setcash(config.broker_params['initial_cash'])
+    cerebro.broker.setcommission(config.broker_params['commission_rate'])
+    cerebro.broker.set_slippage_perc(config.broker_params['slippage'])
+    cerebro.addanalyzer(LongTermTradeAnalyzer, _name='longterm_trades')
+    strat = cerebro.run()[0]
+    bt_trades = strat.analyzers.longterm_trades.get_analysis()['trades']
+    bt_value = cerebro.broker.get_value()
+
+    result = run_vad(data, **params)
+    fast_trades = result['trades']
+
+    if len(bt_trades) != len(fast_trades):
+        return False, len(fast_trades), f'交易笔数不同: backtrader {len(bt_trades)}, 向量化 {len(fast_trades)}'
+    for n, (a, b) in enumerate(zip(bt_trades, fast_trades)):
+        if a['date'] != b['date'] or a['isbuy'] != b['isbuy'] or a['closed'] != b['closed']:
+            return False, len(fast_trades), f'第 {n} 笔交易不同: {a} != {b}'
+        for key in ('price', 'size', 'value', 'pnl'):
+            if not math.isclose(a[key], b[key], rel_tol=1e-9, abs_tol=1e-6):
+                return False, len(fast_trades), f'第 {n} 笔交易 {key} 不同: {a[key]} != {b[key]}'
+    if not math.isclose(bt_value, result['end_value'], rel_tol=1e-9):
+        return False, len(fast_trades), f'最终净值不同: backtrader {bt_value}, 向量化 {result["end_value"]}'
+    if (strat.buy_count, strat.sell_count) != (result['buy_count'], result['sell_count']):
+        return False, len(fast_trades), '下单次数不同'
+    return True, len(fast_trades), ''
+
+
+# verify_against_backtrader 的 (成交量, 参数) 组合，python fast_engine.py 和 tests/test_fast_engine.py 共用
+# 原始数据成交量为 NaN，VADStrategy 不会下单；常数成交量下再用几组参数覆盖加仓、止盈止损和现金不足拒单
+VERIFY_CHECKS = [
+    (None, {}),
+    (1.0, {}),
+    (1.0, dict(k=0.3, base_order_amount=100)),
+    (1.0, dict(k=0.5, base_order_amount=300, number_of_dca_orders=50, dca_multiplier=1.05)),
+    (1.0, dict(k=0.2, base_order_amount=600000, dca_multiplier=2))
+]
+
+
+if __name__ == '__main__':
+    # 在 results/ 下所有数据文件上校验向量化引擎与 backtrader 的结果一致
+    failed = False
+    for name, data_file in config.data_files:
+        for volume, params in VERIFY_CHECKS:
+            ok, count, message = verify_against_backtrader(data_file, volume=volume, **params)
+            label = '原始数据' if volume is None else f'成交量={volume} {params}'
+            print(f'{name} ({label}): {"一致" if ok else "不一致"}，交易 {count} 笔 {message}')
+            failed = failed or not ok
+    if failed:
+        raise SystemExit(1)
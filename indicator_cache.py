@@ -0,0 +1,97 @@
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+import config
+from indicators import atr_array, ema_array, vwma_array
+
+'''
+指标预计算缓存
+同一数据集（按内容哈希区分）的同一指标、同一周期只计算一次，结果保存在有界的 LRU 内存缓存中，可选同时写入磁盘
+参数扫描时只有 k 等策略参数在变，ATR、VWMA 数组直接复用
+'''
+
+# 指标名称 -> 计算函数（参数为列数组字典和周期）
+INDICATORS = {
+    'atr': lambda columns, period: atr_array(columns['high'], columns['low'], columns['close'], period=period),
+    'vwma': lambda columns, period: vwma_array(columns['close'], _volume(columns), period=period),
+    'ema': lambda columns, period: ema_array(columns['close'], period)
+}
+
+_cache = OrderedDict()
+_stats = {'hits': 0, 'misses': 0, 'disk_hits': 0}
+
+
+def _volume(columns):
+    # 数据中没有成交量时与 MyCSVData 一致，按 NaN 处理
+    if 'volume' in columns:
+        return columns['volume']
+    return np.full(len(columns['close']), np.nan)
+
+
+def dataset_key(columns):
+    # 按指标用到的列的内容计算哈希，同一份数据无论来自缓存文件、切片视图还是共享内存都得到相同的键
+    digest = hashlib.sha1()
+    for name in ('datetime', 'high', 'low', 'close', 'volume'):
+        if name in columns:
+            digest.update(name.encode('utf-8'))
+            digest.update(memoryview(np.ascontiguousarray(columns[name]).view(np.uint8)))
+    return digest.hexdigest()
+
+
+def _disk_path(key, name, period):
+    return os.path.join(config.indicator_cache_params['cache_dir'], f'{key}-{name}-{period}.npy')
+
+
+def get_indicator(columns, name, period, key=None):
+    '''
+    获取指标数组，优先从内存缓存、其次从磁盘缓存读取，都没有时计算并写入缓存
+    :param columns: 列数组字典
+    :param name: 指标名称，见 INDICATORS
+    :param period: 指标周期
+    :param key: 数据集的键，不传则按内容计算（同一数据集多次调用时可以先算好传入）
+    :return: 只读的 float64 数组，与 columns 逐 bar 对齐
+    '''
+    cache_key = (key or dataset_key(columns), name, period)
+    if cache_key in _cache:
+        _cache.move_to_end(cache_key)
+        _stats['hits'] += 1
+        return _cache[cache_key]
+
+    _stats['misses'] += 1
+    path = _disk_path(*cache_key)
+    if config.indicator_cache_params['disk'] and os.path.exists(path):
+        values = np.load(path)
+        _stats['disk_hits'] += 1
+    else:
+        values = INDICATORS[name](columns, period)
+        if config.indicator_cache_params['disk']:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp, path)
+
+    values.setflags(write=False)
+    _cache[cache_key] = values
+    while len(_cache) > config.indicator_cache_params['maxsize']:
+        _cache.popitem(last=False)
+    return values
+
+
+def put_indicator(key, name, period, values):
+    # 把已算好的指标数组（如共享内存中的数组）放入内存缓存，之后同一数据集的 get_indicator 直接命中
+    values.setflags(write=False)
+    _cache[(key, name, period)] = values
+    while len(_cache) > config.indicator_cache_params['maxsize']:
+        _cache.popitem(last=False)
+
+
+def cache_info():
+    return dict(_stats, size=len(_cache), maxsize=config.indicator_cache_params['maxsize'])
+
+
+def clear():
+    _cache.clear()
+    for key in _stats:
+        _stats[key] = 0
@@ -1,4 +1,6 @@
 import backtrader as bt
+import numpy as np
+import math
 import config
 
 class VWMA(bt.Indicator):
@@ -9,3 +11,101 @@ class VWMA(bt.Indicator):
         self.addminperiod(self.params.period)
         volume_price = self.data.close * self.data.volume
         self.lines.vwma = bt.indicators.SumN(volume_price, period=self.params.period) / bt.indicators.SumN(self.data.volume, period=self.params.period)
+
+
+'''
+数组版本的指标，计算顺序与 backtrader 的 once 模式一致（逐位相同），供向量化回测引擎使用
+'''
+
+def sum_n_array(values, period):
+    # 与 bt.indicators.SumN 一致：窗口内用 math.fsum 求和
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    src = values.tolist()
+    for i in range(period - 1, len(src)):
+        out[i] = math.fsum(src[i - period + 1:i + 1])
+    return out
+
+
+def true_range_array(high, low, close):
+    # TR = max(high, 前收) - min(low, 前收)，第一根 bar 没有前收
+    tr = np.full(len(close), np.nan)
+    tr[1:] = np.maximum(high[1:], close[:-1]) - np.minimum(low[1:], close[:-1])
+    return tr
+
+
+def atr_array(high, low, close, period=14):
+    # 与 bt.indicators.ATR 一致：TR 的 Wilder 平滑，用前 period 个 TR 的均值作为种子
+    tr = true_range_array(np.asarray(high, dtype=np.float64),
+                          np.asarray(low, dtype=np.float64),
+                          np.asarray(close, dtype=np.float64))
+    out = np.full(len(tr), np.nan)
+    if len(tr) <= period:
+        return out
+
+    alpha = 1.0 / period
+    alpha1 = 1.0 - alpha
+    src = tr.tolist()
+    prev = math.fsum(src[1:period + 1]) / period
+    out[period] = prev
+    for i in range(period + 1, len(src)):
+        prev = prev * alpha1 + src[i] * alpha
+        out[i] = prev
+    return out
+
+
+def ema_array(values, period):
+    # 与 bt.indicators.EMA 一致：前 period 个值的均值作为种子，之后 prev * (1 - alpha) + x * alpha
+    src = np.asarray(values, dtype=np.float64).tolist()
+    out = np.full(len(src), np.nan)
+    if len(src) < period:
+        return out
+
+    alpha = 2.0 / (1.0 + period)
+    alpha1 = 1.0 - alpha
+    prev = math.fsum(src[:period]) / period
+    out[period - 1] = prev
+    for i in range(period, len(src)):
+        prev = prev * alpha1 + src[i] * alpha
+        out[i] = prev
+    return out
+
+
+def vwma_array(close, volume, period=config.indicator_params['vwma_period']):
+    # 与 VWMA 指标一致：sum(close * volume, period) / sum(volume, period)
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sum_n_array(close * volume, period) / sum_n_array(volume, period)
+
+
+class ArrayIndicator(bt.Indicator):
+    '''
+    把预先计算好的数组（与数据源逐 bar 对齐）包装成 backtrader 指标，不再在回测中重复计算
+    minperiod 与对应的原生指标保持一致，策略开始 next 的位置不变
+    '''
+    params = (('values', None), ('minperiod', 1))
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def next(self):
+        self.lines[0][0] = self.p.values[len(self) - 1]
+
+    def once(self, start, end):
+        dst = self.lines[0].array
+        src = self.p.values
+        for i in range(start, end):
+            dst[i] = src[i]
+
+
+class ArrayATR(ArrayIndicator):
+    lines = ('atr',)
+
+
+class ArrayVWMA(ArrayIndicator):
+    lines = ('vwma',)
+
+
+class ArrayEMA(ArrayIndicator):
+    lines = ('ema',)
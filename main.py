@@ -2,14 +2,20 @@ import backtrader as bt
 import config
 from strategy import VADStrategy
 from strategy import BuyAndHoldStrategy
-# from strategy import AR_Strategy
+from strategy import AR_Strategy
 from texttable import Texttable 
-from my_data import MyCSVData
+from my_data import MyArrayData, MyCSVData
+from data_cache import load_data_file
+from resample import timeframe_datasets
+import numpy as np
 import pandas as pd
-from LTanalyzer import LongTermTradeAnalyzer, CalculateTotalReturn, CalculateAnnualReturn
-from LTanalyzer import CalculateMaxDrawdown,CalculateSharpeRatio
+from LTanalyzer import LongTermTradeAnalyzer, CalculateMetrics, EquityCurve, EarlyStop
+from profiling import Profiler
+from trade_ledger import BASIC_CSV_FIELDS, INFO_CSV_FIELDS
+from result_store import ResultStore, run_key
+from cerebro_setup import run_cerebro
+from indicator_cache import dataset_key
 import os
-# from visual import plot_results
 
 '''
 运行回测
@@ -20,148 +26,215 @@ output_dir = 'data'
 if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
-def add_data_and_run_strategy(strategy_class, data_file, name, strategy_name):
-    cerebro = bt.Cerebro()
-    data = MyCSVData( 
-        dataname=data_file,
-        dtformat='%Y/%m/%d %H:%M',
-        datetime=0,
-        open=1,
-        high=2,
-        low=3,
-        close=4,
-        fromdate=pd.to_datetime(config.backtest_params['start_date']),
-        todate=pd.to_datetime(config.backtest_params['end_date'])
-    )
-    
-    # 添加数据、策略
-    cerebro.adddata(data, name=name)
-    cerebro.addstrategy(strategy_class)
-
-    # 添加资金、佣金、滑点
-    cerebro.broker.setcash(config.broker_params['initial_cash'])
-    cerebro.broker.setcommission(config.broker_params['commission_rate'])
-    cerebro.broker.set_slippage_perc(config.broker_params['slippage'])
-    
-    # 添加分析器
-    cerebro.addanalyzer(LongTermTradeAnalyzer, _name='longterm_trades')
-    cerebro.addanalyzer(CalculateTotalReturn, _name='total_return')
-    cerebro.addanalyzer(CalculateAnnualReturn, _name='annual_return')
-    cerebro.addanalyzer(CalculateMaxDrawdown, _name='max_drawdown')
-    cerebro.addanalyzer(CalculateSharpeRatio, _name='sharpe_ratio')
-    
-    # 运行回测
-    results = cerebro.run()
-
+# 参与比较的策略：(显示名称, 策略类, 交易记录文件名后缀)，第一个为基准
+benchmark = ('BuyAndHold', BuyAndHoldStrategy, 'buy_and_hold')
+strategies = [
+    benchmark,
+    ('VADStrategy', VADStrategy, 'VAD'),
+    ('AR_Strategy', AR_Strategy, 'AR'),
+]
+
+# 有界内存模式与已读入内存的数据（重采样）同时开启时的错误信息
+BOUNDED_WITH_DATA_ERROR = ('有界内存模式（config.bounded_memory_params）逐行读取数据文件，不能用于已整列读入内存的数据'
+                           '（如 config.resample_params 的重采样结果），请关闭其中一项')
+
+def load_data(data_file):
+    '''
+    读取数据文件并截取回测区间，返回 (列数组字典, 数据文件总行数)
+    数据按时间排序，用 searchsorted 定位区间，得到的列数组是原数组的切片视图（不复制），可供多个策略共用
+    '''
+    # .npz 或二进制列式缓存都跳过文本解析
+    columns, total_lines = load_data_file(data_file)
+    return slice_backtest_window(columns), total_lines
+
+def slice_backtest_window(columns):
+    # 截取 config.backtest_params 的回测区间
+    dt = columns['datetime']
+    start = np.searchsorted(dt, pd.Timestamp(config.backtest_params['start_date']).as_unit('ns').value, side='left')
+    end = np.searchsorted(dt, pd.Timestamp(config.backtest_params['end_date']).as_unit('ns').value, side='right')
+    return {key: values[start:end] for key, values in columns.items()}
+
+def backtest_datasets():
+    '''
+    需要回测的数据集：[(名称, 数据文件, 已读取的数据)]
+    开启 config.resample_params 时只解析一次 base_file，各周期在内存中重采样得到，已读取的数据为 (列数组字典, 总行数)；
+    否则逐个使用 config.data_files，已读取的数据为 None
+    重采样的各周期由整个 base_file 在内存中聚合得到，不能与有界内存模式同时开启
+    '''
+    if not config.resample_params['enabled']:
+        return [(name, data_file, None) for name, data_file in config.data_files]
+    if config.bounded_memory_params['enabled']:
+        raise ValueError(BOUNDED_WITH_DATA_ERROR)
+    base_file = config.resample_params['base_file']
+    return [(name, base_file, (slice_backtest_window(columns), total_lines))
+            for name, columns, total_lines in timeframe_datasets()]
+
+def run_strategy(strategy_class, columns, total_lines, name, profiler=None, early_stop=None, broker_params=None,
+                 in_place=False, **strategy_params):
+    # 在已读取的列数组上运行单个策略，每次运行有独立的 broker 和分析器
+    # 传入 profiler 时给策略、分析器、broker 和数据加上计时
+    # 传入 early_stop（EarlyStop 的参数，如 {'max_drawdown': 0.5}）时回撤或净值越过阈值后提前终止
+    # 传入 broker_params（格式同 config.broker_params）时用它代替 config 中的资金、佣金和滑点
+    # in_place 为 True 时数据源直接读取 columns 中的数组（如共享内存），不复制
+    data = MyArrayData(dataname=columns, total_lines=total_lines, in_place=in_place)
+    analyzers = [(LongTermTradeAnalyzer, 'longterm_trades'), (CalculateMetrics, 'metrics'), (EquityCurve, 'equity')]
+    if early_stop is not None:
+        analyzers.append((EarlyStop, 'early_stop', early_stop))
+    return run_cerebro(bt.Cerebro(), data, strategy_class, name, analyzers, profiler, broker_params, **strategy_params)
+
+def run_strategy_bounded(strategy_class, data_file, name, **strategy_params):
+    '''
+    有界内存模式：MyCSVData 逐行读取数据文件（不预加载），cerebro 以 exactbars 运行，数据和指标只保留回看所需的 bar
+    分析器只保留 O(1) 内存的 LongTermTradeAnalyzer 和 CalculateMetrics（不记录逐 bar 净值曲线）
+    data_file 不是 CSV（如 data_cache 转换的 .npz）时改读同名的 CSV 文件，没有则报错
+    '''
+    if os.path.splitext(data_file)[1].lower() != '.csv':
+        csv_file = os.path.splitext(data_file)[0] + '.csv'
+        if not os.path.exists(csv_file):
+            raise ValueError(f'有界内存模式需要逐行读取 CSV 文本文件，{data_file} 不是 CSV，也没有同名的 CSV 文件')
+        data_file = csv_file
+    data = MyCSVData(dataname=data_file,
+                     fromdate=pd.Timestamp(config.backtest_params['start_date']).to_pydatetime(),
+                     todate=pd.Timestamp(config.backtest_params['end_date']).to_pydatetime())
+    cerebro = bt.Cerebro(stdstats=False, exactbars=config.bounded_memory_params['exactbars'])
+    analyzers = [(LongTermTradeAnalyzer, 'longterm_trades'), (CalculateMetrics, 'metrics')]
+    return run_cerebro(cerebro, data, strategy_class, name, analyzers, **strategy_params)
+
+def backtest_dates():
     # 获取回测时间
     start_date = pd.to_datetime(config.backtest_params['start_date']).strftime('%Y-%m-%d')
     end_date = pd.to_datetime(config.backtest_params['end_date']).strftime('%Y-%m-%d')
-
+    return start_date, end_date
+
+def add_data_and_run_strategy(strategy_class, data_file, name, strategy_name, **strategy_params):
+    if not config.profiling_params['enabled']:
+        columns, total_lines = load_data(data_file)
+        results = run_strategy(strategy_class, columns, total_lines, name, **strategy_params)
+    else:
+        profiler = Profiler()
+        columns, total_lines = profiler.call('load_data', load_data, data_file)
+        results = run_strategy(strategy_class, columns, total_lines, name, profiler=profiler, **strategy_params)
+        if config.profiling_params['print_summary']:
+            print(f"{name} {strategy_name} 热点分析:")
+            profiler.print_summary()
+        json_path, folded_path = profiler.export(f'{name}_{strategy_name}_{os.getpid()}')
+        print(f"热点分析结果已写入 {json_path} 和 {folded_path}")
+    start_date, end_date = backtest_dates()
     return results, start_date, end_date
 
+def run_strategies(data_file, name, strategy_list=None, data=None):
+    '''
+    每个数据文件只读取、解析一次，多个策略在同一份列数组上运行
+    :param strategy_list: [(显示名称, 策略类, 交易记录文件名后缀)]，默认使用 strategies
+    :param data: 已读取的 (列数组字典, 总行数)，传入时不再读取 data_file（不能与有界内存模式同时使用）
+    :return: {显示名称: 策略实例}，开启 config.result_store_params 时命中结果库的为 result_store.StoredStrategy
+    '''
+    if data is not None and config.bounded_memory_params['enabled']:
+        raise ValueError(BOUNDED_WITH_DATA_ERROR)
+    if config.bounded_memory_params['enabled']:
+        # 有界内存模式逐行读取数据文件，不整列读入（也不使用结果库，键需要整列数据的哈希）
+        return {strategy_name: run_strategy_bounded(strategy_class, data_file, name)[0]
+                for strategy_name, strategy_class, _ in strategy_list or strategies}
+
+    columns, total_lines = data if data is not None else load_data(data_file)
+    if not config.result_store_params['enabled']:
+        return {strategy_name: run_strategy(strategy_class, columns, total_lines, name)[0]
+                for strategy_name, strategy_class, _ in strategy_list or strategies}
+
+    # 结果库中已有（数据、参数、代码都没变）的直接取回，其余回测后写入
+    data_key = dataset_key(columns)
+    strats = {}
+    with ResultStore() as store:
+        for strategy_name, strategy_class, _ in strategy_list or strategies:
+            key = run_key(columns, total_lines, strategy_class, data_key=data_key)
+            strats[strategy_name] = store.get(key)
+            if strats[strategy_name] is None:
+                strats[strategy_name] = run_strategy(strategy_class, columns, total_lines, name)[0]
+                store.put_strategy(key, name, strats[strategy_name])
+    return strats
+
+def collect_metrics(strat):
+    # 从分析器中提取总收益率、年化收益率、最大回撤、夏普比率等指标
+    metrics = dict(strat.analyzers.metrics.get_analysis())
+    metrics['trade_count'] = strat.buy_count + strat.sell_count
+    return metrics
+
 def log_trades(trades, file_name, strategy_name):
     file_path = os.path.join(output_dir, file_name)
+    ledger = trades['ledger']
+    fields = INFO_CSV_FIELDS if strategy_name in ('VADStrategy', 'AR_Strategy') else BASIC_CSV_FIELDS
+    # BuyAndHoldStrategy 按整数股下单，数量列保持整数格式；其他策略不论本次成交是否都是整数都写为浮点数
+    int_size = strategy_name == 'BuyAndHoldStrategy'
 
     try:
-        with open(file_path, 'w') as f:
-            if strategy_name == 'VADStrategy':
-                f.write("Date,IsBuy,Price,Size,Value,PnL,x,ema200,atr,y,TargetPosition,CurrentPosition,Closed\n")
-            else:
-                f.write("Date,IsBuy,Price,Size,Value,PnL,Closed\n")
-            
-            for trade in trades['trades']:
-                if strategy_name == 'VADStrategy':
-                    log_str = f'{trade["date"]},{trade["isbuy"]},{trade["price"]},{trade["size"]},{trade["value"]},{trade["pnl"]},{trade.get("x", "")},{trade.get("ema200", "")},{trade.get("atr", "")},{trade.get("y", "")},{trade.get("target_position", "")},{trade.get("current_position", "")},{trade["closed"]}\n'
-                else:
-                    log_str = f'{trade["date"]},{trade["isbuy"]},{trade["price"]},{trade["size"]},{trade["value"]},{trade["pnl"]},{trade["closed"]}\n'
-                f.write(log_str)
+        # 整列批量写入，不再逐行格式化
+        ledger.to_csv(file_path, fields, int_size=int_size)
+        if config.trade_log_params['npz']:
+            ledger.to_npz(os.path.splitext(file_path)[0] + '.npz')
         print(f"每笔交易数据成功写入 {file_path}")
     except Exception as e:
         print(f"Error writing to {file_path}: {e}")
 
 
+def format_percent(value):
+    return f"{value * 100:.2f}%" if value is not None else "N/A"
+
 def run_backtest():
-    for name, data_file in config.data_files:
+    start_date, end_date = backtest_dates()
+    benchmark_name = benchmark[0]
+    compared = [item for item in strategies if item[0] != benchmark_name]
+
+    for name, data_file, data in backtest_datasets():
         print(f"\n{name} 分析结果:")
 
-        # 运行策略
-        buy_and_hold_results, start_date, end_date = add_data_and_run_strategy(BuyAndHoldStrategy, data_file, name, 'BuyAndHoldStrategy')
-        buy_and_hold_strat = buy_and_hold_results[0]
-        VADStrategy_results, start_date, end_date = add_data_and_run_strategy(VADStrategy, data_file, name, 'VADStrategy')
-        VADStrategy_strat = VADStrategy_results[0]
-        # AR_results, _, _ = add_data_and_run_strategy(AR_results, data_file, name)
-        # AR_strat = AR_results[0]
-
-        # 获取 BuyAndHoldStrategy 的分析结果
-        buy_and_hold_trades = buy_and_hold_strat.analyzers.longterm_trades.get_analysis()
-        buy_and_hold_total_return = buy_and_hold_strat.analyzers.total_return.get_analysis()['total_return']
-        buy_and_hold_annual_return = buy_and_hold_strat.analyzers.annual_return.get_analysis()['annual_return']
-        buy_and_hold_drawdown = buy_and_hold_strat.analyzers.max_drawdown.get_analysis()['max_drawdown']
-        buy_and_hold_sharpe = buy_and_hold_strat.analyzers.sharpe_ratio.get_analysis()['sharpe_ratio']
-        buy_and_hold_start_value = buy_and_hold_strat.analyzers.total_return.start_value
-        buy_and_hold_end_value = buy_and_hold_strat.analyzers.total_return.end_value
-
-        # 获取 VADStrategy 的分析结果
-        VAD_trades = VADStrategy_strat.analyzers.longterm_trades.get_analysis()
-        VAD_total_return = VADStrategy_strat.analyzers.total_return.get_analysis()['total_return'] 
-        VAD_annual_return = VADStrategy_strat.analyzers.annual_return.get_analysis()['annual_return'] 
-        VAD_drawdown = VADStrategy_strat.analyzers.max_drawdown.get_analysis()['max_drawdown']
-        VAD_sharpe = VADStrategy_strat.analyzers.sharpe_ratio.get_analysis()['sharpe_ratio']
-        VAD_start_value = VADStrategy_strat.analyzers.total_return.start_value
-        VAD_end_value = VADStrategy_strat.analyzers.total_return.end_value
-
-        # 获取AR的分析结果
-        # AR_trades = AR_strat.analyzers.longterm_trades.get_analysis()
-        # AR_total_return = AR_strat.analyzers.total_return.get_analysis()['total_return'] 
-        # AR_annual_return = AR_strat.analyzers.annual_return.get_analysis()['annual_return'] 
-        # AR_drawdown = AR_strat.analyzers.max_drawdown.get_analysis()['max_drawdown']
-        # AR_sharpe = AR_strat.analyzers.sharpe_ratio.get_analysis()['sharpe_ratio']
-        # AR_start_value = AR_strat.analyzers.total_return.start_value
-        # AR_end_value = AR_strat.analyzers.total_return.end_value
-
-        # 计算超额收益
-        excess_total_returns = VAD_total_return - buy_and_hold_total_return
-        excess_annual_returns = VAD_annual_return - buy_and_hold_annual_return
+        # 运行策略（数据只读取一次）
+        strats = run_strategies(data_file, name, data=data)
+        metrics = {strategy_name: collect_metrics(strat) for strategy_name, strat in strats.items()}
+        benchmark_metrics = metrics[benchmark_name]
 
         # 打印
         print(f"回测时间：从 {start_date} 到 {end_date}")
-        print(f'BuyAndHold 初始本金为 {buy_and_hold_start_value:.2f}')
-        print(f'BuyAndHold 最终本金为 {buy_and_hold_end_value:.2f}')
-        print(f'VADStrategy 初始本金为 {VAD_start_value:.2f}')
-        print(f'VADStrategy 最终本金为 {VAD_end_value:.2f}')
+        for strategy_name in [benchmark_name] + [item[0] for item in compared]:
+            print(f'{strategy_name} 初始本金为 {metrics[strategy_name]["start_value"]:.2f}')
+            print(f'{strategy_name} 最终本金为 {metrics[strategy_name]["end_value"]:.2f}')
 
-        table = Texttable()
+        # 每个策略一列，之后是相对 BuyAndHold 的超额收益
+        names = [item[0] for item in compared]
+        excess_titles = ["超额收益"] if len(names) == 1 else [f"{strategy_name} 超额收益" for strategy_name in names]
+        blanks = [" "] * len(names)
+
+        def excess(key):
+            # 计算超额收益
+            return [format_percent(metrics[strategy_name][key] - benchmark_metrics[key]) for strategy_name in names]
+
+        table = Texttable(max_width=0)
         table.add_rows([
-            ["分析项目", "VADStrategy", "BuyAndHold", "超额收益"],
-            ["总收益率", f"{VAD_total_return * 100:.2f}%" if VAD_total_return is not None else "N/A",
-                            f"{buy_and_hold_total_return * 100:.2f}%" if buy_and_hold_total_return is not None else "N/A",
-                            f"{excess_total_returns * 100:.2f}%" if excess_total_returns is not None else "N/A"],
-            ["年化收益率", f"{VAD_annual_return * 100:.2f}%" if VAD_annual_return is not None else "N/A",
-                            f"{buy_and_hold_annual_return * 100:.2f}%" if buy_and_hold_annual_return is not None else "N/A", 
-                            f"{excess_annual_returns * 100:.2f}%" if excess_annual_returns is not None else "N/A"],
-            ["最大回撤", f"{VAD_drawdown * 100:.2f}%" if VAD_drawdown is not None else "N/A",
-                         f"{buy_and_hold_drawdown * 100:.2f}%" if buy_and_hold_drawdown is not None else "N/A", 
-                         " "],
-            ["夏普比率", f"{VAD_sharpe:.2f}" if VAD_sharpe is not None else "N/A",
-                         f"{buy_and_hold_sharpe:.2f}" if buy_and_hold_sharpe is not None else "N/A", 
-                         " "],
-            ["总交易笔数", VADStrategy_strat.buy_count + VADStrategy_strat.sell_count,
-                          buy_and_hold_strat.buy_count + buy_and_hold_strat.sell_count,
-                          " "]
+            ["分析项目"] + names + [benchmark_name] + excess_titles,
+            ["总收益率"] + [format_percent(metrics[n]['total_return']) for n in names]
+                        + [format_percent(benchmark_metrics['total_return'])] + excess('total_return'),
+            ["年化收益率"] + [format_percent(metrics[n]['annual_return']) for n in names]
+                          + [format_percent(benchmark_metrics['annual_return'])] + excess('annual_return'),
+            ["最大回撤"] + [format_percent(metrics[n]['max_drawdown']) for n in names]
+                        + [format_percent(benchmark_metrics['max_drawdown'])] + blanks,
+            ["夏普比率"] + [f"{metrics[n]['sharpe_ratio']:.2f}" if metrics[n]['sharpe_ratio'] is not None else "N/A" for n in names]
+                        + [f"{benchmark_metrics['sharpe_ratio']:.2f}" if benchmark_metrics['sharpe_ratio'] is not None else "N/A"] + blanks,
+            ["总交易笔数"] + [metrics[n]['trade_count'] for n in names] + [benchmark_metrics['trade_count']] + blanks
         ])
 
         print(table.draw())
-        log_trades(buy_and_hold_trades, f'{name}_buy_and_hold_trades.csv', 'BuyAndHoldStrategy')
-        log_trades(VAD_trades, f'{name}_VAD_trades.csv', 'VADStrategy')
-
-        # # 准备绘图数据
-        # data = {
-        #     'date': pd.date_range(start=start_date, end=end_date),
-        #     'net_value': [...]  # 这里填入实际的净值数据
-        # }
-        # df = pd.DataFrame(data)
-        # plot_results(df, name, 'VADStrategy')
-
+        for strategy_name, strategy_class, suffix in [benchmark] + compared:
+            trades = strats[strategy_name].analyzers.longterm_trades.get_analysis()
+            log_trades(trades, f'{name}_{suffix}_trades.csv', strategy_class.__name__)
+
+        # 绘图：每个策略与 BuyAndHold 的净值曲线（降采样）和买卖点；有界内存模式没有记录净值曲线，不绘图
+        if config.plot_params['enabled'] and all(hasattr(strat.analyzers, 'equity') for strat in strats.values()):
+            from visual import plot_results
+            equity = {strategy_name: strat.analyzers.equity.get_analysis() for strategy_name, strat in strats.items()}
+            benchmark_df = pd.DataFrame({'date': equity[benchmark_name]['datetime'], 'net_value': equity[benchmark_name]['value']})
+            for strategy_name in names:
+                df = pd.DataFrame({'date': equity[strategy_name]['datetime'], 'net_value': equity[strategy_name]['value']})
+                ledger = strats[strategy_name].analyzers.longterm_trades.get_analysis()['ledger']
+                plot_results(df, name, strategy_name, ledger=ledger, benchmark=benchmark_df, benchmark_name=benchmark_name)
 
 if __name__ == '__main__':
     run_backtest()
\ No newline at end of file
@@ -1,31 +1,156 @@
 import backtrader as bt
+import numpy as np
 from datetime import datetime
+import config
+import date_index
+from data_cache import read_csv_columns
 
 '''
 大聪明backtrader解析不了4h bar，所以手动解析了
 '''
 
-class MyCSVData(bt.feeds.GenericCSVData):
+def datetime_to_num(dt_ns):
+    '''
+    把 int64 纳秒时间戳数组转换为 backtrader 的日期数值
+    计算顺序与 bt.date2num 相同，结果逐位一致
+    '''
+    dt_ns = np.asarray(dt_ns, dtype=np.int64)
+    days, rem = np.divmod(dt_ns, 86400 * 10**9)
+    hour, rem = np.divmod(rem, 3600 * 10**9)
+    minute, rem = np.divmod(rem, 60 * 10**9)
+    second, rem = np.divmod(rem, 10**9)
+    microsecond = rem // 1000
+    # 719163 为 1970-01-01 的 ordinal
+    base = (days + 719163).astype(np.float64)
+    return base + (hour / 24.0 + minute / 1440.0 + second / 86400.0 + microsecond / 86400000000.0)
+
+
+def num_to_datetime(num):
+    '''
+    把 backtrader 的日期数值数组转换为 datetime64[ns]
+    计算顺序与 bt.num2date 相同（包括微秒的取舍）
+    '''
+    num = np.asarray(num, dtype=np.float64)
+    days = num.astype(np.int64)
+    remainder = num - days
+    hour, remainder = np.divmod(24 * remainder, 1)
+    minute, remainder = np.divmod(60 * remainder, 1)
+    second, remainder = np.divmod(60 * remainder, 1)
+    microsecond = (1e6 * remainder).astype(np.int64)
+    microsecond = np.where(microsecond < 10, 0, microsecond)
+    # 接近整秒时进位
+    microsecond = np.where(microsecond > 999990, 1000000, microsecond)
+    total_us = (((days - 719163) * 24 + hour.astype(np.int64)) * 60 + minute.astype(np.int64)) * 60
+    total_us = (total_us + second.astype(np.int64)) * 1000000 + microsecond
+    return (total_us * 1000).view('datetime64[ns]')
+
+
+class ColumnsFeedMixin(object):
+    '''
+    从列数组逐根输出 bar 的公共逻辑，MyCSVData（向量化模式）和 MyArrayData 共用
+    '''
+    def _start_columns(self, columns, in_place=False):
+        # in_place 为 True 时按 memoryview 直接读取原数组（如共享内存），不转换成 Python 列表，逐根读取稍慢但不占额外内存
+        convert = (lambda values: memoryview(np.ascontiguousarray(values, dtype=np.float64))) if in_place else \
+            (lambda values: values.tolist())
+        self._dtnum = convert(columns['dtnum'] if 'dtnum' in columns else datetime_to_num(columns['datetime']))
+        self._open = convert(columns['open'])
+        self._high = convert(columns['high'])
+        self._low = convert(columns['low'])
+        self._close = convert(columns['close'])
+        # 数据中没有成交量时与 MyCSVData 一致，volume 保持 NaN
+        self._volume = convert(columns['volume']) if 'volume' in columns else None
+        self._idx = 0
+
+    def _load_columns(self):
+        i = self._idx
+        if i >= len(self._dtnum):
+            return False
+
+        self.lines.datetime[0] = self._dtnum[i]
+        self.lines.open[0] = self._open[i]
+        self.lines.high[0] = self._high[i]
+        self.lines.low[0] = self._low[i]
+        self.lines.close[0] = self._close[i]
+        if self._volume is not None:
+            self.lines.volume[0] = self._volume[i]
+        self._idx += 1
+        return True
+
+
+class MyCSVData(ColumnsFeedMixin, bt.feeds.GenericCSVData):
     params = (
         ('dtformat', '%Y/%m/%d %H:%M'),
         ('datetime', 0),
         ('open', 1),
         ('high', 2),
         ('low', 3),
-        ('close', 4)
+        ('close', 4),
+        ('vectorized', False),  # True 时一次读入整个文件并向量化解析，不再逐行 strptime
+        ('use_index', config.date_index_params['enabled'])  # 设置了 fromdate / todate 时按日期索引只读取区间内的行
     )
 
     # 因为我们的数据是非连续的（节假日信息空缺），这里为了减少数据的处理，增加用行数指代bar的位置的逻辑
     def __init__(self, *args, **kwargs):
         super(MyCSVData, self).__init__(*args, **kwargs)
         self.total_lines = 0  # 初始化总行数为0
+        self._rows_left = None  # 按索引读取时区间内剩余的行数
+
+    def _index_window(self):
+        # 按日期索引定位 fromdate / todate 区间，没有设置区间或不使用索引时返回 None
+        if not self.p.use_index or not isinstance(self.p.dataname, str):
+            return None
+        if self.p.fromdate is None and self.p.todate is None:
+            return None
+        return date_index.lookup(self.p.dataname, self.p.fromdate, self.p.todate, dtformat=self.p.dtformat)
 
     def start(self):
+        window = self._index_window()
+        if self.p.vectorized:
+            # 跳过 CSVDataBase 的逐行读取，日期和 OHLC 一次解析完成，总行数取自同一次读取
+            bt.feeds.DataBase.start(self)
+            raw = None
+            if window is not None:
+                # 只读取表头和区间内的字节
+                with open(self.p.dataname, 'rb') as f:
+                    header = f.readline() if self.p.headers else b''
+                    f.seek(window['start_offset'])
+                    raw = header + f.read(window['end_offset'] - window['start_offset'])
+            columns, self.total_lines = read_csv_columns(
+                self.p.dataname, dtformat=self.p.dtformat, raw=raw, headers=self.p.headers, separator=self.p.separator,
+                datetime=self.p.datetime, open=self.p.open, high=self.p.high, low=self.p.low, close=self.p.close)
+            if window is not None:
+                self.total_lines = window['total_lines']
+            self._start_columns(columns)
+            return
+
         super().start()
+        if window is not None:
+            # 直接定位到区间的第一行，读完区间内的行就停止；总行数取自索引
+            self.total_lines = window['total_lines']
+            self.f.seek(window['start_offset'])
+            self._rows_left = window['rows']
+            return
+
         # 打开文件，计算行数
         with open(self.p.dataname, 'r') as f:
             self.total_lines = sum(1 for line in f)
 
+    def _load(self):
+        if self.p.vectorized:
+            return self._load_columns()
+        if self._rows_left is not None:
+            if self._rows_left <= 0:
+                return False
+            self._rows_left -= 1
+        return super()._load()
+
+    def preload(self):
+        if self.p.vectorized:
+            # 向量化模式没有打开的文件句柄，不需要 CSVDataBase 在预加载后关闭文件
+            return bt.feeds.DataBase.preload(self)
+        return super().preload()
+
     # 手动解析日期时间信息
     def _loadline(self, linetokens):
         dtfield = linetokens[self.p.datetime]
@@ -39,6 +164,28 @@ class MyCSVData(bt.feeds.GenericCSVData):
         self.lines.close[0] = float(linetokens[self.p.close])
 
         return True
-    
 
 
+class MyArrayData(ColumnsFeedMixin, bt.feeds.DataBase):
+    '''
+    从内存中的列数组读取 bar，不做逐行文本解析
+    dataname 为列数组字典：datetime（int64 纳秒）、open、high、low、close，可选 volume 和 dtnum（预先换算的 backtrader 日期数值）
+    total_lines 与 MyCSVData 的含义相同（数据文件总行数，含表头），不传则按 行数 + 1 计算
+    in_place 为 True 时直接从原数组读取 bar，不复制（见 shared_data）
+    '''
+    params = (
+        ('total_lines', None),
+        ('in_place', False),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(MyArrayData, self).__init__(*args, **kwargs)
+        columns = self.p.dataname
+        self.total_lines = self.p.total_lines if self.p.total_lines is not None else len(columns['close']) + 1
+
+    def start(self):
+        super().start()
+        self._start_columns(self.p.dataname, self.p.in_place)
+
+    def _load(self):
+        return self._load_columns()
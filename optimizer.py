@@ -0,0 +1,352 @@
+import itertools
+import math
+import os
+import random
+import time
+import pandas as pd
+from texttable import Texttable
+import config
+import shared_data
+from indicator_cache import dataset_key
+from result_store import ResultStore, run_key
+
+'''
+参数扫描
+对 config.sweep_params 中的参数网格做笛卡尔积，把 (参数组合 × 数据文件) 的回测任务分发到进程池，
+汇总总收益率、年化收益率、最大回撤、夏普比率，输出一张排名表
+开启 config.result_store_params 时每个组合完成后立即写入结果库，中断后重新运行会跳过已完成的组合
+开启 config.shared_data_params 时数据只在主进程读取一次、放入共享内存，工作进程挂载后直接使用（见 shared_data）
+config.sweep_settings['method'] 为 'halving' 时改用自适应的 successive halving：先用回测区间的前一小段评估全部候选，
+逐轮淘汰、加长数据，回撤或净值越过阈值的回测由 EarlyStop 分析器提前终止，最后报告相对完整网格节省的计算量
+'''
+
+output_dir = 'data'
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+METRICS = ['total_return', 'annual_return', 'max_drawdown', 'sharpe_ratio']
+
+# 每个工作进程内缓存已读取的数据（仅 fast 引擎使用）
+_loaded_data = {}
+# 每个工作进程内缓存回测区间的列数组（successive halving 的 backtrader 引擎使用）
+_window_data = {}
+
+
+def param_grid(grid):
+    # 把 {参数: [取值...]} 展开成参数字典列表
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def _fast_data(data_file):
+    # fast 引擎使用的列数组，优先取共享内存中的数据集，否则读取数据文件（每个工作进程只读取一次）
+    import fast_engine
+
+    if data_file not in _loaded_data:
+        shared = shared_data.get(data_file)
+        if shared is not None:
+            columns, _ = shared
+            _loaded_data[data_file] = dict(columns, datetime=columns['datetime'].view('datetime64[ns]'))
+        else:
+            _loaded_data[data_file] = fast_engine.load_arrays(data_file,
+                                                              fromdate=config.backtest_params['start_date'],
+                                                              todate=config.backtest_params['end_date'])
+    return _loaded_data[data_file]
+
+
+def _run_backtrader(name, data_file, params):
+    from main import add_data_and_run_strategy, run_strategy, collect_metrics
+    from strategy import VADStrategy
+
+    shared = shared_data.get(data_file)
+    if shared is not None and not config.profiling_params['enabled']:
+        # 直接在共享内存的数组上回测，不读取数据文件，数据源也不复制
+        columns, total_lines = shared
+        strat = run_strategy(VADStrategy, columns, total_lines, name, in_place=True, printlog=False, **params)[0]
+        return collect_metrics(strat)
+
+    results, _, _ = add_data_and_run_strategy(VADStrategy, data_file, name, 'VADStrategy', printlog=False, **params)
+    return collect_metrics(results[0])
+
+
+def _run_fast(name, data_file, params):
+    import fast_engine
+
+    data = _fast_data(data_file)
+    result = fast_engine.run_vad(data, **params)
+    metrics = fast_engine.analyze_values(result['values'], data['datetime'], result['start_value'])
+    metrics['trade_count'] = result['buy_count'] + result['sell_count']
+    return metrics
+
+
+def _run_batch(combos, data_files):
+    # batch 引擎：每个数据文件一次批量运行全部参数组合（batch_engine），行的顺序与 run_sweep 的任务一致
+    import batch_engine
+    import fast_engine
+
+    results = []
+    for _, data_file in data_files:
+        data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                       todate=config.backtest_params['end_date'])
+        results.append(batch_engine.run_grid(data, combos))
+
+    rows = []
+    for j, params in enumerate(combos):
+        for (name, _), metrics in zip(data_files, results):
+            row = {key: values[j].item() for key, values in metrics.items() if key not in ('buy_count', 'sell_count')}
+            row['trade_count'] = int(metrics['buy_count'][j] + metrics['sell_count'][j])
+            rows.append(_row(name, params, row))
+    return rows
+
+
+def _row(name, params, metrics):
+    row = {'data': name}
+    row.update(params)
+    row.update(metrics)
+    return row
+
+
+def _run_job(job):
+    # 进程池中执行的单个回测任务
+    engine, name, data_file, params = job
+    if engine == 'fast':
+        metrics = _run_fast(name, data_file, params)
+    else:
+        metrics = _run_backtrader(name, data_file, params)
+    return _row(name, params, metrics)
+
+
+def _run_budget_job(job):
+    # 在回测区间的前 fraction 部分运行一次 VADStrategy，回撤或净值越过阈值时提前终止
+    engine, name, data_file, params, fraction, stop = job
+    if engine == 'fast':
+        import fast_engine
+
+        data = _fast_data(data_file)
+        bars = max(1, math.ceil(len(data['close']) * fraction))
+        # 指标只依赖之前的 bar，前 bars 根的通道就是完整数据通道的前 bars 根
+        bands = fast_engine.vad_bands(data, params.get('k', config.vad_strategy_params['k']))
+        result = fast_engine.run_vad({key: values[:bars] for key, values in data.items()},
+                                     bands={key: values[:bars] for key, values in bands.items()},
+                                     stop_drawdown=stop['max_drawdown'], stop_equity=stop['min_equity'], **params)
+        metrics = fast_engine.analyze_values(result['values'], data['datetime'][:len(result['values'])],
+                                             result['start_value'])
+        metrics['trade_count'] = result['buy_count'] + result['sell_count']
+        metrics['stopped'] = result['stopped']
+        metrics['bars'] = len(result['values'])
+    else:
+        from main import load_data, run_strategy, collect_metrics
+        from strategy import VADStrategy
+
+        shared = shared_data.get(data_file)
+        if data_file not in _window_data:
+            _window_data[data_file] = shared if shared is not None else load_data(data_file)
+        columns, total_lines = _window_data[data_file]
+        bars = max(1, math.ceil(len(columns['close']) * fraction))
+        strat = run_strategy(VADStrategy, {key: values[:bars] for key, values in columns.items()}, total_lines, name,
+                             early_stop=stop, in_place=shared is not None, printlog=False, **params)[0]
+        metrics = collect_metrics(strat)
+        metrics.update(strat.analyzers.early_stop.get_analysis())
+    return _row(name, params, metrics)
+
+
+def _score(rows, sort_by):
+    # 候选参数在各数据文件上的平均指标（越大越好），任一数据文件上被提前终止或指标为 NaN 时排在最后
+    values = [row[sort_by] for row in rows]
+    if any(row['stopped'] for row in rows) or any(value is None or value != value for value in values):
+        return -math.inf
+    score = sum(values) / len(values)
+    return -score if sort_by == 'max_drawdown' else score
+
+
+def run_halving(grid=config.sweep_params, data_files=config.data_files,
+                engine=config.sweep_settings['engine'],
+                processes=config.sweep_settings['processes'],
+                sort_by=config.sweep_settings['sort_by'],
+                eta=config.halving_params['eta'],
+                min_fraction=config.halving_params['min_fraction'],
+                candidates=config.halving_params['candidates'],
+                seed=config.halving_params['seed'],
+                stop_drawdown=config.halving_params['stop_drawdown'],
+                stop_equity=config.halving_params['stop_equity']):
+    '''
+    successive halving 自适应参数优化
+    每一轮在回测区间的前 fraction 部分评估当前全部候选（每个候选在每个数据文件上各一次），按 sort_by 的平均值
+    保留最好的 1/eta，fraction 乘以 eta 进入下一轮，直到在完整区间上评估
+    :param candidates: 第一轮从 grid 的全部组合中随机抽取的个数，None 表示全部组合
+    :return: (最后一轮的 DataFrame，排序同 run_sweep；每一轮的统计；计算量统计)
+    '''
+    from main import load_data
+
+    combos = param_grid(grid)
+    grid_size = len(combos)
+    if candidates and candidates < len(combos):
+        combos = random.Random(seed).sample(combos, candidates)
+    stop = {'max_drawdown': stop_drawdown, 'min_equity': stop_equity}
+    window_bars = sum(len(load_data(data_file)[0]['close']) for _, data_file in data_files)
+    processes = processes or os.cpu_count()
+
+    rungs = []
+    fraction = min_fraction
+    with shared_data.process_pool(processes, data_files) as executor:
+        while True:
+            jobs = [(engine, name, data_file, params, fraction, stop) for params in combos for name, data_file in data_files]
+            chunksize = max(1, len(jobs) // (processes * 4))
+            rows = list(executor.map(_run_budget_job, jobs, chunksize=chunksize))
+            rungs.append({
+                'fraction': fraction,
+                'candidates': len(combos),
+                'runs': len(jobs),
+                'stopped': sum(1 for row in rows if row['stopped']),
+                'bars': sum(row['bars'] for row in rows)
+            })
+            if fraction >= 1:
+                break
+
+            # 每个候选的各数据文件结果在 rows 中相邻
+            groups = [rows[i:i + len(data_files)] for i in range(0, len(rows), len(data_files))]
+            scores = [_score(group, sort_by) for group in groups]
+            order = sorted(range(len(combos)), key=lambda i: scores[i], reverse=True)
+            combos = [combos[i] for i in order[:max(1, math.ceil(len(combos) / eta))]]
+            fraction = fraction * eta
+            if fraction > 1 - 1e-9:
+                fraction = 1.0
+
+    df = pd.DataFrame(rows).drop(columns=['bars'])
+    df = df.sort_values(sort_by, ascending=(sort_by == 'max_drawdown')).reset_index(drop=True)
+    df.index += 1
+
+    processed = sum(rung['bars'] for rung in rungs)
+    full = grid_size * window_bars
+    compute = {
+        'grid_runs': grid_size * len(data_files),
+        'runs': sum(rung['runs'] for rung in rungs),
+        'stopped': sum(rung['stopped'] for rung in rungs),
+        'grid_bars': full,
+        'bars': processed,
+        'saved': 1 - processed / full if full else 0.0
+    }
+    return df, rungs, compute
+
+
+def print_rungs(rungs, compute):
+    table = Texttable(max_width=0)
+    table.set_cols_dtype(['t'] * 5)
+    rows = [['数据比例', '候选数', '回测次数', '提前终止', '运行的 bar 数']]
+    for rung in rungs:
+        rows.append([f"{rung['fraction'] * 100:.1f}%", rung['candidates'], rung['runs'], rung['stopped'], f"{rung['bars']:,}"])
+    table.add_rows(rows)
+    print(table.draw())
+    print(f"共 {compute['runs']} 次回测（其中 {compute['stopped']} 次提前终止），完整网格需要 {compute['grid_runs']} 次；"
+          f"运行 {compute['bars']:,} 根 bar，完整网格需要 {compute['grid_bars']:,} 根，节省 {compute['saved'] * 100:.1f}% 的计算量")
+
+
+def job_keys(jobs):
+    # 每个任务在结果库中的键（数据按回测区间内的内容哈希，每个数据文件只读取一次）
+    import fast_engine
+    from main import load_data
+    from strategy import VADStrategy
+
+    data = {}
+    keys = []
+    for engine, name, data_file, params in jobs:
+        if data_file not in data:
+            columns, total_lines = load_data(data_file)
+            data[data_file] = (columns, total_lines, dataset_key(columns))
+        columns, total_lines, data_key = data[data_file]
+        target = fast_engine.run_vad if engine == 'fast' else VADStrategy
+        keys.append(run_key(columns, total_lines, target, params, data_key=data_key))
+    return keys
+
+
+def run_sweep(grid=config.sweep_params, data_files=config.data_files,
+              engine=config.sweep_settings['engine'],
+              processes=config.sweep_settings['processes'],
+              sort_by=config.sweep_settings['sort_by']):
+    '''
+    运行参数扫描
+    :param grid: 参数网格，{参数名: [取值...]}，参数名为 VADStrategy 的参数
+    :param data_files: [(名称, 文件路径)]
+    :param engine: 'backtrader'、'fast' 或 'batch'（单进程一次算完整个网格，不使用结果库）
+    :param processes: 进程数，None 表示使用全部 CPU 核
+    :param sort_by: 排名依据的指标
+    :return: 按 sort_by 降序排列的 DataFrame（最大回撤按升序）
+    '''
+    combos = param_grid(grid)
+    if engine == 'batch':
+        df = pd.DataFrame(_run_batch(combos, data_files))
+        df = df.sort_values(sort_by, ascending=(sort_by == 'max_drawdown')).reset_index(drop=True)
+        df.index += 1
+        return df
+
+    jobs = [(engine, name, data_file, params) for params in combos for name, data_file in data_files]
+    processes = processes or os.cpu_count()
+
+    store = ResultStore() if config.result_store_params['enabled'] else None
+    rows = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    if store is not None:
+        # 已完成的组合直接从结果库取回，中断后重新运行只补跑剩下的
+        keys = job_keys(jobs)
+        stored = store.get_metrics(keys)
+        for i in [i for i in pending if keys[i] in stored]:
+            rows[i] = _row(jobs[i][1], jobs[i][3], stored[keys[i]])
+        pending = [i for i in pending if keys[i] not in stored]
+        if len(pending) < len(jobs):
+            print(f'结果库中已有 {len(jobs) - len(pending)} 个组合，补跑其余 {len(pending)} 个')
+
+    # 每个进程一次领取一批任务，减少进程间通信开销
+    chunksize = max(1, len(pending) // (processes * 4))
+    try:
+        with shared_data.process_pool(processes, data_files) as executor:
+            for i, row in zip(pending, executor.map(_run_job, [jobs[i] for i in pending], chunksize=chunksize)):
+                rows[i] = row
+                if store is not None:
+                    metrics = {key: value for key, value in row.items() if key != 'data' and key not in jobs[i][3]}
+                    store.put(keys[i], jobs[i][1], 'VADStrategy', jobs[i][3], metrics)
+    finally:
+        if store is not None:
+            store.close()
+
+    df = pd.DataFrame(rows)
+    df = df.sort_values(sort_by, ascending=(sort_by == 'max_drawdown')).reset_index(drop=True)
+    df.index += 1
+    return df
+
+
+def print_ranking(df, top_n=config.sweep_settings['top_n']):
+    table = Texttable(max_width=0)
+    table.set_cols_align(['r'] + ['l'] * (len(df.columns)))
+    header = ['排名'] + list(df.columns)
+    rows = [header]
+    for rank, row in df.head(top_n).iterrows():
+        cells = [rank]
+        for column in df.columns:
+            value = row[column]
+            if column in METRICS and column != 'sharpe_ratio':
+                cells.append(f'{value * 100:.2f}%')
+            elif column == 'sharpe_ratio':
+                cells.append(f'{value:.2f}')
+            else:
+                cells.append(value)
+        rows.append(cells)
+    table.add_rows(rows)
+    print(table.draw())
+
+
+if __name__ == '__main__':
+    start = time.time()
+    if config.sweep_settings['method'] == 'halving':
+        df, rungs, compute = run_halving()
+        elapsed = time.time() - start
+        print(f'自适应参数优化完成：用时 {elapsed:.1f} 秒')
+        print_rungs(rungs, compute)
+    else:
+        df = run_sweep()
+        elapsed = time.time() - start
+        print(f'参数扫描完成：{len(df)} 次回测，用时 {elapsed:.1f} 秒')
+    print_ranking(df)
+
+    file_path = os.path.join(output_dir, 'sweep_results.csv')
+    df.to_csv(file_path, index_label='rank')
+    print(f'完整排名已写入 {file_path}')
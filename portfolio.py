@@ -0,0 +1,338 @@
+import time
+import numpy as np
+import pandas as pd
+from texttable import Texttable
+import config
+import fast_engine
+from data_cache import load_data_file
+
+'''
+多标的组合回测
+所有标的共用一个资金池，每个标的有自己的持仓和 DCA 状态（total_long_trades、last_dca_price）
+各标的的 bar 按时间并集对齐成 (bar 数, 标的数) 的二维数组，没有 bar 的位置为 NaN，内存和运行时间随标的数线性增长
+每根 bar 先撮合上一根 bar 的挂单，再按标的顺序判断信号；信号判断对全部标的向量化，只有触发信号的标的进入 Python 分支
+成交规则与 fast_engine / backtrader 的 BackBroker 一致，只有一个标的时结果与 fast_engine.run_vad 完全相同
+'''
+
+BUY, SELL = 1, -1
+
+
+def align(datasets, total_lines=None):
+    '''
+    把多个标的的列数组按时间对齐
+    :param datasets: [(名称, 列数组字典)]，datetime 为 int64 纳秒，可选 volume
+    :param total_lines: 每个标的数据文件的总行数（含表头，BuyAndHold 据此决定卖出的 bar），None 表示按 bar 数 + 1
+    :return: 对齐后的数组字典：names、datetime (T,)、open/high/low/close/volume (T, N)、has_bar (T, N)、total_lines (N,)
+    '''
+    names = [name for name, _ in datasets]
+    dt = np.unique(np.concatenate([np.asarray(columns['datetime'], dtype=np.int64) for _, columns in datasets]))
+    shape = (len(dt), len(datasets))
+    aligned = {'names': names, 'datetime': dt, 'has_bar': np.zeros(shape, dtype=bool)}
+    aligned['total_lines'] = np.array(total_lines if total_lines is not None
+                                      else [len(columns['close']) + 1 for _, columns in datasets], dtype=np.int64)
+    for key in ('open', 'high', 'low', 'close', 'volume'):
+        aligned[key] = np.full(shape, np.nan)
+
+    for n, (_, columns) in enumerate(datasets):
+        rows = np.searchsorted(dt, columns['datetime'])
+        aligned['has_bar'][rows, n] = True
+        for key in ('open', 'high', 'low', 'close'):
+            aligned[key][rows, n] = columns[key]
+        if 'volume' in columns:
+            aligned['volume'][rows, n] = columns['volume']
+    return aligned
+
+
+def _symbol_columns(aligned, n):
+    # 取出单个标的自己的 bar（不含对齐补出的空位）
+    rows = aligned['has_bar'][:, n]
+    return {
+        'datetime': aligned['datetime'][rows].view('datetime64[ns]'),
+        'open': aligned['open'][rows, n],
+        'high': aligned['high'][rows, n],
+        'low': aligned['low'][rows, n],
+        'close': aligned['close'][rows, n],
+        'volume': aligned['volume'][rows, n]
+    }
+
+
+def vad_band_matrix(aligned, k, vwma_period=config.indicator_params['vwma_period']):
+    '''
+    每个标的在自己的 bar 序列上计算 VADStrategy 的通道，再放回对齐后的位置
+    :return: upper、lower、k_atr (T, N)，以及每个标的的 bar 序号 bar_index (T, N)
+    '''
+    shape = aligned['close'].shape
+    bands = {key: np.full(shape, np.nan) for key in ('upper', 'lower', 'k_atr')}
+    bands['bar_index'] = np.cumsum(aligned['has_bar'], axis=0) - 1
+    for n in range(shape[1]):
+        rows = aligned['has_bar'][:, n]
+        symbol_bands = fast_engine.vad_bands(_symbol_columns(aligned, n), k, vwma_period)
+        for key in ('upper', 'lower', 'k_atr'):
+            bands[key][rows, n] = symbol_bands[key]
+    return bands
+
+
+class Portfolio(object):
+    '''
+    共用资金池的账户，撮合规则与 fast_engine.run_vad 相同
+    '''
+    def __init__(self, names, broker_params=config.broker_params):
+        n = len(names)
+        self.names = names
+        self.cash = float(broker_params['initial_cash'])
+        self.start_value = self.cash
+        self.commission = broker_params['commission_rate']
+        self.slippage = broker_params['slippage']
+        self.pos_size = np.zeros(n)
+        self.pos_price = np.zeros(n)
+        # 挂单：方向（0 表示没有）、数量、下单时的收盘价
+        self.pending_side = np.zeros(n, dtype=np.int8)
+        self.pending_size = np.zeros(n)
+        self.pending_price = np.zeros(n)
+        self.trades = []
+        self.pnl = []
+
+    def order(self, n, side, size, created_price):
+        self.pending_side[n] = side
+        self.pending_size[n] = size
+        self.pending_price[n] = created_price
+
+    def execute(self, n, dt, open_, high, low):
+        # 撮合标的 n 的挂单
+        side = self.pending_side[n]
+        size = float(self.pending_size[n])
+        created_price = float(self.pending_price[n])
+        self.pending_side[n] = 0
+        pos_size = float(self.pos_size[n])
+        pos_price = float(self.pos_price[n])
+
+        if side == BUY:
+            # 提交检查：按下单时的收盘价预估现金
+            check_cash = self.cash - abs(size) * created_price
+            check_cash -= abs(size) * self.commission * created_price
+            if check_cash < 0.0:
+                return
+            price = open_ * (1 + self.slippage)
+            if price > high:
+                price = high
+            new_cash = self.cash - abs(size) * price
+            new_cash -= abs(size) * self.commission * price
+            if new_cash < 0.0:
+                return
+            self.cash = new_cash
+            new_size = pos_size + size
+            self.pos_price[n] = price if not pos_size else (pos_price * pos_size + size * price) / new_size
+            self.pos_size[n] = new_size
+            trade = fast_engine._trade_info(dt, price, size, abs(size) * price, 0.0, True)
+        else:
+            price = open_ * (1 - self.slippage)
+            if price < low:
+                price = low
+            closed = -size
+            pnl = size * (price - pos_price) * 1.0
+            closed_value = abs(closed) * pos_price
+            self.cash += closed_value + pnl
+            self.cash -= abs(closed) * self.commission * price
+            self.pos_size[n] = 0.0
+            self.pos_price[n] = 0.0
+            trade = fast_engine._trade_info(dt, price, closed, closed_value, pnl, False)
+            trade['closed'] = True
+            self.pnl.append(pnl)
+        trade['symbol'] = self.names[n]
+        self.trades.append(trade)
+
+
+def run_portfolio(aligned, strategy='VADStrategy', k=config.vad_strategy_params['k'],
+                  base_order_amount=config.vad_strategy_params['base_order_amount'],
+                  dca_multiplier=config.vad_strategy_params['dca_multiplier'],
+                  number_of_dca_orders=config.vad_strategy_params['number_of_dca_orders'],
+                  vwma_period=config.indicator_params['vwma_period'],
+                  broker_params=config.broker_params):
+    '''
+    在一个资金池上对全部标的运行策略
+    :param aligned: align 的结果
+    :param strategy: 'VADStrategy'（每个标的独立的 DCA 状态）或 'BuyAndHold'（资金平均分配，每个标的第一根 bar 买入，
+                     与 BuyAndHoldStrategy 一样在该标的第 total_lines - 2 根 bar 下单卖出）
+    :return: trades（带 symbol 字段）、pnl、每根 bar 的组合净值 values、start_value、end_value、buy_count、sell_count
+    '''
+    names = aligned['names']
+    dts = aligned['datetime'].view('datetime64[ns]')
+    opens, highs, lows, closes = aligned['open'], aligned['high'], aligned['low'], aligned['close']
+    has_bar = aligned['has_bar']
+    count, symbols = closes.shape
+    account = Portfolio(names, broker_params)
+
+    if strategy == 'VADStrategy':
+        bands = vad_band_matrix(aligned, k, vwma_period)
+        upper, lower, k_atr = bands['upper'], bands['lower'], bands['k_atr']
+        # 每个标的自己的指标全部就绪后才开始判断信号
+        ready = bands['bar_index'] >= max(fast_engine.ATR_PERIOD + 1, vwma_period) - 1
+    else:
+        # 与 BuyAndHoldStrategy 一致：按 收盘价 * (1 + 佣金 + 滑点) 取整计算数量，每个标的分到同样的资金（只有一个标的时即全部现金）
+        budget = account.cash / symbols
+        cost_rate = 1 + broker_params['commission_rate'] + broker_params['slippage']
+        bar_index = np.cumsum(has_bar, axis=0) - 1
+        first_bar = has_bar & (bar_index == 0)
+        # 第 total_lines - 2 根 bar（len(self) 从 1 开始）下单卖出全部持仓，下一根 bar 成交；
+        # 回测区间短于数据文件时与 BuyAndHoldStrategy 一样不会卖出
+        sell_bar = has_bar & (bar_index == aligned['total_lines'] - 3)
+
+    total_long_trades = np.zeros(symbols, dtype=np.int64)
+    last_dca_price = np.zeros(symbols)
+    last_close = np.zeros(symbols)  # 每个标的最近的收盘价，用于计算没有 bar 时的持仓市值
+    values = np.empty(count)
+    buy_count = 0
+    sell_count = 0
+
+    for i in range(count):
+        bar = has_bar[i]
+        # 撮合挂单（按标的顺序）
+        for n in np.flatnonzero(account.pending_side != 0):
+            if bar[n]:
+                account.execute(n, dts[i], float(opens[i, n]), float(highs[i, n]), float(lows[i, n]))
+
+        close_row = closes[i]
+        np.copyto(last_close, close_row, where=bar)
+        values[i] = account.cash + float(np.dot(account.pos_size, last_close))
+
+        if strategy != 'VADStrategy':
+            for n in np.flatnonzero(first_bar[i]):
+                close = float(close_row[n])
+                size = int(budget / (close * cost_rate))
+                if size > 0 and size * close * cost_rate <= account.cash:
+                    account.order(n, BUY, size, close)
+            for n in np.flatnonzero(sell_bar[i] & (account.pos_size > 0)):
+                account.order(n, SELL, float(account.pos_size[n]), float(close_row[n]))
+            continue
+
+        # 信号对全部标的向量化判断，只处理触发了信号的标的
+        with np.errstate(invalid='ignore'):
+            long_signal = (close_row < lower[i]) & ready[i]
+            short_signal = (close_row > upper[i]) & ready[i]
+        for n in np.flatnonzero(long_signal | (short_signal & (account.pos_size > 0))):
+            close = float(close_row[n])
+            if long_signal[n] and total_long_trades[n] == 0:
+                # 开仓
+                account.order(n, BUY, base_order_amount / close, close)
+                last_dca_price[n] = base_order_amount
+                total_long_trades[n] = 1
+                buy_count += 1
+            elif long_signal[n] and 0 < total_long_trades[n] < number_of_dca_orders:
+                # 加仓
+                last_dca_price[n] *= dca_multiplier
+                account.order(n, BUY, float(last_dca_price[n]) / close, close)
+                total_long_trades[n] += 1
+                buy_count += 1
+
+            # 止盈止损
+            pos_size = float(account.pos_size[n])
+            if pos_size > 0 and short_signal[n]:
+                pos_price = float(account.pos_price[n])
+                band = float(k_atr[i, n])
+                if close - pos_price >= band * pos_size or close - pos_price <= - band * pos_size:
+                    account.order(n, SELL, pos_size, close)
+                    sell_count += 1
+
+    if strategy != 'VADStrategy':
+        # 与 BuyAndHoldStrategy 一样只计成交的订单（notify_order 的 Completed），现金不足被拒绝或来不及成交的不计
+        buy_count = sum(1 for trade in account.trades if trade['isbuy'])
+        sell_count = len(account.trades) - buy_count
+
+    return {
+        'trades': account.trades,
+        'pnl': account.pnl,
+        'values': values,
+        'start_value': account.start_value,
+        'end_value': float(values[-1]) if count else account.start_value,
+        'buy_count': buy_count,
+        'sell_count': sell_count
+    }
+
+
+def load_portfolio(data_files=config.portfolio_params['data_files']):
+    # 读取各数据文件、截取回测区间并对齐
+    from main import slice_backtest_window
+    loaded = [(name, load_data_file(data_file)) for name, data_file in data_files]
+    return align([(name, slice_backtest_window(columns)) for name, (columns, _) in loaded],
+                 total_lines=[total_lines for _, (_, total_lines) in loaded])
+
+
+def verify_single_symbol(data_file, volume=None, **params):
+    '''
+    只有一个标的时，组合回测的交易和净值应与 fast_engine.run_vad 完全相同
+    :param volume: 常数成交量（让 VWMA 有效、真正触发交易），None 表示与 MyCSVData 一致为 NaN
+    :return: 是否一致
+    '''
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                   todate=config.backtest_params['end_date'])
+    if volume is not None:
+        data['volume'] = np.full(len(data['close']), float(volume))
+    expected = fast_engine.run_vad(data, **params)
+
+    columns = {key: data[key] for key in ('open', 'high', 'low', 'close', 'volume')}
+    columns['datetime'] = data['datetime'].view(np.int64)
+    result = run_portfolio(align([('x', columns)]), **params)
+    same = len(result['trades']) == len(expected['trades']) and np.array_equal(result['values'], expected['values'])
+    for a, b in zip(result['trades'], expected['trades']):
+        same = same and all(a[key] == b[key] for key in ('date', 'price', 'size', 'value', 'pnl', 'isbuy'))
+    return same
+
+
+def synthetic_datasets(symbols, bars, seed=0):
+    # 生成 symbols 个随机游走标的（共同的 5 分钟交易时段，部分 bar 随机缺失），用于检查规模扩展
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range(end=config.backtest_params['end_date'], periods=-(-bars // 78))
+    dt = (sessions.values[:, None] + pd.Timedelta(hours=13, minutes=30).to_timedelta64()
+          + np.arange(78) * pd.Timedelta(minutes=5).to_timedelta64()).ravel()[:bars].view(np.int64)
+    datasets = []
+    for n in range(symbols):
+        keep = rng.random(bars) > 0.02
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, bars)))
+        open_ = np.append(close[0], close[:-1])
+        spread = np.abs(rng.normal(0, 0.001, bars)) * close
+        datasets.append((f'SYN{n}', {
+            'datetime': dt[keep],
+            'open': open_[keep],
+            'high': (np.maximum(open_, close) + spread)[keep],
+            'low': (np.minimum(open_, close) - spread)[keep],
+            'close': close[keep],
+            'volume': np.ones(int(keep.sum()))
+        }))
+    return datasets
+
+
+def print_results(results, aligned):
+    table = Texttable(max_width=0)
+    table.set_cols_dtype(['t'] * (len(results) + 1))
+    rows = [['分析项目'] + list(results)]
+    metrics = {name: fast_engine.analyze_values(result['values'], aligned['datetime'].view('datetime64[ns]'),
+                                                result['start_value']) for name, result in results.items()}
+    rows.append(['初始本金'] + [f"{result['start_value']:.2f}" for result in results.values()])
+    rows.append(['最终本金'] + [f"{result['end_value']:.2f}" for result in results.values()])
+    rows.append(['总收益率'] + [f"{metrics[name]['total_return'] * 100:.2f}%" for name in results])
+    rows.append(['年化收益率'] + [f"{metrics[name]['annual_return'] * 100:.2f}%" for name in results])
+    rows.append(['最大回撤'] + [f"{metrics[name]['max_drawdown'] * 100:.2f}%" for name in results])
+    rows.append(['夏普比率'] + [f"{metrics[name]['sharpe_ratio']:.2f}" for name in results])
+    rows.append(['总交易笔数'] + [result['buy_count'] + result['sell_count'] for result in results.values()])
+    table.add_rows(rows)
+    print(table.draw())
+
+
+if __name__ == '__main__':
+    aligned = load_portfolio()
+    print(f"组合回测：{len(aligned['names'])} 个标的（{', '.join(aligned['names'])}），对齐后 {len(aligned['datetime'])} 根 bar")
+    results = {strategy: run_portfolio(aligned, strategy=strategy) for strategy in config.portfolio_params['strategies']}
+    print_results(results, aligned)
+
+    for name, data_file in config.portfolio_params['data_files']:
+        same = verify_single_symbol(data_file, volume=1.0, k=0.5, base_order_amount=10000)
+        print(f'{name} 单标的组合回测与 fast_engine: {"一致" if same else "不一致"}')
+
+    # 规模扩展：标的数增加时，耗时和内存应大致线性增长
+    for symbols in config.portfolio_params['scaling_symbols']:
+        aligned = align(synthetic_datasets(symbols, config.portfolio_params['scaling_bars']))
+        memory = sum(value.nbytes for key, value in aligned.items() if key != 'names')
+        start = time.time()
+        result = run_portfolio(aligned, k=1.0, base_order_amount=1000)
+        print(f'{symbols} 个合成标的 × {len(aligned["datetime"])} 根 bar：用时 {time.time() - start:.2f} 秒，'
+              f'对齐数组 {memory / 2**20:.1f} MB，成交 {len(result["trades"])} 笔')
@@ -0,0 +1,133 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import config
+from data_cache import load_data_file, read_csv_columns
+
+'''
+多周期重采样
+只读取、解析一次最细周期的数据文件，15 分钟、60 分钟、4 小时、日线等更粗的周期在内存中向量化聚合得到
+每个交易时段（相邻 bar 的间隔超过 session_gap 即视为新时段）单独从时段开盘时刻起分桶，
+时段最后一个桶不足一个周期时保持不完整，与导出的 60 分钟数据一致（例如 19:30 的 bar 只包含半小时）
+bar 的时间为该桶的开始时刻，与数据文件的约定相同
+重采样结果按 (数据文件, 周期, 时段间隔) 缓存在内存中
+'''
+
+_cache = OrderedDict()
+
+
+def _to_ns(value):
+    return pd.Timedelta(value).value
+
+
+def resample_columns(columns, timeframe, session_gap=config.resample_params['session_gap']):
+    '''
+    把列数组聚合到更粗的周期
+    :param columns: 列数组字典，datetime 为 int64 纳秒（如 data_cache.read_csv_columns 的结果）
+    :param timeframe: 目标周期，pandas 的时间间隔写法，例如 '15min'、'4h'、'1D'；不短于交易时段时每个时段聚合为一根 bar
+    :param session_gap: 相邻 bar 间隔超过该值时视为新的交易时段
+    :return: 新的列数组字典，open 取桶内第一根，high/low 取最值，close 取最后一根，volume 求和
+    '''
+    dt = columns['datetime']
+    n = len(dt)
+    if n == 0:
+        return {key: values[:0].copy() for key, values in columns.items()}
+    freq = _to_ns(timeframe)
+    gap = _to_ns(session_gap)
+
+    # 交易时段的开始位置，以及每根 bar 所在时段的开盘时刻
+    new_session = np.empty(n, dtype=bool)
+    new_session[0] = True
+    np.greater(np.diff(dt), gap, out=new_session[1:])
+    session_id = np.cumsum(new_session) - 1
+    session_open = dt[new_session][session_id]
+
+    # 时段内从开盘时刻起按周期分桶，时段或桶变化处为新 bar 的起点
+    bucket = (dt - session_open) // freq
+    starts = np.empty(n, dtype=bool)
+    starts[0] = True
+    starts[1:] = new_session[1:] | (bucket[1:] != bucket[:-1])
+    first = np.flatnonzero(starts)
+    last = np.append(first[1:], n) - 1
+
+    result = {
+        'datetime': session_open[first] + bucket[first] * freq,
+        'open': np.asarray(columns['open'])[first],
+        'high': np.maximum.reduceat(columns['high'], first),
+        'low': np.minimum.reduceat(columns['low'], first),
+        'close': np.asarray(columns['close'])[last]
+    }
+    if 'volume' in columns:
+        result['volume'] = np.add.reduceat(columns['volume'], first)
+    return result
+
+
+def load_resampled(data_file, timeframe, session_gap=config.resample_params['session_gap'], base=None):
+    '''
+    读取数据文件并重采样到 timeframe，结果缓存在内存中（源文件大小或修改时间变化后重新计算）
+    :param base: 已读取的 (列数组字典, 总行数)，传入时不再读取文件
+    :return: (列数组字典, 总行数)，总行数按同样行数的 CSV（含表头）计算
+    '''
+    stat = os.stat(data_file)
+    key = (os.path.abspath(data_file), stat.st_size, stat.st_mtime_ns, _to_ns(timeframe), _to_ns(session_gap))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    columns, _ = base if base is not None else load_data_file(data_file)
+    resampled = resample_columns(columns, timeframe, session_gap)
+    for values in resampled.values():
+        values.setflags(write=False)
+    entry = (resampled, len(resampled['datetime']) + 1)
+    _cache[key] = entry
+    while len(_cache) > config.resample_params['maxsize']:
+        _cache.popitem(last=False)
+    return entry
+
+
+def timeframe_datasets(base_file=config.resample_params['base_file'],
+                       timeframes=config.resample_params['timeframes'],
+                       session_gap=config.resample_params['session_gap']):
+    '''
+    只解析一次 base_file，返回它和各个更粗周期的数据集
+    :return: [(名称, 列数组字典, 总行数)]，第一个为原始周期
+    '''
+    base = load_data_file(base_file)
+    name = os.path.splitext(os.path.basename(base_file))[0]
+    datasets = [(name, base[0], base[1])]
+    for timeframe in timeframes:
+        columns, total_lines = load_resampled(base_file, timeframe, session_gap, base=base)
+        datasets.append((f'{name}_{timeframe}', columns, total_lines))
+    return datasets
+
+
+def verify_against_file(base_file, data_file, timeframe, session_gap=config.resample_params['session_gap']):
+    '''
+    把 base_file 重采样到 timeframe，与直接导出的同周期数据文件 data_file 在重叠区间内逐根比较
+    :return: (是否一致, 比较的 bar 数)
+    '''
+    resampled, _ = load_resampled(base_file, timeframe, session_gap)
+    expected, _ = read_csv_columns(data_file)
+
+    # 只比较 base_file 覆盖的区间
+    dt = resampled['datetime']
+    start = np.searchsorted(expected['datetime'], dt[0], side='left')
+    end = np.searchsorted(expected['datetime'], dt[-1], side='right')
+    if end - start != len(dt) or not np.array_equal(expected['datetime'][start:end], dt):
+        return False, len(dt)
+    same = all(np.array_equal(expected[key][start:end], resampled[key]) for key in ('open', 'high', 'low', 'close'))
+    return same, len(dt)
+
+
+if __name__ == '__main__':
+    base_file = config.resample_params['base_file']
+    for timeframe, data_file in [('15min', os.path.join(config.data_dir, 'BATS_QQQ, 15.csv')),
+                                 ('60min', os.path.join(config.data_dir, 'BATS_QQQ, 60.csv'))]:
+        if not os.path.exists(data_file):
+            continue
+        same, bars = verify_against_file(base_file, data_file, timeframe)
+        print(f'{base_file} -> {timeframe} 与 {data_file} 比较 {bars} 根 bar：{"一致" if same else "不一致"}')
+
+    for name, columns, _ in timeframe_datasets():
+        print(f'{name}: {len(columns["datetime"])} 根 bar')
@@ -0,0 +1,184 @@
+import functools
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import os
+import sqlite3
+import time
+from types import SimpleNamespace
+import numpy as np
+import config
+import indicator_cache
+from trade_ledger import TradeLedger
+
+'''
+回测结果库
+每次回测按 数据内容 + 策略参数（含默认值）+ broker 参数 + 指标参数 + 策略源码 的哈希作为键，
+指标、买卖次数、交易台账和净值曲线保存在本地 SQLite 中；数据、config 和代码都没有变化时直接取回结果，不再回测
+参数扫描每完成一个组合就写入一次，中断后重新运行只会补跑没有完成的组合
+'''
+
+# 2：put_strategy 的指标带上 trade_count，与参数扫描保存的行一致
+STORE_VERSION = 2
+
+# 策略源码之外，同样会影响回测结果的模块
+SOURCE_MODULES = ('indicators', 'signals', 'LTanalyzer', 'trade_ledger', 'my_data')
+
+# backtrader 策略另外计入的模块：cerebro 的 broker 和分析器设置
+CEREBRO_MODULES = ('cerebro_setup',)
+
+# 不影响回测结果的策略参数，不参与哈希
+IGNORED_PARAMS = ('printlog', 'indicator_cache')
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash(target):
+    '''
+    策略源码的哈希
+    :param target: backtrader 策略类或 fast_engine.run_vad 这样的函数，都取所在模块的完整源码（含模块级的辅助函数和常量）
+    '''
+    digest = hashlib.sha1()
+    digest.update(inspect.getsource(inspect.getmodule(target)).encode('utf-8'))
+    for name in SOURCE_MODULES:
+        digest.update(inspect.getsource(importlib.import_module(name)).encode('utf-8'))
+    if inspect.isclass(target):
+        # backtrader 策略还要加上设置 broker（资金、佣金、滑点）和分析器的模块
+        for name in CEREBRO_MODULES:
+            digest.update(inspect.getsource(importlib.import_module(name)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def effective_params(target, params):
+    # 实际生效的参数：策略类 / 函数的默认值，再用传入的参数覆盖
+    if inspect.isclass(target):
+        merged = dict(target.params._getpairs())
+    else:
+        merged = {name: parameter.default for name, parameter in inspect.signature(target).parameters.items()
+                  if parameter.default is not inspect.Parameter.empty}
+    merged.update(params)
+    return {key: value for key, value in merged.items() if key not in IGNORED_PARAMS}
+
+
+def run_key(columns, total_lines, target, params=None, data_key=None):
+    '''
+    一次回测的键
+    :param columns: 回测区间内的列数组（按内容哈希，与数据来自 CSV、npz 还是重采样无关）
+    :param total_lines: 数据文件总行数（BuyAndHold 据此决定卖出的 bar）
+    :param target: 策略类，或 fast 引擎的 fast_engine.run_vad
+    :param data_key: 已算好的 indicator_cache.dataset_key(columns)，同一数据多次调用时传入
+    '''
+    payload = {
+        'version': STORE_VERSION,
+        'data': data_key or indicator_cache.dataset_key(columns),
+        'total_lines': total_lines,
+        'strategy': target.__name__,
+        'params': effective_params(target, params or {}),
+        'broker': config.broker_params,
+        'indicator': config.indicator_params,
+        'source': source_hash(target)
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class StoredStrategy(object):
+    '''
+    命中结果库时代替策略实例，提供 main 用到的 buy_count、sell_count 和
+    analyzers.longterm_trades / metrics / equity 的 get_analysis()
+    '''
+    def __init__(self, metrics, buy_count, sell_count, ledger, pnl, equity):
+        self.buy_count = buy_count
+        self.sell_count = sell_count
+        trades = {'trades': ledger.to_records(), 'pnl': pnl, 'ledger': ledger}
+        self.analyzers = SimpleNamespace(
+            longterm_trades=SimpleNamespace(get_analysis=lambda: trades),
+            metrics=SimpleNamespace(get_analysis=lambda: metrics),
+            equity=SimpleNamespace(get_analysis=lambda: equity)
+        )
+
+
+class ResultStore(object):
+    def __init__(self, path=config.result_store_params['path']):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+            key TEXT PRIMARY KEY,
+            data TEXT,
+            strategy TEXT,
+            params TEXT,
+            metrics TEXT,
+            buy_count INTEGER,
+            sell_count INTEGER,
+            ledger BLOB,
+            series BLOB,
+            created REAL)''')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def put(self, key, data, strategy, params, metrics, buy_count=0, sell_count=0, ledger=None, pnl=None, equity=None):
+        '''
+        保存一次回测的结果（立即提交，进程中断也不会丢失已完成的结果）
+        :param metrics: 指标字典（可 JSON 序列化）
+        :param ledger: 交易台账，参数扫描只保存指标时为 None
+        :param pnl: 已平仓交易的盈亏
+        :param equity: EquityCurve 的结果 {'datetime', 'value'}
+        '''
+        series = None
+        if pnl is not None or equity is not None:
+            buffer = io.BytesIO()
+            arrays = {'pnl': np.asarray(pnl if pnl is not None else [], dtype=np.float64)}
+            if equity is not None:
+                arrays['datetime'] = np.asarray(equity['datetime']).view(np.int64)
+                arrays['value'] = np.asarray(equity['value'], dtype=np.float64)
+            np.savez(buffer, **arrays)
+            series = buffer.getvalue()
+        self.conn.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            key, data, strategy, json.dumps(params, sort_keys=True, default=str), json.dumps(metrics),
+            int(buy_count), int(sell_count), ledger.to_bytes() if ledger is not None else None, series, time.time()))
+        self.conn.commit()
+
+    def get_metrics(self, keys):
+        # 批量查询指标：{键: 指标字典}，只包含已保存的键
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(f'SELECT key, metrics FROM runs WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            found.update((key, json.loads(metrics)) for key, metrics in rows)
+        return found
+
+    def get(self, key):
+        # 完整结果，没有时返回 None；没有保存台账或净值曲线的结果（参数扫描）不能用于代替策略实例
+        row = self.conn.execute('SELECT metrics, buy_count, sell_count, ledger, series FROM runs WHERE key = ?',
+                                (key,)).fetchone()
+        if row is None or row[3] is None or row[4] is None:
+            return None
+        metrics, buy_count, sell_count, ledger, series = row
+        with np.load(io.BytesIO(series)) as arrays:
+            pnl = arrays['pnl'].tolist()
+            equity = {'datetime': arrays['datetime'].view('datetime64[ns]'), 'value': arrays['value']}
+        return StoredStrategy(json.loads(metrics), buy_count, sell_count, TradeLedger.from_bytes(ledger), pnl, equity)
+
+    def put_strategy(self, key, data, strat, params=None):
+        # 保存 run_strategy 得到的策略实例的全部结果，指标与 main.collect_metrics 相同（含 trade_count），
+        # 参数扫描用 get_metrics 取回时与新跑的行字段一致
+        trades = strat.analyzers.longterm_trades.get_analysis()
+        metrics = dict(strat.analyzers.metrics.get_analysis())
+        metrics['trade_count'] = strat.buy_count + strat.sell_count
+        self.put(key, data, type(strat).__name__, params or {}, metrics,
+                 strat.buy_count, strat.sell_count, trades['ledger'], trades['pnl'],
+                 strat.analyzers.equity.get_analysis())
@@ -0,0 +1,188 @@
+import math
+import numpy as np
+import pandas as pd
+from texttable import Texttable
+import config
+
+'''
+蒙特卡洛 / bootstrap 稳健性分析
+一次回测只给出一条实际的交易序列和净值曲线，这里在不重新回测的前提下生成大量模拟路径：
+交易盈亏：打乱顺序（permutation）或有放回抽样（bootstrap），得到期末收益率和最大回撤的分布
+逐 bar 收益率：循环块 bootstrap（保留块内的自相关），得到期末收益率、最大回撤和夏普比率的分布
+所有模拟按批次以二维数组一次计算（每行一条路径），内存占用受 batch_size 限制
+'''
+
+STATS = ['final_return', 'max_drawdown', 'sharpe_ratio']
+
+
+def _max_drawdown(equity):
+    # 每行一条净值路径，返回每条路径的最大回撤
+    peak = np.maximum.accumulate(equity, axis=1)
+    return np.max(1 - equity / peak, axis=1)
+
+
+def _batches(simulations, batch_size):
+    done = 0
+    while done < simulations:
+        size = min(batch_size, simulations - done)
+        yield size
+        done += size
+
+
+def simulate_trades(pnl, start_value, method='bootstrap', simulations=config.robustness_params['simulations'],
+                    batch_size=config.robustness_params['batch_size'], seed=config.robustness_params['seed']):
+    '''
+    对已平仓交易的盈亏做模拟
+    :param pnl: 每笔已平仓交易的盈亏（LongTermTradeAnalyzer 的 pnl）
+    :param method: 'bootstrap' 有放回抽样，'shuffle' 只打乱顺序（期末收益率不变，回撤随顺序变化）
+    :return: {'final_return': 数组, 'max_drawdown': 数组}，每个元素对应一条模拟路径
+    '''
+    pnl = np.asarray(pnl, dtype=np.float64)
+    if not len(pnl):
+        return {'final_return': np.zeros(simulations), 'max_drawdown': np.zeros(simulations)}
+    rng = np.random.default_rng(seed)
+    final_return = np.empty(simulations)
+    max_drawdown = np.empty(simulations)
+
+    done = 0
+    for size in _batches(simulations, batch_size):
+        if method == 'shuffle':
+            paths = rng.permuted(np.broadcast_to(pnl, (size, len(pnl))), axis=1)
+        else:
+            paths = pnl[rng.integers(0, len(pnl), size=(size, len(pnl)))]
+        # 净值路径包含起点，回撤从初始资金开始计算
+        equity = np.empty((size, len(pnl) + 1))
+        equity[:, 0] = start_value
+        np.cumsum(paths, axis=1, out=equity[:, 1:])
+        equity[:, 1:] += start_value
+        final_return[done:done + size] = equity[:, -1] / start_value - 1
+        max_drawdown[done:done + size] = _max_drawdown(equity)
+        done += size
+    return {'final_return': final_return, 'max_drawdown': max_drawdown}
+
+
+def block_indices(rng, size, n, block_length):
+    # 循环块 bootstrap 的下标：每条路径由随机起点的连续块拼接而成，超出末尾时绕回开头
+    blocks = -(-n // block_length)
+    starts = rng.integers(0, n, size=(size, blocks))
+    indices = (starts[:, :, None] + np.arange(block_length)) % n
+    return indices.reshape(size, blocks * block_length)[:, :n]
+
+
+def simulate_returns(returns, periods_per_year, simulations=config.robustness_params['simulations'],
+                     block_length=config.robustness_params['block_length'],
+                     batch_size=config.robustness_params['batch_size'], seed=config.robustness_params['seed'],
+                     risk_free_rate=0.02):
+    '''
+    对逐 bar 收益率做循环块 bootstrap
+    :param returns: 每根 bar 的收益率
+    :param periods_per_year: 每年的 bar 数，用于年化夏普比率（与 LTanalyzer.summarize_metrics 的算法一致）
+    :return: {'final_return', 'max_drawdown', 'sharpe_ratio'}，每个元素对应一条模拟路径
+    '''
+    returns = np.asarray(returns, dtype=np.float64)
+    n = len(returns)
+    result = {key: np.zeros(simulations) for key in STATS}
+    if not n:
+        return result
+    rng = np.random.default_rng(seed)
+    block_length = max(1, min(block_length, n))
+
+    done = 0
+    for size in _batches(simulations, batch_size):
+        paths = returns[block_indices(rng, size, n, block_length)]
+        equity = np.cumprod(1 + paths, axis=1)
+        result['final_return'][done:done + size] = equity[:, -1] - 1
+        result['max_drawdown'][done:done + size] = np.maximum(0, _max_drawdown(equity))
+
+        result['sharpe_ratio'][done:done + size] = sharpe_ratio(paths, periods_per_year, risk_free_rate)
+        done += size
+    return result
+
+
+def sharpe_ratio(returns, periods_per_year, risk_free_rate=0.02):
+    # 每行一条收益率路径，返回每条路径的年化夏普比率（与 LTanalyzer.summarize_metrics 的算法一致）
+    returns = np.atleast_2d(returns)
+    annualized_return = (returns.mean(axis=1) - risk_free_rate / periods_per_year) * periods_per_year
+    annualized_volatility = returns.std(axis=1) * math.sqrt(periods_per_year)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(annualized_volatility != 0, annualized_return / annualized_volatility, 0)
+
+
+def bar_returns(dts, values):
+    '''
+    由净值曲线得到逐 bar 收益率和每年的 bar 数
+    :param dts: 每根 bar 的时间（datetime64）
+    :param values: 每根 bar 的净值（EquityCurve 分析器或 fast_engine.run_vad 的 values）
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    returns = np.diff(values) / values[:-1] if len(values) > 1 else np.empty(0)
+    days = (pd.Timestamp(dts[-1]) - pd.Timestamp(dts[0])).total_seconds() / 86400 if len(dts) > 1 else 0
+    periods_per_year = len(returns) / (days / 365.0) if days > 0 and len(returns) else 252 * 2
+    return returns, periods_per_year
+
+
+def distribution(samples, actual=None, percentiles=config.robustness_params['percentiles']):
+    # 模拟结果的分位数、均值，以及实际值在模拟分布中的分位
+    row = {f'p{p}': float(np.percentile(samples, p)) for p in percentiles}
+    row['mean'] = float(np.mean(samples))
+    if actual is not None:
+        row['actual'] = actual
+        row['actual_rank'] = float(np.mean(samples <= actual))
+    return row
+
+
+def analyze(pnl, dts, values, start_value, simulations=config.robustness_params['simulations']):
+    '''
+    对一次回测的结果做完整的稳健性分析
+    :param pnl: 已平仓交易的盈亏
+    :param dts, values: 净值曲线
+    :return: {(模拟方式, 指标): 分布}
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    returns, periods_per_year = bar_returns(dts, values)
+    report = {}
+
+    actual_return = float(np.sum(pnl)) / start_value if len(pnl) else 0.0
+    for method in ('bootstrap', 'shuffle'):
+        simulated = simulate_trades(pnl, start_value, method=method, simulations=simulations)
+        for key in ('final_return', 'max_drawdown'):
+            report[(f'trades_{method}', key)] = distribution(simulated[key], actual_return if key == 'final_return' else None)
+
+    simulated = simulate_returns(returns, periods_per_year, simulations=simulations)
+    actual = {}
+    if len(values):
+        peak = np.maximum.accumulate(values)
+        actual = {'final_return': float(values[-1] / values[0] - 1),
+                  'max_drawdown': float(np.max((peak - values) / peak)),
+                  'sharpe_ratio': float(sharpe_ratio(returns, periods_per_year)[0]) if len(returns) > 1 else 0.0}
+    for key in STATS:
+        report[('bars_block_bootstrap', key)] = distribution(simulated[key], actual.get(key))
+    return report
+
+
+def print_report(report, percentiles=config.robustness_params['percentiles']):
+    table = Texttable(max_width=0)
+    table.set_cols_dtype(['t'] * (len(percentiles) + 5))
+    rows = [['模拟方式', '指标'] + [f'P{p}' for p in percentiles] + ['均值', '实际值', '实际值分位']]
+    for (method, key), row in report.items():
+        fmt = (lambda v: f'{v:.2f}') if key == 'sharpe_ratio' else (lambda v: f'{v * 100:.2f}%')
+        rows.append([method, key] + [fmt(row[f'p{p}']) for p in percentiles] + [fmt(row['mean'])]
+                    + [fmt(row['actual']) if 'actual' in row else '', f"{row['actual_rank'] * 100:.0f}%" if 'actual_rank' in row else ''])
+    table.add_rows(rows)
+    print(table.draw())
+
+
+if __name__ == '__main__':
+    import time
+    from main import run_strategies, strategies
+
+    for name, data_file in config.data_files:
+        strats = run_strategies(data_file, name)
+        for strategy_name, _, _ in strategies:
+            strat = strats[strategy_name]
+            pnl = strat.analyzers.longterm_trades.get_analysis()['pnl']
+            equity = strat.analyzers.equity.get_analysis()
+            start = time.time()
+            report = analyze(pnl, equity['datetime'], equity['value'], config.broker_params['initial_cash'])
+            print(f'\n{name} {strategy_name} 稳健性分析（{config.robustness_params["simulations"]} 次模拟，用时 {time.time() - start:.1f} 秒）:')
+            print_report(report)
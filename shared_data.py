@@ -0,0 +1,215 @@
+import contextlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import config
+import indicator_cache
+from my_data import MyArrayData, datetime_to_num
+
+'''
+共享内存数据集
+主进程把每个数据文件回测区间的列数组（datetime、OHLC、volume，以及预先换算的 backtrader 日期数值 dtnum）
+和 config.shared_data_params['indicators'] 中的指标数组，按 64 字节对齐依次放入一个命名的共享内存块，只放一次
+工作进程（ProcessPoolExecutor 的 initializer=init_worker）按清单只读挂载，得到的 numpy 数组直接指向共享内存，
+指标数组放入 indicator_cache，MyArrayData(in_place=True) 逐根读取时也不复制，
+因此无论多少个工作进程，机器上只有一份数据，工作进程启动时也不再读取、解析数据文件
+'''
+
+ALIGNMENT = 64
+
+# 工作进程中已挂载的数据集：数据文件 -> (列数组字典, 总行数)
+_datasets = {}
+# 挂载的共享内存块，进程存活期间保持映射
+_blocks = []
+
+
+class DatasetRegistry(object):
+    '''
+    主进程中的数据集注册表，manifest 为可 pickle 的清单，传给工作进程挂载
+    用法：with DatasetRegistry() as registry: registry.publish(...); ProcessPoolExecutor(initializer=init_worker, initargs=(registry.manifest,))
+    '''
+    def __init__(self, prefix=None):
+        self.prefix = prefix or f'atr_{os.getpid()}'
+        self.blocks = []
+        self.manifest = {}  # 数据文件 -> {'block', 'total_lines', 'key', 'arrays': {名称: (偏移, dtype, 长度)}, 'indicators': [(指标名, 周期, 数组名)]}
+
+    def publish(self, data_file, columns, total_lines, indicators=config.shared_data_params['indicators']):
+        '''
+        把一个数据集放入共享内存
+        :param columns: 回测区间内的列数组字典（main.load_data 的结果）
+        :param indicators: [(indicator_cache 中的指标名, 周期)]，重复的只放一次
+        '''
+        arrays = {name: np.ascontiguousarray(values) for name, values in columns.items()}
+        if 'volume' not in arrays:
+            # 与 MyCSVData 和 fast_engine.load_arrays 一致，没有成交量时为 NaN
+            arrays['volume'] = np.full(len(arrays['close']), np.nan)
+        key = indicator_cache.dataset_key(arrays)
+        entries = []
+        for name, period in dict.fromkeys(indicators):
+            array_name = f'{name}_{period}'
+            arrays[array_name] = indicator_cache.get_indicator(arrays, name, period, key=key)
+            entries.append((name, period, array_name))
+        arrays['dtnum'] = datetime_to_num(arrays['datetime'])
+
+        layout = {}
+        size = 0
+        for name, values in arrays.items():
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout[name] = (size, values.dtype.str, len(values))
+            size += values.nbytes
+        block = shared_memory.SharedMemory(name=f'{self.prefix}_{len(self.blocks)}', create=True, size=max(size, 1))
+        self.blocks.append(block)
+        for name, values in arrays.items():
+            offset, dtype, length = layout[name]
+            np.ndarray(length, dtype=dtype, buffer=block.buf, offset=offset)[:] = values
+
+        self.manifest[data_file] = {
+            'block': block.name,
+            'total_lines': total_lines,
+            'key': key,
+            'arrays': layout,
+            'indicators': entries
+        }
+
+    def nbytes(self):
+        return sum(block.size for block in self.blocks)
+
+    def close(self):
+        # 关闭并删除全部共享内存块（已挂载的工作进程在退出前仍可读取）
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_registry(data_files=config.data_files, indicators=config.shared_data_params['indicators'], loader=None):
+    '''
+    读取每个数据文件并放入共享内存
+    :param loader: 读取函数，返回 (列数组字典, 总行数)，默认为 main.load_data（回测区间）
+    '''
+    if loader is None:
+        from main import load_data as loader
+
+    registry = DatasetRegistry()
+    try:
+        for _, data_file in data_files:
+            columns, total_lines = loader(data_file)
+            registry.publish(data_file, columns, total_lines, indicators)
+    except Exception:
+        registry.close()
+        raise
+    return registry
+
+
+@contextlib.contextmanager
+def process_pool(processes, data_files=config.data_files, indicators=config.shared_data_params['indicators'],
+                 loader=None):
+    '''
+    进程池：开启 config.shared_data_params 时先把 data_files 放入共享内存，工作进程启动时挂载，用完后删除共享内存块
+    工作进程中用 get(data_file) 取数据集，没有开启时 get 返回 None，按原来的方式读取数据文件
+    '''
+    registry = load_registry(data_files, indicators, loader) if config.shared_data_params['enabled'] else None
+    try:
+        manifest = registry.manifest if registry is not None else {}
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(manifest,)) as executor:
+            yield executor
+    finally:
+        if registry is not None:
+            registry.close()
+
+
+def attach(manifest):
+    '''
+    在工作进程中只读挂载清单中的全部数据集，指标数组放入 indicator_cache
+    :return: {数据文件: (列数组字典, 总行数)}，列数组包含 datetime（int64 纳秒）、OHLC、volume 和 dtnum
+    '''
+    datasets = {}
+    for data_file, entry in manifest.items():
+        # 进程池的工作进程与主进程共用 resource_tracker，挂载时的重复登记不会导致提前删除，删除由主进程的 DatasetRegistry 负责
+        block = shared_memory.SharedMemory(name=entry['block'])
+        _blocks.append(block)
+        arrays = {}
+        for name, (offset, dtype, length) in entry['arrays'].items():
+            values = np.ndarray(length, dtype=dtype, buffer=block.buf, offset=offset)
+            values.setflags(write=False)
+            arrays[name] = values
+        for name, period, array_name in entry['indicators']:
+            indicator_cache.put_indicator(entry['key'], name, period, arrays.pop(array_name))
+        datasets[data_file] = (arrays, entry['total_lines'])
+    return datasets
+
+
+def init_worker(manifest):
+    # ProcessPoolExecutor 的 initializer：挂载共享数据集
+    _datasets.update(attach(manifest))
+
+
+def get(data_file):
+    # 工作进程中已挂载的数据集 (列数组字典, 总行数)，没有时返回 None
+    return _datasets.get(data_file)
+
+
+def feed(data_file, **kwargs):
+    # 把已挂载的数据集包装成 backtrader 数据源，直接读取共享内存，不复制
+    columns, total_lines = _datasets[data_file]
+    return MyArrayData(dataname=columns, total_lines=total_lines, in_place=True, **kwargs)
+
+
+def _private_memory():
+    # 当前进程的私有内存（Private_Clean + Private_Dirty，字节），共享内存的页不计入
+    total = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def _measure_job(job):
+    # 在工作进程中运行一次 VADStrategy，返回 (净值, 运行后的私有内存)
+    from main import load_data, run_strategy
+    from strategy import VADStrategy
+
+    name, data_file = job
+    shared = get(data_file)
+    if shared is not None:
+        columns, total_lines = shared
+        strat = run_strategy(VADStrategy, columns, total_lines, name, in_place=True, printlog=False)[0]
+    else:
+        columns, total_lines = load_data(data_file)
+        strat = run_strategy(VADStrategy, columns, total_lines, name, printlog=False)[0]
+    return strat.broker.getvalue(), _private_memory()
+
+
+if __name__ == '__main__':
+    import time
+    import benchmark
+
+    # 一个 50 万根 bar 的合成数据文件，每个工作进程都在上面运行一次回测，比较工作进程的私有内存
+    workers = 4
+    data_file = benchmark.synthetic_file(500000)
+    jobs = [('synthetic', data_file)] * workers
+
+    for shared in (False, True):
+        start = time.time()
+        registry = load_registry([('synthetic', data_file)]) if shared else None
+        nbytes = registry.nbytes() if shared else 0
+        try:
+            initargs = (registry.manifest,) if shared else ({},)
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+                results = list(executor.map(_measure_job, jobs))
+        finally:
+            if registry is not None:
+                registry.close()
+        values = {value for value, _ in results}
+        private = [memory / 1024 ** 2 for _, memory in results]
+        label = f'共享内存（数据块 {nbytes / 1024 ** 2:.0f} MB）' if shared else '各自读取'
+        print(f'{label}：{workers} 个工作进程，用时 {time.time() - start:.1f} 秒，'
+              f'每个进程私有内存 {min(private):.0f}-{max(private):.0f} MB，最终净值 {sorted(values)}')
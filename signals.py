@@ -0,0 +1,44 @@
+import numpy as np
+import config
+import indicator_cache
+
+'''
+策略信号预计算
+策略在回测开始前对整个序列一次算好信号数组（与数据逐 bar 对齐），next 中只按下标读取、处理下单
+指标数组来自 indicator_cache，参数扫描时同一数据集不会重复计算
+'''
+
+
+def target_percent(x, ema, atr, atr_multiplier=config.atr_regression_params['atr_multiplier']):
+    '''
+    AR_Strategy 的目标仓位比例 y（%），x、ema、atr 可以是标量或数组
+    价格高于 ema + atr_multiplier * atr 时为 50，低于 ema - atr_multiplier * atr 时为 200，
+    否则按 delta_atr = (x - ema) / atr 分档：高于均线每 2 个 atr 减少 5%，低于均线每 2 个 atr 增加 10%
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_atr = (x - ema) / atr
+        y = np.where(delta_atr > 0, 100 - 5 * (delta_atr // 2), 100 + 10 * (np.abs(delta_atr) // 2))
+        y = np.where(x <= ema - atr_multiplier * atr, 200, y)
+        y = np.where(x >= ema + atr_multiplier * atr, 50, y)
+    return y
+
+
+def ar_signals(columns, ema_period=config.atr_regression_params['ema_period'],
+               atr_period=config.atr_regression_params['atr_period'],
+               atr_multiplier=config.atr_regression_params['atr_multiplier'], key=None):
+    '''
+    AR_Strategy 的全部信号
+    :param columns: 列数组字典
+    :param key: indicator_cache.dataset_key，不传则按内容计算
+    :return: {'ema', 'atr', 'delta_atr', 'y'}，指标未就绪的位置为 NaN
+    '''
+    key = key or indicator_cache.dataset_key(columns)
+    close = np.asarray(columns['close'], dtype=np.float64)
+    ema = indicator_cache.get_indicator(columns, 'ema', ema_period, key=key)
+    atr = indicator_cache.get_indicator(columns, 'atr', atr_period, key=key)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_atr = (close - ema) / atr
+    signals = {'ema': ema, 'atr': atr, 'delta_atr': delta_atr, 'y': target_percent(close, ema, atr, atr_multiplier)}
+    for values in signals.values():
+        values.setflags(write=False)
+    return signals
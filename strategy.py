@@ -1,22 +1,41 @@
 import backtrader as bt
 import config
-from indicators import VWMA
+from indicators import VWMA, ArrayATR, ArrayEMA, ArrayVWMA
+from my_data import MyArrayData
+import indicator_cache
+import signals
 
 '''
 策略
 '''
 
+def _cacheable_data(data):
+    # 只有列数组数据源、且没有在 backtrader 内部再按日期过滤时，预先算好的数组才与 bar 逐根对齐
+    return isinstance(data, MyArrayData) and data.p.fromdate is None and data.p.todate is None
+
+
 class VADStrategy(bt.Strategy):
     params = (
         ('k', config.vad_strategy_params['k']),
         ('base_order_amount', config.vad_strategy_params['base_order_amount']),
         ('dca_multiplier', config.vad_strategy_params['dca_multiplier']),
-        ('number_of_dca_orders', config.vad_strategy_params['number_of_dca_orders'])
+        ('number_of_dca_orders', config.vad_strategy_params['number_of_dca_orders']),
+        ('printlog', True),  # 参数扫描时关闭逐笔输出
+        ('indicator_cache', config.indicator_cache_params['enabled'])
     )
 
     def __init__(self):
-        self.atr = bt.indicators.ATR(self.data, period=14) #这个要改成 Indicator里的指标
-        self.vwma = VWMA(self.data, period=config.indicator_params['vwma_period'])
+        vwma_period = config.indicator_params['vwma_period']
+        if self.params.indicator_cache and self._cacheable_data():
+            # 从指标缓存取预先算好的数组，参数扫描时同一数据集的 ATR、VWMA 只计算一次
+            columns = self.data.p.dataname
+            key = indicator_cache.dataset_key(columns)
+            self.atr = ArrayATR(self.data, values=indicator_cache.get_indicator(columns, 'atr', 14, key=key), minperiod=14 + 1)
+            self.vwma = ArrayVWMA(self.data, values=indicator_cache.get_indicator(columns, 'vwma', vwma_period, key=key),
+                                  minperiod=vwma_period)
+        else:
+            self.atr = bt.indicators.ATR(self.data, period=14) #这个要改成 Indicator里的指标
+            self.vwma = VWMA(self.data, period=vwma_period)
         self.k_atr = self.params.k * self.atr
         self.take_profit_percent = self.params.k * self.atr
         self.stop_loss_percent = self.params.k * self.atr
@@ -26,6 +45,9 @@ class VADStrategy(bt.Strategy):
         self.buy_count = 0
         self.sell_count = 0
 
+    def _cacheable_data(self):
+        return _cacheable_data(self.data)
+
     def next(self):
         vwma_above = self.vwma.vwma[0] + self.k_atr[0]
         vwma_below = self.vwma.vwma[0] - self.k_atr[0]
@@ -68,6 +90,8 @@ class VADStrategy(bt.Strategy):
                 self.log(f'Sell order (Stop Loss): Size={self.position.size}, Price={self.data.close[0]}')
 
     def log(self, txt, dt=None):
+        if not self.params.printlog:
+            return
         dt = dt or self.datas[0].datetime.date(0)
         print(f'{dt.isoformat()}, {txt}')
 
@@ -85,8 +109,9 @@ class BuyAndHoldStrategy(bt.Strategy):
         if len(self) == 1 and not self.position and not self.buy_executed:
             cash = self.broker.get_cash()
             close_price = self.data.close[0]
-            commission_rate = config.broker_params['commission_rate']
-            slippage_rate = config.broker_params['slippage']
+            # 佣金、滑点取自本次回测的 broker（main.run_strategy 可以传入不同于 config 的成本参数）
+            commission_rate = self.broker.getcommissioninfo(self.data).p.commission
+            slippage_rate = self.broker.p.slip_perc
 
             # 计算总成本
             size = int(cash / (close_price * (1 + commission_rate + slippage_rate)))
@@ -122,78 +147,83 @@ class BuyAndHoldStrategy(bt.Strategy):
         print(f'{dt.isoformat()}, {txt}')
 
 
-# class AR_Strategy(bt.Strategy):
-#     params = config.atr_regression_params
-
-#     def __init__(self):
-#         self.ema = bt.indicators.ExponentialMovingAverage(self.data.close, period=config.strategy_params['ema_period'])
-#         self.atr = bt.indicators.AverageTrueRange(self.data, period=config.strategy_params['atr_period'])
-#         self.order = None
-#         self.buy_count = 0  
-#         self.sell_count = 0 
-#         self.last_trade_price = None  # 记录上一次交易的价格
-
-#     def calculate_y(self, x, ema200, atr):
-#         # 计算目标仓位比例 y
-#         atr_multiplier = config.strategy_params['atr_multiplier']
-#         if x >= ema200 + atr_multiplier * atr:
-#             return 50  # 如果价格x高于 ema200 + atr_multiplier * atr, 返回50%
-#         elif x <= ema200 - atr_multiplier * atr:
-#             return 200  # 如果价格x低于 ema200 - atr_multiplier * atr, 返回200%
-#         else:
-#             delta_atr = (x - ema200) / atr  # 当前价格与均线之间的差值相对于 ATR 的倍数
-#             if delta_atr > 0: # 如果delta为正，则价格高于ema200，目标仓位要减少
-#                 return 100 - 5 * (delta_atr // 2) # 每2个atr，仓位减少5%
-#             else:
-#                 return 100 + 10 * (abs(delta_atr) // 2) # 每2个atr，仓位增加10%
-
-#     def next(self):
-#         # 检查是否有活动订单，如果有则跳过
-#         if self.order:
-#             return
+class AR_Strategy(bt.Strategy):
+    params = (
+        ('ema_period', config.atr_regression_params['ema_period']),
+        ('atr_period', config.atr_regression_params['atr_period']),
+        ('atr_multiplier', config.atr_regression_params['atr_multiplier']),
+        ('indicator_cache', config.indicator_cache_params['enabled'])
+    )
+
+    def __init__(self):
+        if self.params.indicator_cache and _cacheable_data(self.data):
+            # 回测前对整个序列一次算好 EMA、ATR、delta_atr 和目标仓位比例 y，next 只按下标读取并处理下单
+            self.signals = signals.ar_signals(self.data.p.dataname, self.params.ema_period, self.params.atr_period,
+                                              self.params.atr_multiplier)
+            self.ema = ArrayEMA(self.data, values=self.signals['ema'], minperiod=self.params.ema_period)
+            self.atr = ArrayATR(self.data, values=self.signals['atr'], minperiod=self.params.atr_period + 1)
+        else:
+            self.signals = None
+            self.ema = bt.indicators.ExponentialMovingAverage(self.data.close, period=self.params.ema_period)
+            self.atr = bt.indicators.AverageTrueRange(self.data, period=self.params.atr_period)
+        self.order = None
+        self.buy_count = 0  
+        self.sell_count = 0 
+        self.last_trade_price = None  # 记录上一次交易的价格
+
+    def calculate_y(self, x, ema200, atr):
+        # 计算目标仓位比例 y
+        if self.signals is not None:
+            return self.signals['y'][len(self) - 1]
+        return signals.target_percent(x, ema200, atr, self.params.atr_multiplier)
+
+    def next(self):
+        # 检查是否有活动订单，如果有则跳过
+        if self.order:
+            return
         
-#         # 只有在均线计算完成后才开始交易
-#         if len(self.data) < self.params.ema_period:
-#             return
+        # 只有在均线计算完成后才开始交易
+        if len(self.data) < self.params.ema_period:
+            return
         
-#         x = self.data.close[0] # 当前收盘价
-#         ema200 = self.ema[0] # 当前 ema 值
-#         atr = self.atr[0] # 当前 atr 值
-
-#         # 如果这是第一次交易，直接记录价格并返回
-#         if self.last_trade_price is None:
-#             self.last_trade_price = x
-#             return
-
-#         # 检查价格是否超出上次交易价格的 2 ATR 范围
-#         if abs(x - self.last_trade_price) < 2 * atr:
-#             return        
-
-#         y = self.calculate_y(x, ema200, atr)  # 目标仓位比例
-#         target_position = config.initial_cash / x * (y / 100) # 计算目标持仓数量
-#         current_position = self.broker.getposition(self.data).size # 获取当前持仓数量
-
-#         # 如果当前持仓小于目标持仓，则买入差额部分
-#         if current_position < target_position:
-#             self.order = self.buy(size=target_position - current_position)
-#             self.order.addinfo(x=x, ema200=ema200, atr=atr, y=y, target_position=target_position, current_position=current_position)
-#             self.last_trade_price = x  # 更新最后交易价格
-
-#         # 如果当前持仓大于目标持仓，则卖出差额部分
-#         elif current_position > target_position:
-#             self.order = self.sell(size=current_position - target_position)
-#             self.order.addinfo(x=x, ema200=ema200, atr=atr, y=y, target_position=target_position, current_position=current_position)
-#             self.last_trade_price = x  # 更新最后交易价格
-
-#     def notify_order(self, order):
-#         # 处理订单状态变化
-#         if order.status in [order.Completed]:
-#             # 记录买卖次数
-#             if order.isbuy():
-#                 self.buy_count += 1
-#             elif order.issell():
-#                 self.sell_count += 1
-
-#         # 如果订单完成、取消或出现保证金问题，则重置当前订单
-#         if order.status in [order.Completed, order.Canceled, order.Margin]:
-#             self.order = None
\ No newline at end of file
+        x = self.data.close[0] # 当前收盘价
+        ema200 = self.ema[0] # 当前 ema 值
+        atr = self.atr[0] # 当前 atr 值
+
+        # 如果这是第一次交易，直接记录价格并返回
+        if self.last_trade_price is None:
+            self.last_trade_price = x
+            return
+
+        # 检查价格是否超出上次交易价格的 2 ATR 范围
+        if abs(x - self.last_trade_price) < 2 * atr:
+            return        
+
+        y = float(self.calculate_y(x, ema200, atr))  # 目标仓位比例
+        target_position = self.broker.startingcash / x * (y / 100) # 计算目标持仓数量（按本次回测 broker 的初始资金）
+        current_position = self.broker.getposition(self.data).size # 获取当前持仓数量
+
+        # 如果当前持仓小于目标持仓，则买入差额部分
+        if current_position < target_position:
+            self.order = self.buy(size=target_position - current_position)
+            self.order.addinfo(x=x, ema200=ema200, atr=atr, y=y, target_position=target_position, current_position=current_position)
+            self.last_trade_price = x  # 更新最后交易价格
+
+        # 如果当前持仓大于目标持仓，则卖出差额部分
+        elif current_position > target_position:
+            self.order = self.sell(size=current_position - target_position)
+            self.order.addinfo(x=x, ema200=ema200, atr=atr, y=y, target_position=target_position, current_position=current_position)
+            self.last_trade_price = x  # 更新最后交易价格
+
+    def notify_order(self, order):
+        # 处理订单状态变化
+        if order.status in [order.Completed]:
+            # 记录买卖次数
+            if order.isbuy():
+                self.buy_count += 1
+            elif order.issell():
+                self.sell_count += 1
+
+        # 如果订单完成、取消或出现保证金问题，则重置当前订单
+        if order.status in [order.Completed, order.Canceled, order.Margin, order.Rejected]:
+            self.order = None
@@ -0,0 +1,319 @@
+import io
+import json
+import math
+import os
+from collections import deque
+import numpy as np
+import pandas as pd
+import config
+from data_cache import read_csv_columns
+
+'''
+VADStrategy 的增量流式运行
+ATR、VWMA、DCA 计数（total_long_trades、last_dca_price）、持仓和现金都保存为运行状态，每根新 bar 常数时间更新，
+状态定期写入检查点文件；数据文件追加新行后只处理新增的行，不必把整段历史重新跑一遍
+指标和成交规则与 fast_engine / backtrader 一致
+'''
+
+ATR_PERIOD = 14
+
+
+class VADStream(object):
+    def __init__(self, k=config.vad_strategy_params['k'],
+                 base_order_amount=config.vad_strategy_params['base_order_amount'],
+                 dca_multiplier=config.vad_strategy_params['dca_multiplier'],
+                 number_of_dca_orders=config.vad_strategy_params['number_of_dca_orders'],
+                 vwma_period=config.indicator_params['vwma_period'],
+                 broker_params=config.broker_params):
+        self.params = {
+            'k': k,
+            'base_order_amount': base_order_amount,
+            'dca_multiplier': dca_multiplier,
+            'number_of_dca_orders': number_of_dca_orders,
+            'vwma_period': vwma_period
+        }
+        self.broker_params = dict(broker_params)
+
+        # 指标状态
+        self.bars = 0
+        self.prev_close = None
+        self.tr_seed = []  # ATR 种子：前 ATR_PERIOD 个 TR
+        self.atr = math.nan
+        self.cv_window = deque(maxlen=vwma_period)  # close * volume
+        self.v_window = deque(maxlen=vwma_period)
+
+        # 账户状态
+        self.cash = float(broker_params['initial_cash'])
+        self.start_value = self.cash
+        self.value = self.cash
+        self.pos_size = 0.0
+        self.pos_price = 0.0
+        self.pending = None  # [是否买入, 数量, 下单时收盘价]
+
+        # 策略状态
+        self.total_long_trades = 0
+        self.last_dca_price = 0.0
+        self.buy_count = 0
+        self.sell_count = 0
+
+        self.last_dt = None  # 最后处理的 bar 时间（int64 纳秒）
+        self.trades = []
+
+    def _update_indicators(self, high, low, close, volume):
+        # 与 indicators.atr_array / vwma_array 的计算顺序一致
+        if self.prev_close is not None:
+            tr = max(high, self.prev_close) - min(low, self.prev_close)
+            if len(self.tr_seed) < ATR_PERIOD:
+                self.tr_seed.append(tr)
+                if len(self.tr_seed) == ATR_PERIOD:
+                    self.atr = math.fsum(self.tr_seed) / ATR_PERIOD
+            else:
+                alpha = 1.0 / ATR_PERIOD
+                self.atr = self.atr * (1.0 - alpha) + tr * alpha
+        self.prev_close = close
+
+        self.cv_window.append(close * volume)
+        self.v_window.append(volume)
+        if len(self.v_window) < self.params['vwma_period']:
+            return math.nan
+        sum_v = math.fsum(self.v_window)
+        sum_cv = math.fsum(self.cv_window)
+        if sum_v == 0.0:
+            # 与 numpy 的除法结果一致，不抛出 ZeroDivisionError
+            return math.nan if sum_cv == 0.0 or math.isnan(sum_cv) else math.copysign(math.inf, sum_cv)
+        return sum_cv / sum_v
+
+    def _execute_pending(self, dt, open_, high, low):
+        # 撮合上一根 bar 下的市价单，规则与 BackBroker 一致
+        isbuy, size, created_price = self.pending
+        self.pending = None
+        commission = self.broker_params['commission_rate']
+        slippage = self.broker_params['slippage']
+
+        if isbuy:
+            check_cash = self.cash - abs(size) * created_price
+            check_cash -= abs(size) * commission * created_price
+            if check_cash < 0.0:
+                return None
+            price = open_ * (1 + slippage)
+            if price > high:
+                price = high
+            new_cash = self.cash - abs(size) * price
+            new_cash -= abs(size) * commission * price
+            if new_cash < 0.0:
+                return None
+            self.cash = new_cash
+            new_size = self.pos_size + size
+            self.pos_price = price if not self.pos_size else (self.pos_price * self.pos_size + size * price) / new_size
+            self.pos_size = new_size
+            trade = _trade_info(dt, price, size, abs(size) * price, 0.0, True, False)
+        else:
+            price = open_ * (1 - slippage)
+            if price < low:
+                price = low
+            closed = -size
+            pnl = size * (price - self.pos_price) * 1.0
+            closed_value = abs(closed) * self.pos_price
+            self.cash += closed_value + pnl
+            self.cash -= abs(closed) * commission * price
+            self.pos_size = 0.0
+            self.pos_price = 0.0
+            trade = _trade_info(dt, price, closed, closed_value, pnl, False, True)
+
+        self.trades.append(trade)
+        return trade
+
+    def update(self, dt, open_, high, low, close, volume=math.nan):
+        '''
+        处理一根新 bar
+        :param dt: bar 时间，int64 纳秒
+        :return: 本根 bar 成交的交易记录（没有则为 None）
+        '''
+        trade = None
+        if self.pending is not None:
+            trade = self._execute_pending(dt, open_, high, low)
+
+        self.value = self.cash + self.pos_size * close
+        vwma = self._update_indicators(high, low, close, volume)
+        self.bars += 1
+        self.last_dt = int(dt)
+
+        # 指标全部就绪后才开始交易
+        if self.bars < max(ATR_PERIOD + 1, self.params['vwma_period']):
+            return trade
+
+        k_atr = self.params['k'] * self.atr
+        long_signal = close < vwma - k_atr
+        short_signal = close > vwma + k_atr
+
+        # 开仓逻辑
+        if long_signal and self.total_long_trades == 0:
+            self.pending = [True, self.params['base_order_amount'] / close, close]
+            self.last_dca_price = self.params['base_order_amount']
+            self.total_long_trades = 1
+            self.buy_count += 1
+
+        # 加仓逻辑
+        elif long_signal and 0 < self.total_long_trades < self.params['number_of_dca_orders']:
+            self.last_dca_price *= self.params['dca_multiplier']
+            self.pending = [True, self.last_dca_price / close, close]
+            self.total_long_trades += 1
+            self.buy_count += 1
+
+        # 止盈止损
+        if self.pos_size > 0 and short_signal and (close - self.pos_price >= k_atr * self.pos_size
+                                                   or close - self.pos_price <= - k_atr * self.pos_size):
+            self.pending = [False, self.pos_size, close]
+            self.sell_count += 1
+
+        return trade
+
+    def state_dict(self):
+        # 成交记录不写入检查点，检查点大小不随历史增长
+        state = dict(self.__dict__)
+        del state['trades']
+        state['cv_window'] = list(self.cv_window)
+        state['v_window'] = list(self.v_window)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        stream = cls(broker_params=state['broker_params'], **state['params'])
+        for key, value in state.items():
+            if key in ('cv_window', 'v_window'):
+                value = deque(value, maxlen=state['params']['vwma_period'])
+            setattr(stream, key, value)
+        return stream
+
+
+def _trade_info(dt, price, size, value, pnl, isbuy, closed):
+    # 字段与 LongTermTradeAnalyzer 的单笔交易记录一致，日期保存为字符串以便写入检查点
+    return {
+        'date': str(pd.Timestamp(dt)),
+        'price': price,
+        'size': size,
+        'value': value,
+        'pnl': pnl,
+        'isbuy': isbuy,
+        'closed': closed
+    }
+
+
+def save_checkpoint(path, stream, offset):
+    # 先写临时文件再替换，避免中断时留下损坏的检查点
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'offset': offset, 'state': stream.state_dict()}, f)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    with open(path, 'r') as f:
+        checkpoint = json.load(f)
+    return VADStream.from_state(checkpoint['state']), checkpoint['offset']
+
+
+def checkpoint_path(name):
+    return os.path.join(config.streaming_params['checkpoint_dir'], f'{name}.json')
+
+
+def read_new_rows(data_file, offset):
+    '''
+    从字节偏移 offset 开始读取新追加的完整行
+    :return: (列数组字典, 新的偏移)，offset 为 0 时包含表头
+    '''
+    with open(data_file, 'rb') as f:
+        f.seek(offset)
+        raw = f.read()
+
+    # 只处理以换行结尾的完整行，最后一行可能还在写入
+    end = raw.rfind(b'\n') + 1
+    raw = raw[:end]
+    if not raw.strip() or (offset == 0 and raw.count(b'\n') <= 1):
+        return None, offset + end
+
+    columns, _ = read_csv_columns(data_file, raw=raw, headers=(offset == 0))
+    return columns, offset + end
+
+
+def run_stream(data_file, name, fromdate=config.backtest_params['start_date'], **params):
+    '''
+    处理数据文件中上次检查点之后新增的 bar，并更新检查点
+    第一次运行时从 fromdate 开始处理已有的全部 bar
+    :return: (VADStream, 本次处理的 bar 数, 本次成交的交易记录)
+    '''
+    path = checkpoint_path(name)
+    if os.path.exists(path):
+        stream, offset = load_checkpoint(path)
+        if os.path.getsize(data_file) < offset:
+            raise ValueError(f'{data_file} 比检查点记录的更短，文件可能被重写，请删除 {path} 后重新运行')
+    else:
+        stream, offset = VADStream(**params), 0
+
+    columns, offset = read_new_rows(data_file, offset)
+    processed = 0
+    fills = []
+    if columns is not None:
+        start_ns = pd.Timestamp(fromdate).as_unit('ns').value if fromdate is not None else None
+        rows = zip(columns['datetime'].tolist(), columns['open'].tolist(), columns['high'].tolist(),
+                   columns['low'].tolist(), columns['close'].tolist())
+        for dt, open_, high, low, close in rows:
+            # 跳过回测起点之前和已经处理过的 bar
+            if (start_ns is not None and dt < start_ns) or (stream.last_dt is not None and dt <= stream.last_dt):
+                continue
+            trade = stream.update(dt, open_, high, low, close)
+            processed += 1
+            if trade is not None:
+                fills.append(trade)
+
+    save_checkpoint(path, stream, offset)
+    return stream, processed, fills
+
+
+def verify_against_fast_engine(data_file, split=0.5, volume=None, **params):
+    '''
+    先处理前一部分 bar 并经过一次检查点保存/恢复，再处理剩余 bar，结果应与 fast_engine.run_vad 一致
+    :return: 是否一致
+    '''
+    import fast_engine
+
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'])
+    if volume is not None:
+        data['volume'] = np.full(len(data['close']), float(volume))
+    expected = fast_engine.run_vad(data, **params)
+
+    stream = VADStream(**params)
+    rows = list(zip(data['datetime'].view(np.int64).tolist(), data['open'].tolist(), data['high'].tolist(),
+                    data['low'].tolist(), data['close'].tolist(), data['volume'].tolist()))
+    cut = int(len(rows) * split)
+    trades = []
+    for n, row in enumerate(rows):
+        if n == cut:
+            buffer = io.StringIO()
+            json.dump(stream.state_dict(), buffer)
+            stream = VADStream.from_state(json.loads(buffer.getvalue()))
+        trade = stream.update(*row)
+        if trade is not None:
+            trades.append(trade)
+
+    if len(trades) != len(expected['trades']):
+        return False
+    for a, b in zip(trades, expected['trades']):
+        if pd.Timestamp(a['date']) != pd.Timestamp(b['date']) or a['size'] != b['size'] or a['price'] != b['price']:
+            return False
+    return stream.value == expected['end_value']
+
+
+if __name__ == '__main__':
+    for name, data_file in config.data_files:
+        stream, processed, fills = run_stream(data_file, name)
+        for trade in fills:
+            action = '买入' if trade['isbuy'] else '卖出'
+            print(f'{trade["date"]}, {action}: Size={trade["size"]}, Price={trade["price"]}')
+        print(f'{name}: 处理新 bar {processed} 根，持仓 {stream.pos_size:.4f}，净值 {stream.value:.2f}，检查点 {checkpoint_path(name)}')
+        # 检查点保存 / 恢复后的结果与 fast_engine.run_vad 一致（原始数据没有成交量，成交量取 1 时才会交易）
+        for volume in (None, 1.0):
+            label = '原始数据' if volume is None else f'成交量={volume}'
+            ok = verify_against_fast_engine(data_file, volume=volume)
+            print(f'{name} ({label}) 检查点恢复后与 fast_engine: {"一致" if ok else "不一致"}')
@@ -0,0 +1,29 @@
+import os
+import sys
+import pytest
+
+'''
+测试公共设置
+config 中的数据目录（results/）、检查点目录等都是相对路径，测试在仓库根目录下运行，模块从仓库根目录导入
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+
+@pytest.fixture
+def short_window(monkeypatch):
+    # 回测区间缩短到三个月，校验整段区间的用例保持较快
+    monkeypatch.setitem(config.backtest_params, 'start_date', '2023-6-30')
+    monkeypatch.setitem(config.backtest_params, 'end_date', '2023-9-30')
+
+
+@pytest.fixture
+def in_tmp_dir(tmp_path, monkeypatch):
+    # 在临时目录中运行，按相对路径写出的缓存、索引等文件不落在仓库中（数据文件需使用绝对路径）
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
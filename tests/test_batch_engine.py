@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import config
+import batch_engine
+import fast_engine
+import optimizer
+
+'''
+批量回测引擎：逐组与 fast_engine.run_vad 一致，分块大小不影响结果，optimizer 的 batch 引擎与 fast 引擎排名相同
+'''
+
+DATA_FILES = [pytest.param(data_file, id=name) for name, data_file in config.data_files]
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+@pytest.mark.parametrize('volume, n_sets', [(None, 10), (1, 50)])
+def test_matches_fast_engine(data_file, volume, n_sets, short_window):
+    assert batch_engine.verify_against_fast(data_file, n_sets=n_sets, volume=volume)
+
+
+def test_chunking_does_not_change_results(short_window, monkeypatch):
+    name, data_file = config.data_files[0]
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                   todate=config.backtest_params['end_date'])
+    data['volume'] = np.ones(len(data['close']))
+    combos = optimizer.param_grid(config.sweep_params)[:64]
+    whole = batch_engine.run_grid(data, combos)
+    # 每块只有几根 bar，块边界落在信号和挂单之间
+    monkeypatch.setattr(batch_engine, 'CHUNK_ELEMENTS', 64 * 7)
+    chunked = batch_engine.run_grid(data, combos)
+    assert whole['buy_count'].sum() > 0
+    for key, values in whole.items():
+        assert np.array_equal(values, chunked[key]), key
+
+
+def test_sweep_engines_agree(short_window):
+    grid = {'k': [0.5, 1.0], 'dca_multiplier': [1.2, 2.0]}
+    batch = optimizer.run_sweep(grid=grid, engine='batch', processes=2)
+    fast = optimizer.run_sweep(grid=grid, engine='fast', processes=2)
+    keys = ['data'] + list(grid)
+    batch = batch.sort_values(keys).reset_index(drop=True)
+    fast = fast.sort_values(keys).reset_index(drop=True)
+    assert batch[keys].equals(fast[keys])
+    assert (batch['trade_count'] == fast['trade_count']).all()
+    for column in optimizer.METRICS:
+        assert np.allclose(batch[column], fast[column], rtol=1e-9, atol=1e-12), column
@@ -0,0 +1,59 @@
+import os
+import pytest
+import pandas as pd
+import config
+import benchmark
+from data_cache import read_csv_columns
+
+'''
+性能基准：合成数据文件的格式、与基准的比较，以及在小规模合成数据上完整运行一遍全部基准项
+'''
+
+
+@pytest.fixture
+def output_dir(in_tmp_dir, monkeypatch):
+    monkeypatch.setattr(benchmark, 'output_dir', str(in_tmp_dir / 'benchmarks'))
+    return in_tmp_dir / 'benchmarks'
+
+
+def test_synthetic_file(output_dir):
+    path = benchmark.synthetic_file(500)
+    columns, total_lines = read_csv_columns(path)
+    assert len(columns['close']) == 500
+    assert total_lines == 501
+    assert pd.Timestamp(columns['datetime'][-1]) == pd.Timestamp(config.backtest_params['end_date'])
+    assert (columns['high'] >= columns['low']).all()
+
+    # 已生成的文件直接复用
+    mtime = os.path.getmtime(path)
+    assert benchmark.synthetic_file(500) == path
+    assert os.path.getmtime(path) == mtime
+
+
+def _item(benchmark_name, bars_per_sec, bars=1000):
+    return {'dataset': 'd', 'benchmark': benchmark_name, 'bars': bars, 'seconds': bars / bars_per_sec,
+            'bars_per_sec': bars_per_sec}
+
+
+def test_compare_flags_regressions():
+    baseline = {'results': [_item('fast', 1000), _item('slow', 1000), _item('resized', 1000, bars=10)]}
+    results = [_item('fast', 1100), _item('slow', 500), _item('resized', 100), _item('new', 100)]
+    regressions = benchmark.compare(results, baseline, tolerance=0.15)
+    assert [item['benchmark'] for item in regressions] == ['slow']
+    assert results[0]['change'] == pytest.approx(0.1)
+    # bar 数不同或基准中没有的项不比较
+    assert results[2]['change'] is None and results[3]['change'] is None
+    assert benchmark.compare(results, None) == []
+
+
+def test_benchmark_dataset(output_dir, monkeypatch):
+    monkeypatch.setitem(config.benchmark_params, 'repeat', 1)
+    path = benchmark.synthetic_file(2000)
+    window = dict(config.backtest_params)
+    results = benchmark.benchmark_dataset('synthetic_2000', path)
+    names = [item['benchmark'] for item in results]
+    assert 'end_to_end_VADStrategy' in names and 'engine_empty' in names
+    assert all(f'analyzer_{name}' in names for name, _ in benchmark.ANALYZERS)
+    assert all(item['bars'] == 2000 and item['bars_per_sec'] > 0 for item in results)
+    # 端到端基准临时改为整个合成数据的区间，结束后恢复
+    assert config.backtest_params == window
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import config
+import cost_replay
+
+'''
+成本模型回放：每个成本模型的净值和交易次数与完整重跑一致（回测区间的前 3000 根 bar、2 × 2 个成本模型）
+'''
+
+
+@pytest.fixture
+def cost_grid(monkeypatch):
+    monkeypatch.setitem(config.cost_replay_params, 'commission_rate', [0, 10 / 10000])
+    monkeypatch.setitem(config.cost_replay_params, 'slippage', [0, 2 / 1000])
+
+
+@pytest.fixture(scope='module')
+def window():
+    from main import load_data
+
+    name, data_file = config.data_files[0]
+    columns, total_lines = load_data(data_file)
+    return name, {key: values[:3000] for key, values in columns.items()}, total_lines
+
+
+def _verify(strategy_class, columns, total_lines, name, **params):
+    report = cost_replay.verify_against_full(strategy_class, columns, total_lines, name, **params)
+    assert report['max_error'] < 1e-9
+    assert report['trades_match']
+    return report
+
+
+def test_vad_replays(window, cost_grid):
+    from strategy import VADStrategy
+
+    name, columns, total_lines = window
+    # 数据文件没有成交量时 VADStrategy 不会交易，成交量取 1
+    columns = dict(columns, volume=np.ones(len(columns['close'])))
+    report = _verify(VADStrategy, columns, total_lines, name, k=0.5, base_order_amount=300,
+                     number_of_dca_orders=50, dca_multiplier=1.05, printlog=False)
+    assert report['replayed'] > 0
+
+
+def test_ar_strategy(window, cost_grid):
+    from strategy import AR_Strategy
+
+    name, columns, total_lines = window
+    _verify(AR_Strategy, columns, total_lines, name)
+
+
+def test_buy_and_hold_reruns(window, cost_grid):
+    from strategy import BuyAndHoldStrategy
+
+    name, columns, total_lines = window
+    # 下单数量按扣除成本后的现金计算，每个成本模型都完整重跑
+    report = _verify(BuyAndHoldStrategy, columns, total_lines, name)
+    assert report['replayed'] == 0
+
+
+def test_order_stream_round_trip(window):
+    from main import run_strategy
+    from strategy import AR_Strategy
+
+    name, columns, total_lines = window
+    strat = run_strategy(AR_Strategy, columns, total_lines, name)[0]
+    ledger = strat.analyzers.longterm_trades.get_analysis()['ledger']
+    bars, sizes = cost_replay.order_stream(ledger, columns)
+    assert len(bars) == len(ledger)
+    assert (np.diff(bars) >= 0).all()
+    assert np.array_equal(np.sign(sizes) > 0, ledger.columns()['isbuy'].astype(bool))
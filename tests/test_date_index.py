@@ -0,0 +1,82 @@
+import os
+import backtrader as bt
+import numpy as np
+import pandas as pd
+import pytest
+import config
+import date_index
+from data_cache import read_csv_columns
+from my_data import MyCSVData
+
+'''
+日期索引：MyCSVData 按索引 seek 到回测区间读取的 bar 与逐行读取、过滤的结果相同，数据文件变化时索引重建
+'''
+
+DATA_FILES = [pytest.param(os.path.abspath(data_file), id=name) for name, data_file in config.data_files]
+
+
+class Collect(bt.Strategy):
+    def __init__(self):
+        self.rows = []
+
+    def next(self):
+        data = self.data
+        self.rows.append((data.datetime[0], data.open[0], data.high[0], data.low[0], data.close[0]))
+
+
+def _read(data_file, use_index, fromdate, todate):
+    cerebro = bt.Cerebro(stdstats=False)
+    data = MyCSVData(dataname=data_file, use_index=use_index, fromdate=fromdate, todate=todate)
+    cerebro.adddata(data)
+    cerebro.addstrategy(Collect)
+    strat = cerebro.run()[0]
+    return strat.rows, data.total_lines
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+def test_indexed_range_matches_full_scan(data_file, in_tmp_dir, short_window):
+    fromdate = pd.Timestamp(config.backtest_params['start_date']).to_pydatetime()
+    todate = pd.Timestamp(config.backtest_params['end_date']).to_pydatetime()
+    indexed, indexed_lines = _read(data_file, True, fromdate, todate)
+    scanned, scanned_lines = _read(data_file, False, fromdate, todate)
+    assert len(indexed) > 0
+    assert indexed == scanned
+    assert indexed_lines == scanned_lines
+    assert os.path.exists(date_index.index_path(data_file))
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+def test_lookup(data_file, in_tmp_dir):
+    columns, total_lines = read_csv_columns(data_file)
+    dt = columns['datetime']
+    middle = pd.Timestamp(dt[len(dt) // 2])
+    found = date_index.lookup(data_file, fromdate=middle)
+    assert found['start_row'] == len(dt) // 2
+    assert found['rows'] == len(dt) - len(dt) // 2
+    assert found['total_lines'] == total_lines
+    with open(data_file, 'rb') as f:
+        f.seek(found['start_offset'])
+        assert f.readline().startswith(middle.strftime('%Y/%m/%d %H:%M').encode())
+
+    # 区间在数据之外时没有行
+    before = pd.Timestamp(dt[0]) - pd.Timedelta(days=1)
+    assert date_index.lookup(data_file, todate=before)['rows'] == 0
+    after = pd.Timestamp(dt[-1]) + pd.Timedelta(days=1)
+    assert date_index.lookup(data_file, fromdate=after)['rows'] == 0
+
+
+def test_rebuilt_when_file_changes(in_tmp_dir):
+    # 数据文件追加新行后重建索引
+    with open(DATA_FILES[0].values[0], 'rb') as f:
+        header, *lines = f.read().splitlines(keepends=True)
+    data_file = str(in_tmp_dir / 'data.csv')
+    with open(data_file, 'wb') as f:
+        f.write(header + b''.join(lines[:100]))
+    assert date_index.lookup(data_file)['rows'] == 100
+
+    with open(data_file, 'ab') as f:
+        f.write(b''.join(lines[100:150]))
+    found = date_index.lookup(data_file)
+    assert found['rows'] == 150
+    assert found['total_lines'] == 151
+    assert np.array_equal(date_index.load_index(data_file)['datetime'], read_csv_columns(data_file)[0]['datetime'])
@@ -0,0 +1,26 @@
+import pytest
+import config
+import fast_engine
+
+'''
+向量化引擎与 backtrader 的一致性：results/ 下每个数据文件、fast_engine.VERIFY_CHECKS 中的每组成交量和参数
+'''
+
+DATA_FILES = [pytest.param(data_file, id=name) for name, data_file in config.data_files]
+
+
+def test_data_files_found():
+    # 没有数据文件时下面的参数化用例不会运行，这里明确失败
+    assert config.data_files, f'{config.data_dir}/ 下没有 CSV 数据文件'
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+@pytest.mark.parametrize('volume, params', fast_engine.VERIFY_CHECKS)
+def test_matches_backtrader(data_file, volume, params):
+    ok, count, message = fast_engine.verify_against_backtrader(data_file, volume=volume, **params)
+    assert ok, message
+    if volume is None:
+        # 原始数据没有成交量，VWMA 为 NaN，不会下单
+        assert count == 0
+    else:
+        assert count > 0
@@ -0,0 +1,80 @@
+import math
+import numpy as np
+import pytest
+import config
+import fast_engine
+import optimizer
+
+'''
+自适应参数优化：EarlyStop 分析器与 fast_engine.run_vad 在同一根 bar 提前终止、净值相同；
+successive halving 每一轮的候选数和数据比例正确，fast 与 backtrader 引擎结果相同，计算量少于完整网格
+'''
+
+GRID = {'k': [0.5, 1.0, 1.6], 'dca_multiplier': [1.2, 1.6, 2.0]}
+
+
+@pytest.fixture(scope='module')
+def trading_data():
+    # 成交量取 1 的回测区间数据（数据文件没有成交量时 VADStrategy 不会交易）
+    from main import load_data
+
+    name, data_file = config.data_files[0]
+    columns, total_lines = load_data(data_file)
+    columns = dict(columns, volume=np.ones(len(columns['close'])))
+    return name, columns, total_lines
+
+
+@pytest.mark.parametrize('params, stop_drawdown, stopped', [
+    (dict(k=0.2, base_order_amount=600000, dca_multiplier=2), 0.02, True),
+    (dict(k=0.5, base_order_amount=300, number_of_dca_orders=50, dca_multiplier=1.05), 0.5, False)
+])
+def test_early_stop_matches_fast_engine(trading_data, params, stop_drawdown, stopped):
+    from main import run_strategy
+    from strategy import VADStrategy
+
+    name, columns, total_lines = trading_data
+    strat = run_strategy(VADStrategy, columns, total_lines, name, early_stop={'max_drawdown': stop_drawdown},
+                         printlog=False, **params)[0]
+    data = dict(columns, datetime=columns['datetime'].view('datetime64[ns]'))
+    result = fast_engine.run_vad(data, stop_drawdown=stop_drawdown, **params)
+
+    analysis = strat.analyzers.early_stop.get_analysis()
+    assert analysis['stopped'] == result['stopped'] == stopped
+    assert analysis['bars'] == len(result['values'])
+    if stopped:
+        assert len(result['values']) < len(columns['close'])
+    assert np.allclose(strat.analyzers.equity.get_analysis()['value'], result['values'], rtol=1e-12)
+
+
+def _halving(engine):
+    return optimizer.run_halving(grid=GRID, data_files=config.data_files[-1:], engine=engine, processes=2,
+                                 eta=3, min_fraction=1 / 9, candidates=None)
+
+
+def test_halving_rungs():
+    df, rungs, compute = _halving('fast')
+    assert [rung['candidates'] for rung in rungs] == [9, 3, 1]
+    assert [rung['fraction'] for rung in rungs] == pytest.approx([1 / 9, 1 / 3, 1])
+    assert len(df) == 1
+    assert compute['grid_runs'] == 9
+    assert 0 < compute['bars'] < compute['grid_bars']
+    assert compute['saved'] == pytest.approx(1 - compute['bars'] / compute['grid_bars'])
+
+    # 最后一轮在完整区间上运行，指标与直接运行一次相同
+    row = df.iloc[0]
+    data = optimizer._fast_data(config.data_files[-1][1])
+    params = {key: row[key] for key in GRID}
+    result = fast_engine.run_vad(data, **params)
+    expected = fast_engine.analyze_values(result['values'], data['datetime'], result['start_value'])
+    assert row['sharpe_ratio'] == pytest.approx(expected['sharpe_ratio'], abs=1e-12)
+    assert row['total_return'] == pytest.approx(expected['total_return'], abs=1e-12)
+    assert math.ceil(len(data['close']) * rungs[0]['fraction']) * 9 <= rungs[0]['bars']
+
+
+def test_halving_engines_agree():
+    fast, fast_rungs, _ = _halving('fast')
+    backtrader, backtrader_rungs, _ = _halving('backtrader')
+    assert [rung['bars'] for rung in fast_rungs] == [rung['bars'] for rung in backtrader_rungs]
+    assert fast[list(GRID)].to_dict('records') == backtrader[list(GRID)].to_dict('records')
+    for column in ('total_return', 'max_drawdown', 'sharpe_ratio'):
+        assert np.allclose(fast[column], backtrader[column], rtol=1e-9, atol=1e-12)
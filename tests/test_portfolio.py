@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import config
+import portfolio
+
+'''
+组合回测：只有一个标的时 VADStrategy 与 fast_engine.run_vad 一致、BuyAndHold 与 BuyAndHoldStrategy 一致
+'''
+
+DATA_FILES = [pytest.param(data_file, id=name) for name, data_file in config.data_files]
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+@pytest.mark.parametrize('volume, params', [(None, {}), (1.0, dict(k=0.5, base_order_amount=10000))])
+def test_single_symbol_matches_fast_engine(data_file, volume, params, short_window):
+    assert portfolio.verify_single_symbol(data_file, volume=volume, **params)
+
+
+@pytest.mark.parametrize('data_file', DATA_FILES)
+def test_buy_and_hold_matches_strategy(data_file, short_window):
+    from main import load_data, run_strategy, collect_metrics
+    from strategy import BuyAndHoldStrategy
+
+    columns, total_lines = load_data(data_file)
+    bars = len(columns['close'])
+    # 数据文件的总行数（区间内不卖出）、区间最后一根 bar 下单卖出、区间中间卖出
+    for lines in (total_lines, bars + 1, bars // 2):
+        strat = run_strategy(BuyAndHoldStrategy, columns, lines, 'x')[0]
+        result = portfolio.run_portfolio(portfolio.align([('x', columns)], total_lines=[lines]), strategy='BuyAndHold')
+        assert result['buy_count'] + result['sell_count'] == collect_metrics(strat)['trade_count']
+        assert np.allclose(result['values'], strat.analyzers.equity.get_analysis()['value'], rtol=1e-12)
+
+
+def test_shared_cash_pool():
+    aligned = portfolio.align(portfolio.synthetic_datasets(20, 1000))
+    result = portfolio.run_portfolio(aligned, k=1.0, base_order_amount=1000)
+    assert len(result['values']) == len(aligned['datetime'])
+    assert result['end_value'] == result['values'][-1]
+    assert {trade['symbol'] for trade in result['trades']} <= set(aligned['names'])
+    assert len(result['trades']) > 0
@@ -0,0 +1,34 @@
+import os
+import pytest
+import config
+import resample
+
+'''
+多周期重采样：由最细周期的数据文件聚合出的 15 分钟、60 分钟 bar 与直接导出的同周期数据文件逐根一致
+'''
+
+BASE_FILE = config.resample_params['base_file']
+EXPORTED = [('15min', os.path.join(config.data_dir, 'BATS_QQQ, 15.csv')),
+            ('60min', os.path.join(config.data_dir, 'BATS_QQQ, 60.csv'))]
+
+
+@pytest.mark.parametrize('timeframe, data_file', EXPORTED, ids=[timeframe for timeframe, _ in EXPORTED])
+def test_matches_exported_file(timeframe, data_file):
+    if not os.path.exists(BASE_FILE) or not os.path.exists(data_file):
+        pytest.skip(f'缺少数据文件 {BASE_FILE} 或 {data_file}')
+    same, bars = resample.verify_against_file(BASE_FILE, data_file, timeframe)
+    assert bars > 0
+    assert same
+
+
+def test_timeframe_datasets_share_base():
+    if not os.path.exists(BASE_FILE):
+        pytest.skip(f'缺少数据文件 {BASE_FILE}')
+    datasets = resample.timeframe_datasets(timeframes=['15min', '60min'])
+    assert [name for name, _, _ in datasets][1:] == [f'{datasets[0][0]}_15min', f'{datasets[0][0]}_60min']
+    # 周期越粗 bar 越少，且都在原始周期的时间范围内
+    counts = [len(columns['datetime']) for _, columns, _ in datasets]
+    assert counts[0] > counts[1] > counts[2] > 0
+    for _, columns, _ in datasets[1:]:
+        assert columns['datetime'][0] >= datasets[0][1]['datetime'][0]
+        assert columns['datetime'][-1] <= datasets[0][1]['datetime'][-1]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import config
+import fast_engine
+import robustness
+
+'''
+稳健性分析：实际值与 fast_engine.analyze_values（即 LTanalyzer 的指标算法）一致，各模拟方式的不变量成立
+'''
+
+
+@pytest.fixture(scope='module')
+def vad_run():
+    # 成交量取 1 的 VADStrategy，有若干笔已平仓交易
+    name, data_file = config.data_files[0]
+    data = fast_engine.load_arrays(data_file, fromdate=config.backtest_params['start_date'],
+                                   todate=config.backtest_params['end_date'])
+    data['volume'] = np.ones(len(data['close']))
+    result = fast_engine.run_vad(data, k=0.5, base_order_amount=300, number_of_dca_orders=50, dca_multiplier=1.05)
+    assert len(result['pnl'])
+    return data, result
+
+
+def test_actual_values_match_metrics(vad_run):
+    data, result = vad_run
+    metrics = fast_engine.analyze_values(result['values'], data['datetime'], result['start_value'])
+    report = robustness.analyze(result['pnl'], data['datetime'], result['values'], result['start_value'],
+                                simulations=200)
+    bars = {key: report[('bars_block_bootstrap', key)]['actual'] for key in robustness.STATS}
+    assert bars['final_return'] == pytest.approx(metrics['total_return'], rel=1e-9)
+    assert bars['max_drawdown'] == pytest.approx(metrics['max_drawdown'], rel=1e-9)
+    assert bars['sharpe_ratio'] == pytest.approx(metrics['sharpe_ratio'], rel=1e-9)
+
+
+def test_shuffle_keeps_final_return(vad_run):
+    _, result = vad_run
+    pnl = np.asarray(result['pnl'])
+    simulated = robustness.simulate_trades(pnl, result['start_value'], method='shuffle', simulations=300,
+                                           batch_size=64)
+    assert np.allclose(simulated['final_return'], pnl.sum() / result['start_value'], rtol=1e-9)
+    assert (simulated['max_drawdown'] >= 0).all()
+
+
+def test_bootstrap_is_reproducible(vad_run):
+    _, result = vad_run
+    first = robustness.simulate_trades(result['pnl'], result['start_value'], simulations=300, batch_size=300)
+    again = robustness.simulate_trades(result['pnl'], result['start_value'], simulations=300, batch_size=300)
+    assert np.array_equal(first['final_return'], again['final_return'])
+    assert len(first['final_return']) == 300
+
+
+def test_full_length_block_is_a_rotation():
+    # 块长等于序列长度时每条路径都是原序列的循环移位，期末收益率不变
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0, 0.01, 200)
+    simulated = robustness.simulate_returns(returns, 252, simulations=100, block_length=200, batch_size=30)
+    assert np.allclose(simulated['final_return'], np.prod(1 + returns) - 1, rtol=1e-9)
+    assert np.allclose(simulated['sharpe_ratio'], robustness.sharpe_ratio(returns, 252)[0], rtol=1e-9)
+
+
+def test_max_drawdown_matches_loop():
+    rng = np.random.default_rng(1)
+    equity = 100 * np.cumprod(1 + rng.normal(0, 0.02, (5, 300)), axis=1)
+    expected = []
+    for path in equity:
+        peak, worst = -np.inf, 0.0
+        for value in path:
+            peak = max(peak, value)
+            worst = max(worst, 1 - value / peak)
+        expected.append(worst)
+    assert np.allclose(robustness._max_drawdown(equity), expected, rtol=1e-12)
@@ -0,0 +1,85 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+import config
+import indicator_cache
+import shared_data
+from my_data import datetime_to_num
+
+'''
+共享内存数据集：挂载后的数组与原数据相同且只读，直接在共享内存上回测与复制数据回测的结果相同，
+进程池的工作进程挂载后得到相同的结果，关闭后共享内存块被删除
+'''
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    from main import load_data
+
+    name, data_file = config.data_files[-1]
+    columns, total_lines = load_data(data_file)
+    # 成交量取 1，VADStrategy 会交易
+    return name, data_file, dict(columns, volume=np.ones(len(columns['close']))), total_lines
+
+
+def test_attach_round_trip(dataset):
+    _, data_file, columns, total_lines = dataset
+    with shared_data.DatasetRegistry(prefix='atr_test_attach') as registry:
+        registry.publish(data_file, columns, total_lines)
+        manifest = registry.manifest
+        datasets = shared_data.attach(manifest)
+        arrays, lines = datasets[data_file]
+        assert lines == total_lines
+        for key, values in columns.items():
+            assert np.array_equal(arrays[key], values), key
+        assert np.array_equal(arrays['dtnum'], datetime_to_num(columns['datetime']))
+        with pytest.raises(ValueError):
+            arrays['close'][0] = 0.0
+
+        # 指标数组放入了 indicator_cache，按数据内容的键可以取到
+        key = manifest[data_file]['key']
+        assert key == indicator_cache.dataset_key(columns)
+        for name, period in config.shared_data_params['indicators']:
+            assert np.array_equal(indicator_cache.get_indicator(arrays, name, period, key=key),
+                                  indicator_cache.get_indicator(dict(columns), name, period), equal_nan=True)
+        block = manifest[data_file]['block']
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block)
+
+
+def test_in_place_backtest_matches_copy(dataset):
+    from main import run_strategy
+    from strategy import VADStrategy
+
+    name, data_file, columns, total_lines = dataset
+    expected = run_strategy(VADStrategy, columns, total_lines, name, printlog=False)[0]
+    with shared_data.DatasetRegistry(prefix='atr_test_in_place') as registry:
+        registry.publish(data_file, columns, total_lines)
+        arrays, lines = shared_data.attach(registry.manifest)[data_file]
+        strat = run_strategy(VADStrategy, arrays, lines, name, in_place=True, printlog=False)[0]
+        assert strat.buy_count == expected.buy_count > 0
+        assert strat.sell_count == expected.sell_count
+        assert np.array_equal(strat.analyzers.equity.get_analysis()['value'],
+                              expected.analyzers.equity.get_analysis()['value'])
+
+
+def _attached_bars(data_file):
+    # 在工作进程中运行：已挂载的数据集的 bar 数，没有挂载时为 None
+    shared = shared_data.get(data_file)
+    return None if shared is None else len(shared[0]['close'])
+
+
+def test_process_pool_workers(monkeypatch):
+    from main import load_data, run_strategy
+    from strategy import VADStrategy
+
+    monkeypatch.setitem(config.shared_data_params, 'enabled', True)
+    name, data_file = config.data_files[-1]
+    columns, total_lines = load_data(data_file)
+    expected = run_strategy(VADStrategy, columns, total_lines, name, printlog=False)[0].broker.getvalue()
+    with shared_data.process_pool(2, [(name, data_file)]) as executor:
+        attached = list(executor.map(_attached_bars, [data_file] * 2))
+        results = list(executor.map(shared_data._measure_job, [(name, data_file)] * 2))
+    assert attached == [len(columns['close'])] * 2
+    assert [value for value, _ in results] == [expected, expected]
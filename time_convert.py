@@ -1,35 +1,140 @@
-import pandas as pd
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import config
+from data_cache import COLUMNS
+
+'''
+把 original 目录中 TradingView 导出的数据（time 为 Unix 秒）转换为回测使用的格式
+多个文件用进程池并行转换；源文件没有变化（大小、修改时间相同，或内容哈希相同）且输出已存在时跳过
+输出格式：
+csv：时间写为 UTC 的 年/月/日 时:分 字符串，一次 to_csv 写出
+npz：二进制列式文件，datetime 保留为 int64 纳秒，回测时直接读取，省去时间的格式化和再解析
+'''
+
+MANIFEST = '.time_convert.json'  # 记录每个源文件上次转换时的状态，放在输出目录中
+
+
+def output_paths(file_path, output_dir, formats):
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return [os.path.join(output_dir, f'{base_name}.{fmt}') for fmt in formats]
+
+
+def _file_sha1(file_path):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _source_state(file_path):
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
 
-# 输入目录和输出目录
-input_dir = 'original'
-output_dir = 'results'
 
-# 确保输出目录存在
-os.makedirs(output_dir, exist_ok=True)
+def _write_atomic(path, mode, writer):
+    # 先写临时文件再替换，转换中断时不会留下写了一半的输出
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, mode, **({} if 'b' in mode else {'newline': ''})) as f:
+        writer(f)
+    os.replace(tmp, path)
 
-# 获取 input_dir 目录中的所有 CSV 文件
-file_paths = [os.path.join(input_dir, file) for file in os.listdir(input_dir) if file.endswith('.csv')]
 
-# 处理每个文件
-for file_path in file_paths:
-    # 读取CSV文件
+def convert_file(file_path, output_dir=config.time_convert_params['output_dir'],
+                 formats=config.time_convert_params['formats']):
+    '''
+    转换单个文件
+    :return: (源文件路径, 源文件状态（含内容哈希）, 行数)
+    '''
     df = pd.read_csv(file_path)
+    df.drop(columns=['volume'], errors='ignore', inplace=True)  # 与以前一致，不输出 volume 列
+
+    # 时间戳转换为 int64 纳秒（UTC），只做整数运算
+    dt_ns = df['time'].to_numpy(dtype=np.int64) * 10**9
+    csv_path, npz_path = None, None
+    for path in output_paths(file_path, output_dir, formats):
+        if path.endswith('.csv'):
+            csv_path = path
+        else:
+            npz_path = path
+
+    if csv_path is not None:
+        df['time'] = pd.DatetimeIndex(dt_ns.view('datetime64[ns]'))
+        _write_atomic(csv_path, 'w', lambda f: df.to_csv(f, index=False, date_format='%Y/%m/%d %H:%M'))
+
+    if npz_path is not None:
+        columns = {'datetime': dt_ns}
+        for name in COLUMNS[1:]:
+            columns[name] = df[name].to_numpy(dtype=np.float64)
+        # 总行数与同样内容的 CSV 文件一致（含表头）
+        _write_atomic(npz_path, 'wb', lambda f: np.savez(f, total_lines=len(df) + 1, **columns))
+
+    state = _source_state(file_path)
+    state['sha1'] = _file_sha1(file_path)
+    return file_path, state, len(df)
+
+
+def _read_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_unchanged(file_path, entry, output_dir, formats):
+    if entry is None or sorted(entry.get('formats', [])) != sorted(formats):
+        return False
+    if not all(os.path.exists(path) for path in output_paths(file_path, output_dir, formats)):
+        return False
+    state = _source_state(file_path)
+    if state['size'] != entry['size']:
+        return False
+    # 修改时间变了但内容可能没变（例如重新下载了同样的数据），比较内容哈希
+    return state['mtime_ns'] == entry['mtime_ns'] or _file_sha1(file_path) == entry['sha1']
+
 
-    # 将时间列从时间戳转换为UTC的年月日时分格式
-    df['time'] = pd.to_datetime(df['time'], unit='s', utc=True).dt.strftime('%Y/%m/%d %H:%M')
+def convert_all(input_dir=config.time_convert_params['input_dir'],
+                output_dir=config.time_convert_params['output_dir'],
+                formats=config.time_convert_params['formats'],
+                processes=config.time_convert_params['processes'],
+                force=False):
+    '''
+    并行转换 input_dir 中所有有变化的 CSV 文件
+    :param force: 为 True 时忽略上次的转换记录，全部重新转换
+    :return: (转换的文件列表, 跳过的文件列表)
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    file_paths = sorted(os.path.join(input_dir, file) for file in os.listdir(input_dir) if file.endswith('.csv'))
+    manifest = _read_manifest(output_dir)
 
-    # 生成输出文件路径
-    base_name = os.path.basename(file_path)
-    output_path = os.path.join(output_dir, f'{base_name}')
+    pending, skipped = [], []
+    for file_path in file_paths:
+        key = os.path.basename(file_path)
+        if not force and _is_unchanged(file_path, manifest.get(key), output_dir, formats):
+            skipped.append(file_path)
+        else:
+            pending.append(file_path)
 
-    # 保存转换后的结果到新的CSV文件，不包括volume列
-    df.drop(columns=['volume'], errors='ignore', inplace=True)  # 忽略不存在的列
-    df.to_csv(output_path, index=False)
+    converted = []
+    if pending:
+        processes = min(processes or os.cpu_count(), len(pending))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(convert_file, file_path, output_dir, formats) for file_path in pending]
+            for future in futures:
+                file_path, state, rows = future.result()
+                state['formats'] = list(formats)
+                manifest[os.path.basename(file_path)] = state
+                converted.append(file_path)
+                for path in output_paths(file_path, output_dir, formats):
+                    print(f"时间格式转换完成，已保存到 {path}（{rows} 行）")
 
-    # 保存转换后的结果到新的CSV文件
-    df.to_csv(output_path, index=False)
+        # 全部完成后再更新转换记录
+        _write_atomic(os.path.join(output_dir, MANIFEST), 'w', lambda f: json.dump(manifest, f, indent=2))
+    return converted, skipped
 
-    print(f"时间格式转换完成，已保存到 {output_path}")
 
-print("所有文件的时间格式转换完成。")
+if __name__ == '__main__':
+    converted, skipped = convert_all()
+    print(f"所有文件的时间格式转换完成：转换 {len(converted)} 个，未变化跳过 {len(skipped)} 个。")
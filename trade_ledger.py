@@ -0,0 +1,163 @@
+from array import array
+import io
+import math
+import backtrader as bt
+import numpy as np
+import pandas as pd
+from my_data import num_to_datetime
+
+'''
+交易台账
+成交记录按列保存在紧凑数组中（而不是每笔一个字典），按成交日期和订单编号建立索引，
+平仓时可以直接定位对应的成交记录；导出时整列批量写入 CSV 或二进制列式文件（.npz）
+'''
+
+# 附加信息列（AR_Strategy 下单时通过 order.addinfo 写入），没有时为 NaN
+INFO_FIELDS = ('x', 'ema200', 'atr', 'y', 'target_position', 'current_position')
+FLOAT_FIELDS = ('date', 'price', 'size', 'value', 'pnl') + INFO_FIELDS
+
+# 交易记录 CSV 的列：(表头, 字段)
+BASIC_CSV_FIELDS = [('Date', 'date'), ('IsBuy', 'isbuy'), ('Price', 'price'), ('Size', 'size'),
+                    ('Value', 'value'), ('PnL', 'pnl'), ('Closed', 'closed')]
+INFO_CSV_FIELDS = BASIC_CSV_FIELDS[:-1] + [('x', 'x'), ('ema200', 'ema200'), ('atr', 'atr'), ('y', 'y'),
+                                           ('TargetPosition', 'target_position'),
+                                           ('CurrentPosition', 'current_position'), ('Closed', 'closed')]
+
+
+class TradeLedger(object):
+    def __init__(self):
+        self._floats = {name: array('d') for name in FLOAT_FIELDS}  # date 为 backtrader 日期数值
+        self._isbuy = array('b')
+        self._closed = array('b')
+        self._ref = array('q')
+        self._by_date = {}  # 成交日期 -> 该日期的第一笔成交所在行
+        self._by_ref = {}  # 订单编号 -> 行
+
+    def __len__(self):
+        return len(self._isbuy)
+
+    def append(self, date, price, size, value, pnl, isbuy, ref=-1, info=None):
+        '''
+        记录一笔成交，返回所在行
+        :param date: backtrader 日期数值
+        :param info: 附加信息字典（INFO_FIELDS 中的字段），None 值记为 NaN
+        '''
+        row = len(self._isbuy)
+        floats = self._floats
+        floats['date'].append(date)
+        floats['price'].append(price)
+        floats['size'].append(size)
+        floats['value'].append(value)
+        floats['pnl'].append(pnl)
+        for name in INFO_FIELDS:
+            value = info.get(name) if info else None
+            floats[name].append(math.nan if value is None else value)
+        self._isbuy.append(bool(isbuy))
+        self._closed.append(False)
+        self._ref.append(ref)
+
+        self._by_date.setdefault(date, row)
+        if ref >= 0:
+            self._by_ref[ref] = row
+        return row
+
+    def row_by_ref(self, ref):
+        return self._by_ref.get(ref)
+
+    def row_by_date(self, date):
+        return self._by_date.get(date)
+
+    def mark_closed(self, date, pnl):
+        # 把 date 当天的成交标记为平仓并记录该笔交易的盈亏，返回所在行（找不到时为 None）
+        row = self._by_date.get(date)
+        if row is not None:
+            self._closed[row] = True
+            self._floats['pnl'][row] = pnl
+        return row
+
+    def columns(self):
+        # 以 numpy 数组返回所有列（不复制底层缓冲区），date 转换为 datetime64[ns]
+        columns = {name: np.frombuffer(values, dtype=np.float64) if len(values) else np.empty(0)
+                   for name, values in self._floats.items()}
+        columns['date'] = num_to_datetime(columns['date'])
+        columns['isbuy'] = np.frombuffer(self._isbuy, dtype=np.int8).astype(bool) if len(self) else np.empty(0, dtype=bool)
+        columns['closed'] = np.frombuffer(self._closed, dtype=np.int8).astype(bool) if len(self) else np.empty(0, dtype=bool)
+        columns['ref'] = np.frombuffer(self._ref, dtype=np.int64) if len(self) else np.empty(0, dtype=np.int64)
+        return columns
+
+    def to_dataframe(self):
+        columns = self.columns()
+        return pd.DataFrame({name: columns[name] for name in ('date', 'isbuy', 'price', 'size', 'value', 'pnl')
+                             + INFO_FIELDS + ('closed', 'ref')})
+
+    def to_records(self):
+        # 与 LongTermTradeAnalyzer 以前的格式兼容：每笔成交一个字典
+        records = []
+        floats = self._floats
+        for row in range(len(self)):
+            record = {
+                'date': bt.num2date(floats['date'][row]),
+                'price': floats['price'][row],
+                'size': floats['size'][row],
+                'value': floats['value'][row],
+                'pnl': floats['pnl'][row],
+                'isbuy': bool(self._isbuy[row]),
+                'closed': bool(self._closed[row])
+            }
+            for name in INFO_FIELDS:
+                value = floats[name][row]
+                record[name] = None if math.isnan(value) else value
+            records.append(record)
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        ledger = cls()
+        for record in records:
+            row = ledger.append(bt.date2num(record['date']), record['price'], record['size'], record['value'],
+                                record['pnl'], record['isbuy'], info=record)
+            ledger._closed[row] = bool(record.get('closed', False))
+        return ledger
+
+    def to_csv(self, path, fields=BASIC_CSV_FIELDS, int_size=False):
+        # 整列批量写入，缺失的附加信息写为 None（与以前逐行写入的文件一致）
+        # int_size 由调用方按策略指定：按整数股下单的策略（BuyAndHold）数量写为整数，其他策略总是写为浮点数
+        df = self.to_dataframe()
+        if int_size:
+            df['size'] = df['size'].round().astype(np.int64)
+        df = df[[field for _, field in fields]]
+        df.columns = [header for header, _ in fields]
+        df.to_csv(path, index=False, na_rep='None')
+
+    def to_npz(self, path):
+        # 二进制列式导出，date 保存为 int64 纳秒
+        columns = self.columns()
+        columns['date'] = columns['date'].view(np.int64)
+        np.savez(path, **columns)
+
+    def to_bytes(self):
+        # 无损序列化（date 保留 backtrader 日期数值），供结果库（result_store）保存
+        buffer = io.BytesIO()
+        arrays = {name: np.frombuffer(values, dtype=np.float64) for name, values in self._floats.items() if len(values)}
+        if len(self):
+            arrays.update(isbuy=np.frombuffer(self._isbuy, dtype=np.int8), closed=np.frombuffer(self._closed, dtype=np.int8),
+                          ref=np.frombuffer(self._ref, dtype=np.int64))
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        ledger = cls()
+        with np.load(io.BytesIO(data)) as arrays:
+            if 'isbuy' not in arrays:
+                return ledger
+            for name in FLOAT_FIELDS:
+                ledger._floats[name].frombytes(arrays[name].tobytes())
+            ledger._isbuy.frombytes(arrays['isbuy'].tobytes())
+            ledger._closed.frombytes(arrays['closed'].tobytes())
+            ledger._ref.frombytes(arrays['ref'].tobytes())
+        for row, date in enumerate(ledger._floats['date']):
+            ledger._by_date.setdefault(date, row)
+            if ledger._ref[row] >= 0:
+                ledger._by_ref[ledger._ref[row]] = row
+        return ledger
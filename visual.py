@@ -1,23 +1,109 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import config
 import os
 
+'''
+绘图
+净值曲线先用 LTTB（Largest-Triangle-Three-Buckets）降采样到 config.plot_params['max_points'] 个点再绘制，
+保留曲线的峰谷形状，百万根 bar 的回测也能很快生成、打开 HTML
+买卖点取自交易台账（TradeLedger），标在成交时刻的净值上
+'''
+
 # 确保结果目录存在
 output_dir = 'data'
 if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
-def plot_results(data, name, strategy_name):
+def lttb(x, y, threshold):
+    '''
+    LTTB 降采样
+    :param x: 递增的横坐标（数值）
+    :param y: 纵坐标
+    :param threshold: 保留的点数（含首尾两点）
+    :return: 保留的下标数组
+    '''
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # 首尾两点固定，中间 n - 2 个点平均分成 threshold - 2 个桶
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+
+    prev = 0
+    for b in range(threshold - 2):
+        start, end = edges[b], edges[b + 1]
+        # 下一个桶的平均点（最后一个桶用末点）
+        if b + 2 < len(edges):
+            next_x = x[end:edges[b + 2]].mean()
+            next_y = y[end:edges[b + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # 与上一个选中点、下一个桶平均点构成的三角形面积最大的点
+        area = np.abs((x[prev] - next_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (next_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        indices[b + 1] = prev
+    return indices
+
+
+def downsample(dates, values, max_points=config.plot_params['max_points']):
+    # 对净值曲线做 LTTB 降采样，返回 (日期, 净值)
+    dates = pd.to_datetime(dates).values
+    values = np.asarray(values, dtype=np.float64)
+    indices = lttb(dates.view(np.int64), values, max_points)
+    return dates[indices], values[indices]
+
+
+def trade_markers(ledger, dates, values):
+    '''
+    从交易台账得到买卖点，纵坐标为成交时刻的净值（按完整分辨率的净值曲线插值）
+    :return: {'buy': (日期, 净值, 提示文字), 'sell': (...)}
+    '''
+    columns = ledger.columns()
+    trade_dates = columns['date']
+    x = pd.to_datetime(dates).values.view(np.int64).astype(np.float64)
+    y = np.interp(trade_dates.view(np.int64).astype(np.float64), x, np.asarray(values, dtype=np.float64))
+    markers = {}
+    for side, mask in (('buy', columns['isbuy']), ('sell', ~columns['isbuy'])):
+        text = [f'价格 {price:.2f}，数量 {size:.4f}' for price, size in zip(columns['price'][mask], columns['size'][mask])]
+        markers[side] = (trade_dates[mask], y[mask], text)
+    return markers
+
+
+def plot_results(data, name, strategy_name, ledger=None, benchmark=None, benchmark_name='BuyAndHold',
+                 max_points=config.plot_params['max_points']):
     """
     使用 Plotly 绘制策略结果
     :param data: 包含日期和净值的 DataFrame
     :param name: 数据集名称
     :param strategy_name: 策略名称
+    :param ledger: 交易台账，传入时标出买卖点
+    :param benchmark: 基准策略的日期和净值 DataFrame（格式同 data），传入时一起绘制用于比较
+    :param max_points: 每条曲线降采样后的最多点数
     """
     fig = go.Figure()
 
     # 添加策略收益率
-    fig.add_trace(go.Scatter(x=data['date'], y=data['net_value'], mode='lines', name='净值'))
+    dates, values = downsample(data['date'], data['net_value'], max_points)
+    fig.add_trace(go.Scatter(x=dates, y=values, mode='lines', name=f'{strategy_name} 净值'))
+
+    if benchmark is not None:
+        dates, values = downsample(benchmark['date'], benchmark['net_value'], max_points)
+        fig.add_trace(go.Scatter(x=dates, y=values, mode='lines', name=f'{benchmark_name} 净值'))
+
+    if ledger is not None and len(ledger):
+        markers = trade_markers(ledger, data['date'], data['net_value'])
+        for side, label, symbol, color in (('buy', '买入', 'triangle-up', 'green'), ('sell', '卖出', 'triangle-down', 'red')):
+            marker_dates, marker_values, text = markers[side]
+            fig.add_trace(go.Scatter(x=marker_dates, y=marker_values, mode='markers', name=label, text=text,
+                                     marker=dict(symbol=symbol, color=color, size=8)))
 
     # 更新布局
     fig.update_layout(
@@ -28,5 +114,21 @@ def plot_results(data, name, strategy_name):
     )
 
     # 输出为 HTML 文件
-    fig.write_html(os.path.join(output_dir, f'{name}_{strategy_name}_plot.html'))
-    print(f'图表已保存到 {os.path.join(output_dir, f"{name}_{strategy_name}_plot.html")}')
+    file_path = os.path.join(output_dir, f'{name}_{strategy_name}_plot.html')
+    fig.write_html(file_path, include_plotlyjs=config.plot_params['include_plotlyjs'])
+    print(f'图表已保存到 {file_path}')
+    return file_path
+
+
+if __name__ == '__main__':
+    import time
+
+    # 百万根 bar 的合成净值曲线，检查绘图耗时和 HTML 大小
+    bars = 1000000
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(end=config.backtest_params['end_date'], periods=bars, freq='1min')
+    strategy = pd.DataFrame({'date': dates, 'net_value': 1e6 * np.exp(np.cumsum(rng.normal(0, 2e-4, bars)))})
+    benchmark = pd.DataFrame({'date': dates, 'net_value': 1e6 * np.exp(np.cumsum(rng.normal(0, 2e-4, bars)))})
+    start = time.time()
+    file_path = plot_results(strategy, 'synthetic', 'random_walk', benchmark=benchmark)
+    print(f'{bars} 根 bar：用时 {time.time() - start:.2f} 秒，HTML {os.path.getsize(file_path) / 1024:.0f} KB')
@@ -0,0 +1,215 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from texttable import Texttable
+import config
+import shared_data
+from data_cache import load_data_file
+from optimizer import METRICS, param_grid
+
+'''
+滚动前推（walk-forward）优化
+把每个数据文件的历史切成滚动的 训练窗口 + 紧随其后的测试窗口，
+在训练窗口上对 config.sweep_params 的参数网格做优化，选出的参数在测试窗口上评估（样本外）
+每个窗口是进程池中的一个任务；每个进程中数据文件只读取一次，各窗口用 searchsorted 切片（视图，不复制），
+不再按不同的 fromdate/todate 重新解析；开启 config.shared_data_params 时数据文件只在主进程读取一次，放入共享内存供各进程使用
+'''
+
+output_dir = 'data'
+if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+# 每个工作进程内缓存已读取的数据文件
+_loaded_data = {}
+
+
+def rolling_windows(first_dt, last_dt, train_months=config.walk_forward_params['train_months'],
+                    test_months=config.walk_forward_params['test_months'],
+                    step_months=config.walk_forward_params['step_months']):
+    '''
+    生成滚动窗口，窗口均为左闭右开区间
+    :param first_dt: 数据的第一根 bar 时间
+    :param last_dt: 数据的最后一根 bar 时间，测试窗口不超出数据范围
+    :param step_months: 相邻窗口的间隔，None 表示等于 test_months（测试窗口首尾相接）
+    :return: [(训练开始, 训练结束, 测试开始, 测试结束)]，均为 pd.Timestamp
+    '''
+    step = pd.DateOffset(months=step_months or test_months)
+    train = pd.DateOffset(months=train_months)
+    test = pd.DateOffset(months=test_months)
+
+    windows = []
+    start = pd.Timestamp(first_dt).normalize()
+    last_dt = pd.Timestamp(last_dt)
+    while start + train + test <= last_dt + pd.Timedelta(days=1):
+        windows.append((start, start + train, start + train, start + train + test))
+        start += step
+    return windows
+
+
+def _load(data_file):
+    if data_file not in _loaded_data:
+        shared = shared_data.get(data_file)
+        _loaded_data[data_file] = shared if shared is not None else load_data_file(data_file)
+    return _loaded_data[data_file]
+
+
+def _slice(columns, start, end):
+    # 截取 [start, end) 区间的 bar，返回切片视图
+    dt = columns['datetime']
+    lo = np.searchsorted(dt, start.as_unit('ns').value, side='left')
+    hi = np.searchsorted(dt, end.as_unit('ns').value, side='left')
+    return {key: values[lo:hi] for key, values in columns.items()}
+
+
+def _evaluate_fast(name, columns, params):
+    import fast_engine
+
+    # 与 fast_engine.load_arrays 一致：成交量为 NaN
+    data = {
+        'datetime': columns['datetime'].view('datetime64[ns]'),
+        'open': columns['open'],
+        'high': columns['high'],
+        'low': columns['low'],
+        'close': columns['close'],
+        'volume': np.full(len(columns['close']), np.nan)
+    }
+    result = fast_engine.run_vad(data, **params)
+    metrics = fast_engine.analyze_values(result['values'], data['datetime'], result['start_value'])
+    metrics['trade_count'] = result['buy_count'] + result['sell_count']
+    return metrics
+
+
+def _evaluate_backtrader(name, columns, params):
+    from main import run_strategy, collect_metrics
+    from strategy import VADStrategy
+
+    results = run_strategy(VADStrategy, columns, None, name, printlog=False, **params)
+    return collect_metrics(results[0])
+
+
+def _better(metrics, best, sort_by):
+    # 最大回撤越小越好，其他指标越大越好；NaN 不会被选中
+    value = metrics[sort_by]
+    if value is None or value != value:
+        return False
+    if best is None:
+        return True
+    return value < best[sort_by] if sort_by == 'max_drawdown' else value > best[sort_by]
+
+
+def _run_window(job):
+    # 进程池中执行的单个窗口：训练窗口上选参数，测试窗口上评估
+    engine, name, data_file, window, grid, sort_by = job
+    columns, _ = _load(data_file)
+    train = _slice(columns, window[0], window[1])
+    test = _slice(columns, window[2], window[3])
+    evaluate = _evaluate_fast if engine == 'fast' else _evaluate_backtrader
+
+    best_params, best_metrics = None, None
+    for params in param_grid(grid):
+        metrics = evaluate(name, train, params)
+        if _better(metrics, best_metrics, sort_by):
+            best_params, best_metrics = params, metrics
+    if best_params is None:
+        # 训练窗口上全部为 NaN 时使用默认参数
+        best_params = {key: config.vad_strategy_params[key] for key in grid if key in config.vad_strategy_params}
+        best_metrics = evaluate(name, train, best_params)
+    test_metrics = evaluate(name, test, best_params)
+
+    row = {
+        'data': name,
+        'train_start': window[0].strftime('%Y-%m-%d'),
+        'train_end': window[1].strftime('%Y-%m-%d'),
+        'test_start': window[2].strftime('%Y-%m-%d'),
+        'test_end': window[3].strftime('%Y-%m-%d'),
+        'train_bars': len(train['close']),
+        'test_bars': len(test['close'])
+    }
+    row.update(best_params)
+    row.update({f'train_{key}': best_metrics[key] for key in METRICS})
+    row.update({f'test_{key}': test_metrics[key] for key in METRICS})
+    row['test_trade_count'] = test_metrics['trade_count']
+    return row
+
+
+def run_walk_forward(grid=config.sweep_params, data_files=config.data_files,
+                     engine=config.walk_forward_params['engine'],
+                     processes=config.walk_forward_params['processes'],
+                     sort_by=config.walk_forward_params['sort_by']):
+    '''
+    运行滚动前推优化
+    :param grid: 参数网格，{参数名: [取值...]}，参数名为 VADStrategy 的参数
+    :param data_files: [(名称, 文件路径)]
+    :param engine: 'backtrader' 或 'fast'
+    :param processes: 进程数，None 表示使用全部 CPU 核
+    :param sort_by: 训练窗口上选参数的依据
+    :return: 每个窗口一行的 DataFrame
+    '''
+    jobs = []
+    for name, data_file in data_files:
+        columns, _ = load_data_file(data_file)
+        dt = columns['datetime']
+        if not len(dt):
+            continue
+        for window in rolling_windows(pd.Timestamp(dt[0]), pd.Timestamp(dt[-1])):
+            jobs.append((engine, name, data_file, window, grid, sort_by))
+    if not jobs:
+        return pd.DataFrame()
+
+    processes = min(processes or os.cpu_count(), len(jobs))
+    # 各窗口是数据的切片，与整个文件的指标数组不对齐，只共享列数组
+    with shared_data.process_pool(processes, data_files, indicators=(), loader=load_data_file) as executor:
+        rows = list(executor.map(_run_window, jobs))
+    return pd.DataFrame(rows)
+
+
+def summarize(df):
+    '''
+    每个数据文件汇总样本外表现：测试窗口收益率首尾相接复利得到的总收益率、平均夏普、最大回撤，
+    以及样本外与样本内平均总收益率之比（越接近 1 说明参数越不依赖于训练区间）
+    '''
+    rows = []
+    for name, group in df.groupby('data', sort=False):
+        train_mean = group['train_total_return'].mean()
+        rows.append({
+            'data': name,
+            'windows': len(group),
+            'oos_total_return': float(np.prod(1 + group['test_total_return']) - 1),
+            'oos_mean_sharpe': group['test_sharpe_ratio'].mean(),
+            'oos_max_drawdown': group['test_max_drawdown'].max(),
+            'efficiency': group['test_total_return'].mean() / train_mean if train_mean else float('nan')
+        })
+    return pd.DataFrame(rows)
+
+
+def print_windows(df, grid=config.sweep_params):
+    table = Texttable(max_width=0)
+    header = ['数据', '训练区间', '测试区间'] + list(grid) + ['训练总收益率', '测试总收益率', '测试夏普', '测试最大回撤']
+    rows = [header]
+    for _, row in df.iterrows():
+        rows.append([row['data'], f"{row['train_start']} ~ {row['train_end']}", f"{row['test_start']} ~ {row['test_end']}"]
+                    + [row[key] for key in grid]
+                    + [f"{row['train_total_return'] * 100:.2f}%", f"{row['test_total_return'] * 100:.2f}%",
+                       f"{row['test_sharpe_ratio']:.2f}", f"{row['test_max_drawdown'] * 100:.2f}%"])
+    table.add_rows(rows)
+    print(table.draw())
+
+
+if __name__ == '__main__':
+    start = time.time()
+    df = run_walk_forward()
+    elapsed = time.time() - start
+    if df.empty:
+        print('数据长度不足一个 训练 + 测试 窗口，请调整 config.walk_forward_params')
+    else:
+        print(f'滚动前推优化完成：{len(df)} 个窗口，用时 {elapsed:.1f} 秒')
+        print_windows(df)
+        for _, row in summarize(df).iterrows():
+            print(f"{row['data']}: {row['windows']} 个窗口，样本外复利总收益率 {row['oos_total_return'] * 100:.2f}%，"
+                  f"平均夏普 {row['oos_mean_sharpe']:.2f}，最大回撤 {row['oos_max_drawdown'] * 100:.2f}%，"
+                  f"样本外/样本内收益比 {row['efficiency']:.2f}")
+
+        file_path = os.path.join(output_dir, 'walk_forward_results.csv')
+        df.to_csv(file_path, index=False)
+        print(f'每个窗口的结果已写入 {file_path}')